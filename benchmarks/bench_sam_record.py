@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.9
+
+"""
+Compare the csv.DictReader record parsing evaluate_sam_file used to do against the
+SamRecord tab split parser and the SamBytesRecord parser the memory mapped reader uses,
+on the checked in test alignments.
+"""
+import argparse
+import csv
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from variant_calling.sam_reader import SamBytesRecord, SamRecord  # noqa: E402
+
+DEFAULT_SAM_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "test", "test_sam_file.tsv"
+)
+# The fixed columns the old reader assumed, tags only landed in the right slot when the
+# aligner wrote exactly these in exactly this order
+LEGACY_SAM_HEADER = [
+    "QNAME",
+    "FLAG",
+    "RNAME",
+    "POS",
+    "MAPQ",
+    "CIGAR",
+    "RNEXT",
+    "PNEXT",
+    "TLEN",
+    "SEQ",
+    "QUAL",
+    "NM",
+    "MD",
+    "AS",
+    "XS",
+    "XA",
+]
+
+
+def parse_with_dict_reader(sam_lines):
+    for sam_record in csv.DictReader(
+        sam_lines, delimiter="\t", fieldnames=LEGACY_SAM_HEADER
+    ):
+        sam_record["RNAME"], int(sam_record["POS"]), int(sam_record["FLAG"])
+        sam_record["CIGAR"], sam_record["QUAL"], sam_record["MD"]
+
+
+def parse_with_sam_record(sam_lines):
+    for sam_record in map(SamRecord, sam_lines):
+        sam_record.chrom, sam_record.pos, sam_record.flag
+        sam_record["CIGAR"], sam_record.qual, sam_record.md
+
+
+def parse_with_sam_bytes_record(sam_lines):
+    for sam_record in map(SamBytesRecord, sam_lines):
+        sam_record.chrom, sam_record.pos, sam_record.flag
+        sam_record["CIGAR"], sam_record.qual, sam_record.md
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sam_file", default=DEFAULT_SAM_FILE)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args(args[1:])
+
+    with open(options.sam_file) as in_file:
+        alignment_lines = [
+            line for line in in_file if not line.startswith(("@", "QNAME\t"))
+        ]
+    sam_lines = (alignment_lines * (options.records // len(alignment_lines) + 1))[
+        : options.records
+    ]
+    sam_line_bytes = [line.rstrip("\n").encode() for line in sam_lines]
+    for name, parse, lines in [
+        ("csv.DictReader", parse_with_dict_reader, sam_lines),
+        ("SamRecord", parse_with_sam_record, sam_lines),
+        ("SamBytesRecord", parse_with_sam_bytes_record, sam_line_bytes),
+    ]:
+        seconds = min(
+            timeit.repeat(lambda: parse(lines), number=1, repeat=options.repeat)
+        )
+        print(f"{name:>16}: {len(sam_lines) / seconds:12,.0f} records/sec")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.9
+
+"""
+Compare the MD and cigar tokenizing parse_md_string and parse_cigar_string used to do
+against the precompiled tokenizers, with and without their caches, on the cigars and MD
+strings of the checked in test alignments.
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from variant_calling.sam_reader import SamRecord  # noqa: E402
+from variant_calling.tokenizers import (  # noqa: E402
+    cached_tokenize_cigar,
+    cached_tokenize_md,
+    clear_tokenizer_caches,
+    get_tokenizer_cache_info,
+    tokenize_cigar,
+    tokenize_md,
+)
+
+DEFAULT_SAM_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "test", "test_sam_file.tsv"
+)
+
+
+def legacy_parse_md_string(md_string):
+    parsed_md_list = []
+    for matched_region in re.finditer(r"([0-9]+)([\^A,C,T,G]+)", md_string[5:]):
+        base_count = int(matched_region.group(1))
+        ref_base = matched_region.group(2)
+        parsed_md_list.append((base_count, ref_base))
+    final_base_count = ""
+    char = md_string[-1]
+    count = -1
+    string_numbers = [str(x) for x in range(0, 10)]
+    while char in string_numbers:
+        final_base_count += char
+        count -= 1
+        char = md_string[count]
+    parsed_md_list.append((int(final_base_count), "N"))
+    return parsed_md_list
+
+
+def legacy_parse_cigar_string(cigar_string):
+    parsed_cigar_list = []
+    for matched_region in re.finditer("([0-9]+)([M,I,D,N,S,H,P,=,X])", cigar_string):
+        base_count = int(matched_region.group(1))
+        cigar_op = matched_region.group(2)
+        parsed_cigar_list.append((base_count, cigar_op))
+    return parsed_cigar_list
+
+
+def count_tokens(tokenize, strings):
+    return sum(len(tokenize(string)) for string in strings)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sam_file", default=DEFAULT_SAM_FILE)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args(args[1:])
+
+    with open(options.sam_file) as in_file:
+        sam_records = [
+            SamRecord(line)
+            for line in in_file
+            if not line.startswith(("@", "QNAME\t"))
+        ]
+    repeats = options.records // len(sam_records) + 1
+    md_strings = ([sam_record["MD"] for sam_record in sam_records] * repeats)[
+        : options.records
+    ]
+    cigar_strings = ([sam_record["CIGAR"] for sam_record in sam_records] * repeats)[
+        : options.records
+    ]
+    for field, strings, implementations in [
+        (
+            "MD",
+            md_strings,
+            [
+                ("legacy", legacy_parse_md_string),
+                ("precompiled", tokenize_md),
+                ("cached", cached_tokenize_md),
+            ],
+        ),
+        (
+            "cigar",
+            cigar_strings,
+            [
+                ("legacy", legacy_parse_cigar_string),
+                ("precompiled", tokenize_cigar),
+                ("cached", cached_tokenize_cigar),
+            ],
+        ),
+    ]:
+        token_count = count_tokens(implementations[0][1], strings)
+        for name, tokenize in implementations:
+            assert list(tokenize(strings[0])) == implementations[0][1](strings[0])
+            clear_tokenizer_caches()
+            seconds = min(
+                timeit.repeat(
+                    lambda: count_tokens(tokenize, strings),
+                    number=1,
+                    repeat=options.repeat,
+                )
+            )
+            print(f"{field:>6} {name:>12}: {token_count / seconds:14,.0f} tokens/sec")
+    hits, misses = get_tokenizer_cache_info()["cigar"]
+    print(f"cigar cache hit rate: {hits / (hits + misses):.1%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
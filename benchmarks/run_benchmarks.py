@@ -0,0 +1,191 @@
+#!/usr/bin/env python3.9
+
+"""
+Time the calling pipeline on a synthetic sam file and write a JSON report. Every
+benchmark runs in a fresh process so the peak RSS it reports is its own. Given a
+baseline report the speedup of every benchmark against it is printed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic_sam import (  # noqa: E402
+    add_config_arguments,
+    get_config,
+    write_synthetic_sam,
+)
+
+from variant_calling.sam_reader import (  # noqa: E402
+    SamRecord,
+    iter_sam_lines,
+    read_sam_header,
+)
+from variant_calling.variant_calling import (  # noqa: E402
+    evaluate_sam_file,
+    get_coverage_data_for_one_sam_record,
+    variant_calling_for_one_sam_record,
+)
+
+REPORT_VERSION = 1
+
+
+def read_sam_records(sam_file: str) -> List[SamRecord]:
+    _, alignment_start = read_sam_header(sam_file)
+    sam_lines = iter_sam_lines(sam_file, alignment_start, os.path.getsize(sam_file))
+    return list(map(SamRecord, sam_lines))
+
+
+def time_per_record(
+    per_record: Callable[[Any], Any], sam_file: str
+) -> Tuple[int, float]:
+    """
+    Time a per alignment function over every record, the parsing is not timed.
+    """
+    sam_records = read_sam_records(sam_file)
+    start = time.perf_counter()
+    for sam_record in sam_records:
+        per_record(sam_record)
+    return len(sam_records), time.perf_counter() - start
+
+
+def bench_evaluate_sam_file(sam_file: str, workers: int) -> Tuple[int, float]:
+    start = time.perf_counter()
+    evaluate_sam_file(sam_file, workers)
+    seconds = time.perf_counter() - start
+    return len(read_sam_records(sam_file)), seconds
+
+
+def bench_get_coverage_data(sam_file: str, workers: int) -> Tuple[int, float]:
+    return time_per_record(get_coverage_data_for_one_sam_record, sam_file)
+
+
+def bench_variant_calling(sam_file: str, workers: int) -> Tuple[int, float]:
+    return time_per_record(variant_calling_for_one_sam_record, sam_file)
+
+
+BENCHMARKS: Dict[str, Callable[[str, int], Tuple[int, float]]] = {
+    "evaluate_sam_file": bench_evaluate_sam_file,
+    "get_coverage_data_for_one_sam_record": bench_get_coverage_data,
+    "variant_calling_for_one_sam_record": bench_variant_calling,
+}
+
+
+def get_peak_rss_kb() -> int:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macos and in kilobytes elsewhere
+    return peak_rss // 1024 if sys.platform == "darwin" else peak_rss
+
+
+def run_benchmark(name: str, sam_file: str, workers: int) -> Dict[str, Any]:
+    record_count, seconds = BENCHMARKS[name](sam_file, workers)
+    return {
+        "seconds": seconds,
+        "records": record_count,
+        "records_per_second": record_count / seconds if seconds else None,
+        "peak_rss_kb": get_peak_rss_kb(),
+    }
+
+
+def run_benchmarks(
+    sam_file: str, names: List[str], workers: int, repeat: int
+) -> Dict[str, Any]:
+    """
+    Run every benchmark repeat times in fresh processes, keep the fastest run and the
+    largest peak RSS.
+    """
+    results: Dict[str, Any] = {}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(run_benchmark, (name, sam_file, workers)))
+        fastest_run = min(runs, key=lambda run: run["seconds"])
+        results[name] = {
+            **fastest_run,
+            "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+            "all_seconds": [run["seconds"] for run in runs],
+        }
+    return results
+
+
+def print_comparison(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]):
+    for name, result in results.items():
+        line = (
+            f"{name:>38}: {result['seconds']:9.3f} sec "
+            f"{result['records_per_second']:12,.0f} records/sec "
+            f"{result['peak_rss_kb'] / 1024:8.1f} MB"
+        )
+        baseline_result = (baseline or {}).get("benchmarks", {}).get(name)
+        if baseline_result:
+            line += f"  {baseline_result['seconds'] / result['seconds']:6.2f}x"
+        print(line)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--report", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="A JSON report to compare against")
+    parser.add_argument(
+        "--sam_file", help="Benchmark this file rather than a synthetic one"
+    )
+    parser.add_argument(
+        "--benchmark",
+        dest="benchmarks",
+        choices=list(BENCHMARKS),
+        action="append",
+        help="Only run this benchmark, may be repeated",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    add_config_arguments(parser)
+    options = parser.parse_args(args[1:])
+    config = get_config(options)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sam_file = options.sam_file
+        if sam_file is None:
+            sam_file = os.path.join(temp_dir, "synthetic.sam")
+            write_synthetic_sam(sam_file, config)
+        results = run_benchmarks(
+            sam_file,
+            options.benchmarks or list(BENCHMARKS),
+            options.workers,
+            options.repeat,
+        )
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "input": options.sam_file or asdict(config),
+        "workers": options.workers,
+        "benchmarks": results,
+    }
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as in_file:
+            baseline = json.load(in_file)
+    print_comparison(results, baseline)
+    if options.report:
+        with open(options.report, "w") as out_file:
+            json.dump(report, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
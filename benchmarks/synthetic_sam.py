@@ -0,0 +1,177 @@
+#!/usr/bin/env python3.9
+
+"""
+Write a synthetic, reproducible sam file for benchmarking. The size, read length,
+strand mix, cigar complexity and variant density are configurable, the same seed always
+gives the same file.
+"""
+import argparse
+import random
+import sys
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+
+BASES = "ACGT"
+# Quality characters, most bases pass the coverage and variant thresholds
+PASSING_QUALS = "?@ABCDEFGHIJ"
+FAILING_QUALS = "#$%&'()*+,-./"
+
+
+@dataclass
+class SyntheticSamConfig:
+    reads: int = 100000
+    read_length: int = 150
+    # Share of the reads on the reverse strand
+    reverse_fraction: float = 0.5
+    # Share of the reads with a soft clip, an insertion or a deletion in their cigar
+    cigar_complexity: float = 0.1
+    # Mismatches per aligned base
+    variant_density: float = 0.005
+    # Share of the bases below the quality thresholds
+    low_quality_fraction: float = 0.02
+    chroms: int = 2
+    chrom_length: int = 10000000
+    coordinate_sorted: bool = True
+    seed: int = 42
+
+
+def make_cigar(
+    rng: random.Random, config: SyntheticSamConfig
+) -> List[Tuple[int, str]]:
+    """
+    A plain full length match, or with cigar_complexity odds a soft clip, an insertion
+    or a deletion somewhere along the read.
+    """
+    read_length = config.read_length
+    if rng.random() >= config.cigar_complexity:
+        return [(read_length, "M")]
+    event = rng.choice("SID")
+    event_length = rng.randint(1, 5)
+    split = rng.randint(10, read_length - 10 - event_length)
+    if event == "S":
+        return [(event_length, "S"), (read_length - event_length, "M")]
+    if event == "I":
+        return [
+            (split, "M"),
+            (event_length, "I"),
+            (read_length - split - event_length, "M"),
+        ]
+    return [(split, "M"), (event_length, "D"), (read_length - split, "M")]
+
+
+def make_md(
+    rng: random.Random, cigar: List[Tuple[int, str]], density: float
+) -> Tuple[str, List[int]]:
+    """
+    An MD string for the cigar with mismatches at the given density, along with the
+    read offsets of the mismatches.
+    """
+    md_parts: List[str] = []
+    mismatch_offsets: List[int] = []
+    matches = 0
+    read_offset = 0
+    for base_count, cigar_op in cigar:
+        if cigar_op in "SI":
+            read_offset += base_count
+        elif cigar_op == "D":
+            md_parts.append(f"{matches}^{''.join(rng.choices(BASES, k=base_count))}")
+            matches = 0
+        else:
+            for _ in range(base_count):
+                if rng.random() < density:
+                    md_parts.append(f"{matches}{rng.choice(BASES)}")
+                    mismatch_offsets.append(read_offset)
+                    matches = 0
+                else:
+                    matches += 1
+                read_offset += 1
+    md_parts.append(str(matches))
+    return "MD:Z:" + "".join(md_parts), mismatch_offsets
+
+
+def make_sam_line(
+    rng: random.Random,
+    config: SyntheticSamConfig,
+    read_index: int,
+    chrom: str,
+    pos: int,
+) -> str:
+    cigar = make_cigar(rng, config)
+    md, mismatch_offsets = make_md(rng, cigar, config.variant_density)
+    seq = "".join(rng.choices(BASES, k=config.read_length))
+    qual = "".join(
+        rng.choice(FAILING_QUALS)
+        if rng.random() < config.low_quality_fraction
+        else rng.choice(PASSING_QUALS)
+        for _ in range(config.read_length)
+    )
+    flag = 16 if rng.random() < config.reverse_fraction else 0
+    cigar_string = "".join(f"{count}{op}" for count, op in cigar)
+    return "\t".join(
+        [
+            f"synthetic.{read_index}",
+            str(flag),
+            chrom,
+            str(pos),
+            "60",
+            cigar_string,
+            "*",
+            "0",
+            "0",
+            seq,
+            qual,
+            f"NM:i:{len(mismatch_offsets)}",
+            md,
+        ]
+    )
+
+
+def write_synthetic_sam(sam_file: str, config: SyntheticSamConfig):
+    rng = random.Random(config.seed)
+    chroms = [f"chr{chrom_index + 1}" for chrom_index in range(config.chroms)]
+    # Leave room before the first position, reverse strand reads walk backwards
+    alignments = [
+        (rng.randrange(len(chroms)), rng.randint(1000, config.chrom_length - 1000))
+        for _ in range(config.reads)
+    ]
+    if config.coordinate_sorted:
+        alignments.sort()
+    with open(sam_file, "w") as out_file:
+        sort_order = "coordinate" if config.coordinate_sorted else "unsorted"
+        out_file.write(f"@HD\tVN:1.6\tSO:{sort_order}\n")
+        for chrom in chroms:
+            out_file.write(f"@SQ\tSN:{chrom}\tLN:{config.chrom_length}\n")
+        for read_index, (chrom_index, pos) in enumerate(alignments):
+            out_file.write(
+                make_sam_line(rng, config, read_index, chroms[chrom_index], pos) + "\n"
+            )
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    for name, default in asdict(SyntheticSamConfig()).items():
+        if isinstance(default, bool):
+            parser.add_argument(
+                f"--{name}",
+                type=lambda value: value.lower() in ("1", "true", "yes"),
+                default=default,
+            )
+        else:
+            parser.add_argument(f"--{name}", type=type(default), default=default)
+
+
+def get_config(options: argparse.Namespace) -> SyntheticSamConfig:
+    return SyntheticSamConfig(
+        **{name: getattr(options, name) for name in asdict(SyntheticSamConfig())}
+    )
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("sam_file")
+    add_config_arguments(parser)
+    options = parser.parse_args(args[1:])
+    write_synthetic_sam(options.sam_file, get_config(options))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -4,10 +4,27 @@
 Toolkit entry point for variant calling.
 """
 import argparse
+import logging
 import os
 import sys
 
-from variant_calling import call_variants_on_sam_file
+# Run as a directory ('python src/variant_calling') the package dir is first on the
+# path, swap in its parent so the package and its relative imports resolve
+if __package__ in (None, ""):
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.path[0]))
+
+from variant_calling.batch import call_variants_on_batch, read_manifest  # noqa: E402
+from variant_calling.instrumentation import profiled  # noqa: E402
+from variant_calling.read_filters import ReadFilter, parse_flag_mask  # noqa: E402
+from variant_calling.regions import (  # noqa: E402
+    RegionSet,
+    parse_region_string,
+    read_bed_regions,
+)
+from variant_calling.variant_calling import (  # noqa: E402
+    call_variants_on_sam_file,
+    merge_partial_files,
+)
 
 
 def parseArgs(args): 
@@ -17,7 +34,7 @@ def parseArgs(args):
     """
     parser = argparse.ArgumentParser(description = __doc__)
     parser.add_argument("sam_file",
-                        help = " The input sam file",
+                        help = " The input sam or bam file",
                         action = "store")
     parser.add_argument("out_variant_file",
                         help = " The output variant file",
@@ -29,14 +46,234 @@ def parseArgs(args):
                         help = " The verbosity level for stdout messages (default INFO)",
                         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
                         action = "store")
-    parser.set_defaults(verbose = "INFO")
+    parser.add_argument("--workers",
+                        help = " The number of processes the sam file is split across (default 1)",
+                        type = int,
+                        action = "store")
+    parser.add_argument("--region",
+                        help = " Only call in this region, eg chr19:71000-80000, may be repeated",
+                        dest = "regions",
+                        action = "append")
+    parser.add_argument("--regions_file",
+                        help = " Only call in the regions of this BED file",
+                        action = "store")
+    parser.add_argument("--streaming",
+                        help = " Write positions as the alignments pass them, the input must be coordinate sorted",
+                        action = "store_true")
+    parser.add_argument("--pipelined",
+                        help = " Read sam input in a thread and parse and call its blocks on the workers, queue depths are logged",
+                        action = "store_true")
+    parser.add_argument("--shared_memory",
+                        help = " Add the read depths of all workers to one set of shared arrays sized by the @SQ lengths, the sam input must be coordinate sorted",
+                        action = "store_true")
+    parser.add_argument("--partial_file",
+                        help = " Also write the results as a binary partial for the merge subcommand",
+                        action = "store")
+    parser.add_argument("--result_store",
+                        help = " Add the counts to the totals kept in this partial file and write those, an input already applied is not counted again",
+                        action = "store")
+    parser.add_argument("--cache_dir",
+                        help = " Reuse the outputs of an earlier run on the same input with the same parameters from this directory, and keep these ones there",
+                        action = "store")
+    parser.add_argument("--cache_max_gb",
+                        help = " Evict the least recently used outputs once the cache directory grows past this many GiB (default 10)",
+                        type = float,
+                        action = "store")
+    parser.add_argument("--checkpoint_file",
+                        help = " Write checkpoints of the running totals to this file so a killed run can be resumed, it is removed at the end",
+                        action = "store")
+    parser.add_argument("--checkpoint_interval",
+                        help = " Seconds between checkpoints at the least (default 300)",
+                        type = float,
+                        action = "store")
+    parser.add_argument("--resume",
+                        help = " Pick up from the checkpoint file an earlier run left, or start over without one. Checkpoints are pickles, only resume from ones this tool wrote",
+                        action = "store_true")
+    parser.add_argument("--require_flags",
+                        help = " Only evaluate alignments with all of these FLAG bits set, a number or names such as PAIRED,PROPER_PAIR",
+                        type = parse_flag_mask,
+                        action = "store")
+    parser.add_argument("--exclude_flags",
+                        help = " Skip alignments with any of these FLAG bits set, a number or names such as UNMAP,SECONDARY,QCFAIL,DUP,SUPPLEMENTARY",
+                        type = parse_flag_mask,
+                        action = "store")
+    parser.add_argument("--min_mapq",
+                        help = " Skip alignments with a lower mapping quality (default 0)",
+                        type = int,
+                        action = "store")
+    parser.add_argument("--coverage_format",
+                        help = " One line per position, or bedGraph runs of equal depth (default positions)",
+                        choices = ["positions", "bedgraph"],
+                        action = "store")
+    parser.add_argument("--compress",
+                        help = " BGZF compress the outputs, a bedGraph coverage file is tabix indexed too",
+                        action = "store_true")
+    parser.add_argument("--base_count_file",
+                        help = " Also write the A/C/G/T/N counts of the quality passing bases at every covered position here",
+                        action = "store")
+    parser.add_argument("--profile",
+                        help = " Run under cProfile and write the pstats to this file",
+                        action = "store")
+    parser.set_defaults(verbose = "INFO", workers = 1, regions = [], coverage_format = "positions",
+                        checkpoint_interval = 300.0, cache_max_gb = 10.0, require_flags = 0, exclude_flags = 0,
+                        min_mapq = 0)
     options = parser.parse_args()
     return options
 
 
+def parseBatchArgs(args):
+    """
+    Parse the arguments of the 'batch' subcommand, which calls every sample of a manifest
+    on one pool of worker processes.
+    """
+    parser = argparse.ArgumentParser(prog = "variant_calling batch", description = parseBatchArgs.__doc__)
+    parser.add_argument("manifest",
+                        help = " One sample per line, 'name<tab>path' or a path to a sam or bam file",
+                        action = "store")
+    parser.add_argument("--out_dir",
+                        help = " Write the variant and coverage files of every sample here",
+                        action = "store")
+    parser.add_argument("--matrix_file",
+                        help = " Write the read depth of every variant in every sample to this file",
+                        action = "store")
+    parser.add_argument("--verbose",
+                        help = " The verbosity level for stdout messages (default INFO)",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        action = "store")
+    parser.add_argument("--workers",
+                        help = " The number of processes the samples are spread across (default 1)",
+                        type = int,
+                        action = "store")
+    parser.add_argument("--region",
+                        help = " Only call in this region, eg chr19:71000-80000, may be repeated",
+                        dest = "regions",
+                        action = "append")
+    parser.add_argument("--regions_file",
+                        help = " Only call in the regions of this BED file",
+                        action = "store")
+    parser.add_argument("--require_flags",
+                        help = " Only evaluate alignments with all of these FLAG bits set, a number or names such as PAIRED,PROPER_PAIR",
+                        type = parse_flag_mask,
+                        action = "store")
+    parser.add_argument("--exclude_flags",
+                        help = " Skip alignments with any of these FLAG bits set, a number or names such as UNMAP,SECONDARY,QCFAIL,DUP,SUPPLEMENTARY",
+                        type = parse_flag_mask,
+                        action = "store")
+    parser.add_argument("--min_mapq",
+                        help = " Skip alignments with a lower mapping quality (default 0)",
+                        type = int,
+                        action = "store")
+    parser.add_argument("--coverage_format",
+                        help = " One line per position, or bedGraph runs of equal depth (default positions)",
+                        choices = ["positions", "bedgraph"],
+                        action = "store")
+    parser.add_argument("--compress",
+                        help = " BGZF compress the outputs, a bedGraph coverage file is tabix indexed too",
+                        action = "store_true")
+    parser.add_argument("--profile",
+                        help = " Run under cProfile and write the pstats to this file",
+                        action = "store")
+    parser.set_defaults(verbose = "INFO", workers = 1, regions = [], coverage_format = "positions",
+                        require_flags = 0, exclude_flags = 0, min_mapq = 0)
+    options = parser.parse_args(args)
+    if options.out_dir is None and options.matrix_file is None:
+        parser.error("give --out_dir, --matrix_file or both")
+    return options
+
+
+def parseMergeArgs(args):
+    """
+    Parse the arguments of the 'merge' subcommand, which merges the partial files of
+    separate runs, such as one per lane, into one variant and one coverage file.
+    """
+    parser = argparse.ArgumentParser(prog = "variant_calling merge", description = parseMergeArgs.__doc__)
+    parser.add_argument("out_variant_file",
+                        help = " The output variant file",
+                        action = "store")
+    parser.add_argument("out_coverage_file",
+                        help = " The output coverage file",
+                        action = "store")
+    parser.add_argument("partial_files",
+                        help = " The partial files written with --partial_file",
+                        nargs = "+",
+                        action = "store")
+    parser.add_argument("--verbose",
+                        help = " The verbosity level for stdout messages (default INFO)",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        action = "store")
+    parser.add_argument("--coverage_format",
+                        help = " One line per position, or bedGraph runs of equal depth (default positions)",
+                        choices = ["positions", "bedgraph"],
+                        action = "store")
+    parser.add_argument("--compress",
+                        help = " BGZF compress the outputs, a bedGraph coverage file is tabix indexed too",
+                        action = "store_true")
+    parser.add_argument("--profile",
+                        help = " Run under cProfile and write the pstats to this file",
+                        action = "store")
+    parser.set_defaults(verbose = "INFO", coverage_format = "positions")
+    return parser.parse_args(args)
+
+
+def get_regions(options):
+    """
+    Gather the --region and --regions_file regions, None when neither is given.
+    """
+    regions = [parse_region_string(region) for region in options.regions]
+    if options.regions_file:
+        regions += read_bed_regions(options.regions_file)
+    return RegionSet(regions) if regions else None
+
+
+def get_read_filter(options):
+    """
+    Gather the FLAG and MAPQ filters, None when none is given.
+    """
+    read_filter = ReadFilter(options.require_flags, options.exclude_flags, options.min_mapq)
+    return read_filter if read_filter != ReadFilter() else None
+
+
+def main_batch(args):
+    options = parseBatchArgs(args[2:])
+    logging.basicConfig(level = options.verbose,
+                        format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with profiled(options.profile):
+        call_variants_on_batch(read_manifest(options.manifest), options.out_dir, options.matrix_file,
+                               workers = options.workers, regions = get_regions(options),
+                               coverage_format = options.coverage_format, compress = options.compress,
+                               read_filter = get_read_filter(options))
+
+
+def main_merge(args):
+    options = parseMergeArgs(args[2:])
+    logging.basicConfig(level = options.verbose,
+                        format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with profiled(options.profile):
+        merge_partial_files(options.partial_files, options.out_variant_file, options.out_coverage_file,
+                            coverage_format = options.coverage_format, compress = options.compress)
+
+
+# Subcommands are dispatched on the first argument, anything else is a single sample run
+SUBCOMMANDS = {"batch": main_batch, "merge": main_merge}
+
+
 def main(args):
+    if len(args) > 1 and args[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[args[1]](args)
     options = parseArgs(args)
-    call_variants_on_sam_file(options.sam_file, options.out_variant_file, options.out_coverage_file)
+    logging.basicConfig(level = options.verbose,
+                        format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with profiled(options.profile):
+        call_variants_on_sam_file(options.sam_file, options.out_variant_file, options.out_coverage_file,
+                                  workers = options.workers, regions = get_regions(options),
+                                  streaming = options.streaming, coverage_format = options.coverage_format,
+                                  compress = options.compress, base_count_out_file = options.base_count_file,
+                                  pipelined = options.pipelined, shared_memory = options.shared_memory,
+                                  checkpoint_file = options.checkpoint_file, resume = options.resume,
+                                  checkpoint_interval = options.checkpoint_interval,
+                                  partial_out_file = options.partial_file, result_store = options.result_store,
+                                  cache_dir = options.cache_dir, cache_max_bytes = int(options.cache_max_gb * (1 << 30)),
+                                  read_filter = get_read_filter(options))
 
 
 if __name__ == "__main__" :
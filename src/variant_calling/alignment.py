@@ -0,0 +1,579 @@
+import re
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .coverage import BaseCountAccumulator, CoverageAccumulator
+from .instrumentation import get_pipeline_metrics
+from .models import GenomicPosition, Variant
+from .read_filters import ReadFilter, SamFlag
+from .regions import RegionSet
+from .tokenizers import cached_tokenize_cigar, cached_tokenize_md
+from .variant_counter import VariantCounter
+
+# Raw (not phred scaled) quality a base must reach to count towards read depth
+MIN_COVERAGE_QUALITY = 20
+# Cigar operations that consume reference bases
+REFERENCE_CIGAR_OPS = "MDN=X"
+# Cigar operations the coverage walk moves along the reference for, clips included
+WALKED_CIGAR_OPS = "MDSH"
+# Reverse strand alignments walk the reference backwards from their position, so a
+# position stays open until the alignment starts have moved this far past it
+DEFAULT_LOOKBEHIND = 1000
+# Maps every quality byte to 1 if it passes the coverage threshold and 0 otherwise
+QUALITY_PASS_TABLE = bytes(
+    int(quality >= MIN_COVERAGE_QUALITY) for quality in range(256)
+)
+PASSING_RUN_PATTERN = re.compile(b"\x01+")
+# Complements the bases of reverse complemented alignments before they are counted
+BASE_COMPLEMENT_TABLE = bytes.maketrans(b"ACGTacgt", b"TGCAtgca")
+# The FLAG bit of reverse complemented alignments, checked for every alignment
+REVERSE_COMPLEMENT_FLAG = int(SamFlag.REVERSE)
+# An MD string without reference bases has no mismatches or deletions
+MD_MISMATCH_PATTERN = re.compile("[ACGT]")
+
+
+def get_reverse_complement(dna):
+    complement = {"A": "T", "C": "G", "G": "C", "T": "A"}
+    return "".join([complement[base] for base in dna[::-1]])
+
+
+def parse_md_string(md_string: str) -> List[Tuple[int, str]]:
+    return list(cached_tokenize_md(md_string))
+
+
+def parse_sam_flag(flag: int, mask: int = REVERSE_COMPLEMENT_FLAG) -> bool:
+    """
+    Whether every bit of mask is set in the flag, by default whether the alignment is
+    reverse complemented.
+    """
+    return flag & mask == mask
+
+
+def identify_and_validate_reference_bases(
+    parsed_md_list: List[Tuple[int, str]], seq: str, qual: str, reverse_complement: bool
+) -> List[Tuple[int, str, str]]:
+    read_variant_list = []  # Parsed variant information from the reads perspective
+    for md_element in parsed_md_list:
+        base_count, ref_base = md_element
+        if ref_base == "N":
+            continue
+        alt_base = seq[base_count]
+        base_quality = ord(qual[base_count]) - 33
+        if base_quality <= 20:
+            continue
+        if reverse_complement:
+            alt_base = get_reverse_complement(alt_base)
+        read_variant_list.append((base_count, ref_base, alt_base))
+    return read_variant_list
+
+
+def variant_call(
+    chrom: str,
+    alignment_start_pos: int,
+    reverse_complement: bool,
+    read_variant_list: List[Tuple[int, str, str]],
+) -> Set[Variant]:
+    variant_set: Set[Variant] = set()
+    total_bases_seen = 0
+    for read_variant in read_variant_list:
+        base_count, ref_base, alt_base = read_variant
+        total_bases_seen += base_count
+        if ref_base == "N":
+            continue
+        if reverse_complement:
+            variant_position = alignment_start_pos - total_bases_seen
+            variant = Variant(chrom, variant_position, ref_base, alt_base)
+        else:
+            variant_position = alignment_start_pos + total_bases_seen
+            variant = Variant(chrom, variant_position, ref_base, alt_base)
+        variant_set.add(variant)
+    return variant_set
+
+
+def variant_calling_for_one_sam_record(
+    sam_record: Dict[str, Any]
+) -> Optional[Set[Variant]]:
+    """
+    Identifies all variants in a single BWA alignment record. Returns a list of variant objects.
+    """
+    # If there are no variants in the alignment MD then return asap
+    no_variant = True
+    for base in ["A", "T", "C", "G"]:
+        if base in sam_record["MD"]:
+            no_variant = False
+    if no_variant:
+        return None
+
+    # Gather the necessary variables from the alignment
+    chrom: str = sam_record["RNAME"]
+    alignment_start_pos: int = int(sam_record["POS"])
+    reverse_complement: bool = parse_sam_flag(int(sam_record["FLAG"]))
+    seq: str = sam_record["SEQ"]
+    qual: str = sam_record["QUAL"]
+
+    # Call variants in this alignment
+    parsed_md_list: List[Tuple[int, str]] = parse_md_string(sam_record["MD"])
+    read_variant_list: List[
+        Tuple[int, str, str]
+    ] = identify_and_validate_reference_bases(
+        parsed_md_list, seq, qual, reverse_complement
+    )
+    variant_set = variant_call(
+        chrom, alignment_start_pos, reverse_complement, read_variant_list
+    )
+    return variant_set
+
+
+def parse_cigar_string(cigar_string: str) -> List[Tuple[int, str]]:
+    return list(cached_tokenize_cigar(cigar_string))
+
+
+def get_reference_interval(
+    block_ref_start: int, run_start: int, run_stop: int, reverse_complement: bool
+) -> Tuple[int, int]:
+    """
+    Convert a run of read offsets within a matched block into a half open reference
+    interval. Reverse complemented alignments walk the reference backwards.
+    """
+    if reverse_complement:
+        return block_ref_start - run_stop + 1, block_ref_start - run_start + 1
+    return block_ref_start + run_start, block_ref_start + run_stop
+
+
+def get_coverage_intervals(
+    alignment_start_pos: int,
+    reverse_complement: bool,
+    parsed_cigar_list: List[Tuple[int, str]],
+    qual_mask: bytes,
+) -> List[Tuple[int, int]]:
+    """
+    Walk the cigar of one alignment and report the reference intervals covered by
+    quality passing bases, as half open [start, stop) intervals in walk order.
+
+    The qual mask holds one byte per read base, 1 where the base passes the coverage
+    quality threshold and 0 otherwise. Runs of passing bases within a matched block are
+    found with a single regex scan rather than a python loop over every base.
+    """
+    return [
+        (start, stop)
+        for start, stop, _ in get_covered_read_segments(
+            alignment_start_pos, reverse_complement, parsed_cigar_list, qual_mask
+        )
+    ]
+
+
+def get_covered_read_segments(
+    alignment_start_pos: int,
+    reverse_complement: bool,
+    parsed_cigar_list: List[Tuple[int, str]],
+    qual_mask: bytes,
+) -> List[Tuple[int, int, int]]:
+    """
+    The covered reference intervals of get_coverage_intervals as (start, stop, read
+    offset) segments. The read offset is that of the base at the first reference
+    position in walk order, which is stop - 1 for reverse complemented alignments.
+    """
+    ref_step = -1 if reverse_complement else 1
+    segments: List[Tuple[int, int, int]] = []  # The covered reference segments
+    current_position_in_ref = (
+        alignment_start_pos  # The current position in the reference genome
+    )
+    current_position_in_read = 0  # The current position in the read
+
+    # Go over the elements of the cigar string, update the current read position
+    # as well as the current reference position each iteration so they are always accurate
+    for parsed_cigar in parsed_cigar_list:
+        base_count, cigar_op = parsed_cigar
+        if cigar_op == "M":  # Matched sequence
+            start = current_position_in_read
+            stop = current_position_in_read + base_count
+            block_mask = qual_mask[start:stop]
+            if b"\x00" not in block_mask:  # Every base passes, the common case
+                segments.append(
+                    (
+                        *get_reference_interval(
+                            current_position_in_ref,
+                            0,
+                            len(block_mask),
+                            reverse_complement,
+                        ),
+                        start,
+                    )
+                )
+            else:
+                for passing_run in PASSING_RUN_PATTERN.finditer(block_mask):
+                    segments.append(
+                        (
+                            *get_reference_interval(
+                                current_position_in_ref,
+                                passing_run.start(),
+                                passing_run.end(),
+                                reverse_complement,
+                            ),
+                            start + passing_run.start(),
+                        )
+                    )
+            current_position_in_ref += ref_step * len(block_mask)
+        elif cigar_op == "I":  # Insertions
+            current_position_in_read += base_count
+        elif (
+            cigar_op == "D" or cigar_op == "S" or cigar_op == "H"
+        ):  # Skipped or deleted sequence
+            current_position_in_read += base_count
+            current_position_in_ref += ref_step * base_count
+    return segments
+
+
+def get_coverage_inputs(
+    sam_record: Any,
+) -> Tuple[int, int, List[Tuple[int, str]], bytes]:
+    """
+    The position, flag, parsed cigar and printable qualities of one alignment. Decoded
+    BAM records already hold these as values, sam lines are parsed from their strings.
+    """
+    if isinstance(sam_record, dict):
+        return (
+            int(sam_record["POS"]),
+            int(sam_record["FLAG"]),
+            parse_cigar_string(sam_record["CIGAR"]),
+            sam_record["QUAL"].encode("latin-1"),
+        )
+    return sam_record.pos, sam_record.flag, sam_record.cigar_ops, sam_record.qual
+
+
+def get_coverage_intervals_for_sam_records(
+    sam_records: List[Any],
+) -> List[List[Tuple[int, int]]]:
+    """
+    Determine the covered reference intervals for a chunk of alignments at once.
+    """
+    return get_coverage_intervals_for_coverage_inputs(
+        [get_coverage_inputs(sam_record) for sam_record in sam_records]
+    )
+
+
+def get_coverage_intervals_for_coverage_inputs(
+    coverage_inputs: List[Tuple[int, int, List[Tuple[int, str]], bytes]],
+) -> List[List[Tuple[int, int]]]:
+    """
+    The qualities of the whole chunk are thresholded with one translate call, each
+    alignment then only walks its cigar operations.
+    """
+    chunk_qual_mask = b"".join([qual for _, _, _, qual in coverage_inputs]).translate(
+        QUALITY_PASS_TABLE
+    )
+    chunk_intervals: List[List[Tuple[int, int]]] = []
+    read_offset = 0  # Where the current alignment starts in the chunk qual mask
+    for alignment_start_pos, flag, parsed_cigar_list, qual in coverage_inputs:
+        qual_mask = chunk_qual_mask[read_offset : read_offset + len(qual)]
+        read_offset += len(qual)
+        chunk_intervals.append(
+            get_coverage_intervals(
+                alignment_start_pos,
+                parse_sam_flag(flag),
+                parsed_cigar_list,
+                qual_mask,
+            )
+        )
+    return chunk_intervals
+
+
+def get_coverage_intervals_for_one_sam_record(
+    sam_record: Dict[str, Any]
+) -> List[Tuple[int, int]]:
+    """
+    Determine the valid reference bases that are covered by this alignment, reported as
+    half open [start, stop) reference intervals.
+
+    BWA alignments are done from the reads perspective, every base is considered and reported.
+    """
+    return get_coverage_intervals_for_sam_records([sam_record])[0]
+
+
+def get_coverage_data_for_one_sam_record(
+    sam_record: Dict[str, Any]
+) -> Set[GenomicPosition]:
+    """
+    Determine the valid reference bases that are covered by this alignment where a valid base
+    has a quality greater than or equal to 20 phred.
+    """
+    chrom: str = sam_record["RNAME"]
+    return {
+        GenomicPosition(chrom, pos)
+        for start, stop in get_coverage_intervals_for_one_sam_record(sam_record)
+        for pos in range(start, stop)
+    }
+
+
+def get_alignment_interval(sam_record: Any) -> Tuple[str, int, int]:
+    """
+    The chromosome and the one based, inclusive reference interval an alignment spans
+    according to its position and cigar.
+    """
+    if isinstance(sam_record, dict):
+        alignment_start_pos = int(sam_record["POS"])
+        parsed_cigar_list = parse_cigar_string(sam_record["CIGAR"])
+    else:
+        alignment_start_pos = sam_record.pos
+        parsed_cigar_list = sam_record.cigar_ops
+    reference_span = sum(
+        base_count
+        for base_count, cigar_op in parsed_cigar_list
+        if cigar_op in REFERENCE_CIGAR_OPS
+    )
+    return (
+        sam_record["RNAME"],
+        alignment_start_pos,
+        alignment_start_pos + max(reference_span, 1) - 1,
+    )
+
+
+def get_walked_interval(sam_record: Any) -> Tuple[str, int, int]:
+    """
+    The chromosome and the one based, inclusive reference interval the coverage and
+    variants of an alignment land on, as get_covered_read_segments walks it. Clips
+    move along the reference as well, and reverse complemented alignments walk
+    backwards from their position rather than forwards.
+    """
+    if isinstance(sam_record, dict):
+        alignment_start_pos = int(sam_record["POS"])
+        flag = int(sam_record["FLAG"])
+        parsed_cigar_list = parse_cigar_string(sam_record["CIGAR"])
+    else:
+        alignment_start_pos = sam_record.pos
+        flag = sam_record.flag
+        parsed_cigar_list = sam_record.cigar_ops
+    walked_span = max(
+        sum(
+            base_count
+            for base_count, cigar_op in parsed_cigar_list
+            if cigar_op in WALKED_CIGAR_OPS
+        ),
+        1,
+    )
+    if parse_sam_flag(flag):
+        return (
+            sam_record["RNAME"],
+            alignment_start_pos - walked_span + 1,
+            alignment_start_pos,
+        )
+    return (
+        sam_record["RNAME"],
+        alignment_start_pos,
+        alignment_start_pos + walked_span - 1,
+    )
+
+
+def filter_sam_records_to_regions(
+    sam_records: List[Any], regions: RegionSet
+) -> List[Any]:
+    return [
+        sam_record
+        for sam_record in sam_records
+        if regions.overlaps(*get_walked_interval(sam_record))
+    ]
+
+
+def filter_sam_records(
+    sam_records: List[Any],
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> List[Any]:
+    """
+    Drop the alignments the read filter rejects, then those outside of the regions. The
+    read filter runs first as it only compares FLAG and MAPQ, the region test parses
+    the cigar of every alignment it is given.
+    """
+    if read_filter is not None:
+        sam_records = read_filter.filter_sam_records(
+            sam_records, get_pipeline_metrics().rejected_reads
+        )
+    if regions is not None:
+        sam_records = filter_sam_records_to_regions(sam_records, regions)
+    return sam_records
+
+
+def get_filter_parameters(
+    regions: Optional[RegionSet] = None, read_filter: Optional[ReadFilter] = None
+) -> Dict[str, Any]:
+    """
+    The regions and read filter of filter_sam_records as plain values, so totals can be
+    stored with the alignments they were evaluated from and matched to them later.
+    """
+    return {
+        "regions": regions.intervals if regions is not None else None,
+        "read_filter": asdict(read_filter) if read_filter is not None else None,
+    }
+
+
+def get_covered_alleles(
+    alignment_start_pos: int,
+    reverse_complement: bool,
+    md_tokens: Sequence[Tuple[int, str]],
+    seq: str,
+    qual: bytes,
+    intervals: List[Tuple[int, int]],
+) -> List[Tuple[int, str, str]]:
+    """
+    Walk the MD tokens of one alignment alongside its covered reference intervals and
+    report the (pos, ref, alt) of the quality passing variants that land on a covered
+    base, in walk order.
+
+    Variant positions and the intervals both move monotonically in the walk direction,
+    so a single merge pass over the two replaces a search of the intervals per variant.
+    Positions, alt bases and the quality test follow variant_calling_for_one_sam_record.
+    """
+    covered_alleles: List[Tuple[int, str, str]] = []
+    interval_index = 0
+    interval_count = len(intervals)
+    total_bases_seen = 0
+    for base_count, ref_base in md_tokens:
+        if ref_base == "N":
+            continue
+        alt_base = seq[base_count]
+        if qual[base_count] - 33 <= 20:
+            continue
+        # Only the counts of quality passing tokens move the position
+        total_bases_seen += base_count
+        if reverse_complement:
+            alt_base = get_reverse_complement(alt_base)
+            variant_position = alignment_start_pos - total_bases_seen
+            while (
+                interval_index < interval_count
+                and intervals[interval_index][0] > variant_position
+            ):
+                interval_index += 1
+        else:
+            variant_position = alignment_start_pos + total_bases_seen
+            while (
+                interval_index < interval_count
+                and intervals[interval_index][1] <= variant_position
+            ):
+                interval_index += 1
+        if interval_index == interval_count:
+            continue
+        interval_start, interval_stop = intervals[interval_index]
+        if not interval_start <= variant_position < interval_stop:
+            continue
+        allele = (variant_position, ref_base, alt_base)
+        # Repeats can only share a position, the list holds a handful at most
+        if allele not in covered_alleles:
+            covered_alleles.append(allele)
+    return covered_alleles
+
+
+def get_covered_variants(
+    chrom: str,
+    alignment_start_pos: int,
+    reverse_complement: bool,
+    md_tokens: Sequence[Tuple[int, str]],
+    seq: str,
+    qual: bytes,
+    intervals: List[Tuple[int, int]],
+) -> List[Variant]:
+    """
+    The covered variants of one alignment as Variant objects, see get_covered_alleles.
+    """
+    return [
+        Variant(chrom, *allele)
+        for allele in get_covered_alleles(
+            alignment_start_pos, reverse_complement, md_tokens, seq, qual, intervals
+        )
+    ]
+
+
+def get_covered_alleles_for_sam_record(
+    sam_record: Any,
+    alignment_start_pos: int,
+    flag: int,
+    qual: bytes,
+    intervals: List[Tuple[int, int]],
+) -> List[Tuple[int, str, str]]:
+    """
+    The covered alleles of one alignment, most alignments have no mismatch in their MD
+    and return before their sequence is looked at.
+    """
+    md = sam_record["MD"]
+    if MD_MISMATCH_PATTERN.search(md) is None:
+        return []
+    return get_covered_alleles(
+        alignment_start_pos,
+        parse_sam_flag(flag),
+        cached_tokenize_md(md),
+        sam_record["SEQ"],
+        qual,
+        intervals,
+    )
+
+
+def evaluate_sam_record_chunk(
+    sam_records: List[Any],
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: CoverageAccumulator,
+) -> List[List[Tuple[int, int]]]:
+    """
+    Add the coverage and the quality passing variants of a chunk of alignments to the
+    running totals, report the covered reference intervals of every alignment.
+    """
+    metrics = get_pipeline_metrics()
+    with metrics.stage("coverage extraction"):
+        coverage_inputs = [
+            get_coverage_inputs(sam_record) for sam_record in sam_records
+        ]
+        chunk_intervals = get_coverage_intervals_for_coverage_inputs(coverage_inputs)
+    with metrics.stage("variant extraction"):
+        chunk_alleles = [
+            get_covered_alleles_for_sam_record(
+                sam_record, alignment_start_pos, flag, qual, intervals
+            )
+            for sam_record, (alignment_start_pos, flag, _, qual), intervals in zip(
+                sam_records, coverage_inputs, chunk_intervals
+            )
+        ]
+    with metrics.stage("aggregation"):
+        # The coverage of the whole chunk is added at once, see add_intervals
+        chrom_intervals: Dict[str, List[Tuple[int, int]]] = {}
+        for sam_record, intervals, covered_alleles in zip(
+            sam_records, chunk_intervals, chunk_alleles
+        ):
+            chrom = sam_record["RNAME"]
+            chrom_intervals.setdefault(chrom, []).extend(intervals)
+            if covered_alleles:
+                variant_to_read_depth.add_alleles(chrom, covered_alleles)
+        for chrom, intervals in chrom_intervals.items():
+            position_to_read_depth.add_intervals(chrom, intervals)
+    metrics.add_reads(
+        sam_records,
+        sum(stop - start for intervals in chunk_intervals for start, stop in intervals),
+    )
+    return chunk_intervals
+
+
+def count_sam_record_chunk_bases(
+    sam_records: List[Any], base_counts: BaseCountAccumulator
+):
+    """
+    Add the quality passing read bases of a chunk of alignments to the base counts, at
+    the positions get_coverage_intervals has them cover. Reverse complemented alignments
+    count the complements of their bases, as their variant alt bases are.
+    """
+    for sam_record in sam_records:
+        seq = sam_record["SEQ"]
+        if seq == "*":
+            continue
+        alignment_start_pos, flag, parsed_cigar_list, qual = get_coverage_inputs(
+            sam_record
+        )
+        reverse_complement = parse_sam_flag(flag)
+        read_bases = seq.encode("latin-1")
+        chrom = sam_record["RNAME"]
+        for start, stop, read_offset in get_covered_read_segments(
+            alignment_start_pos,
+            reverse_complement,
+            parsed_cigar_list,
+            qual.translate(QUALITY_PASS_TABLE),
+        ):
+            bases = read_bases[read_offset : read_offset + stop - start]
+            if reverse_complement:
+                bases = bases[::-1].translate(BASE_COMPLEMENT_TABLE)
+            base_counts.add_bases(chrom, start, bases)
@@ -0,0 +1,406 @@
+import struct
+from typing import Iterator, List, Optional, Tuple, Union
+
+from .alignment import (
+    DEFAULT_LOOKBEHIND,
+    evaluate_sam_record_chunk,
+    filter_sam_records,
+    get_alignment_interval,
+)
+from .bgzf import BgzfReader, BgzfStreamReader, is_bgzf_file
+from .coverage import CoverageAccumulator
+from .index import (
+    BAI_DEPTH,
+    BAI_MIN_SHIFT,
+    AlignmentIndex,
+    ReferenceIndex,
+    add_to_reference_index,
+    find_alignment_index,
+    merge_chunks,
+    read_alignment_index,
+    write_bai_index,
+)
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .sam_reader import iter_chunks
+from .variant_counter import VariantCounter
+
+BAM_MAGIC = b"BAM\x01"
+BAM_CIGAR_OPS = "MIDNSHP=X"
+BAM_SEQ_BASES = "=ACMGRSVTWYHKDBN"
+# Every packed sequence byte holds two bases
+BAM_SEQ_BYTE_TO_BASES = [
+    BAM_SEQ_BASES[byte >> 4] + BAM_SEQ_BASES[byte & 0xF] for byte in range(256)
+]
+# Raw phred scores become the printable sam encoding with a single translate call
+PHRED_TO_SAM_QUAL = bytes(min(phred + 33, 255) for phred in range(256))
+# refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next refID/pos, tlen
+BAM_RECORD_CORE = struct.Struct("<iiBBHHHiiii")
+# The struct formats of the fixed size tag values, also used for 'B' array elements
+BAM_TAG_FORMATS = {
+    "A": "<c",
+    "c": "<b",
+    "C": "<B",
+    "s": "<h",
+    "S": "<H",
+    "i": "<i",
+    "I": "<I",
+    "f": "<f",
+}
+
+
+def is_bam_file(path: str) -> bool:
+    if not is_bgzf_file(path):
+        return False
+    with BgzfReader(path) as bam_reader:
+        return bam_reader.read(4) == BAM_MAGIC
+
+
+def read_bam_header(
+    bam_reader: Union[BgzfReader, BgzfStreamReader]
+) -> Tuple[str, List[Tuple[str, int]]]:
+    """
+    Read the sam header text and the reference sequence names and lengths.
+    """
+    if bam_reader.read(4) != BAM_MAGIC:
+        raise ValueError("Not a BAM file, the magic string is missing")
+    (header_text_length,) = struct.unpack("<i", bam_reader.read(4))
+    header_text = bam_reader.read(header_text_length).rstrip(b"\x00").decode()
+    (reference_count,) = struct.unpack("<i", bam_reader.read(4))
+    references: List[Tuple[str, int]] = []
+    for _ in range(reference_count):
+        (name_length,) = struct.unpack("<i", bam_reader.read(4))
+        name = bam_reader.read(name_length).rstrip(b"\x00").decode()
+        (reference_length,) = struct.unpack("<i", bam_reader.read(4))
+        references.append((name, reference_length))
+    return header_text, references
+
+
+def read_bam_tag_value(
+    data: bytes, value_type: str, offset: int
+) -> Tuple[Union[str, int, float], int]:
+    """
+    Decode one tag value starting at offset, report it along with the offset of the next
+    tag. Arrays are reported the way sam text shows them.
+    """
+    if value_type in "ZH":
+        value_end = data.index(b"\x00", offset)
+        return data[offset:value_end].decode(), value_end + 1
+    if value_type == "B":
+        element_format = BAM_TAG_FORMATS[chr(data[offset])]
+        (element_count,) = struct.unpack_from("<i", data, offset + 1)
+        element_size = struct.calcsize(element_format)
+        elements = [
+            str(struct.unpack_from(element_format, data, element_offset)[0])
+            for element_offset in range(
+                offset + 5, offset + 5 + element_count * element_size, element_size
+            )
+        ]
+        return ",".join([chr(data[offset])] + elements), (
+            offset + 5 + element_count * element_size
+        )
+    if value_type not in BAM_TAG_FORMATS:
+        raise ValueError(f"Unknown BAM tag type {value_type!r}")
+    (value,) = struct.unpack_from(BAM_TAG_FORMATS[value_type], data, offset)
+    if value_type == "A":
+        value = value.decode()
+    return value, offset + struct.calcsize(BAM_TAG_FORMATS[value_type])
+
+
+class BamRecord:
+    """
+    One decoded BAM alignment. Only the fixed size core is unpacked up front, the cigar,
+    sequence, qualities and tags are decoded from the raw record when asked for.
+
+    Supports the sam column names as keys so the per alignment calling functions can use
+    it in place of a parsed sam line.
+    """
+
+    __slots__ = (
+        "_data",
+        "reference_id",
+        "chrom",
+        "pos",
+        "mapq",
+        "flag",
+        "_read_name_length",
+        "_cigar_op_count",
+        "_seq_length",
+    )
+
+    def __init__(self, data: bytes, references: List[Tuple[str, int]]):
+        self._data = data
+        (
+            self.reference_id,
+            zero_based_pos,
+            self._read_name_length,
+            self.mapq,
+            _,
+            self._cigar_op_count,
+            self.flag,
+            self._seq_length,
+            _,
+            _,
+            _,
+        ) = BAM_RECORD_CORE.unpack_from(data)
+        self.chrom = (
+            references[self.reference_id][0] if self.reference_id >= 0 else "*"
+        )
+        self.pos = zero_based_pos + 1  # Sam positions are one based
+
+    @property
+    def _cigar_offset(self) -> int:
+        return BAM_RECORD_CORE.size + self._read_name_length
+
+    @property
+    def _seq_offset(self) -> int:
+        return self._cigar_offset + 4 * self._cigar_op_count
+
+    @property
+    def _qual_offset(self) -> int:
+        return self._seq_offset + (self._seq_length + 1) // 2
+
+    @property
+    def _tags_offset(self) -> int:
+        return self._qual_offset + self._seq_length
+
+    @property
+    def read_name(self) -> str:
+        start = BAM_RECORD_CORE.size
+        return self._data[start : start + self._read_name_length - 1].decode()
+
+    @property
+    def cigar_ops(self) -> List[Tuple[int, str]]:
+        """
+        The cigar as (base count, operation) tuples, like parse_cigar_string reports.
+        """
+        packed_cigar = struct.unpack_from(
+            f"<{self._cigar_op_count}I", self._data, self._cigar_offset
+        )
+        return [(op >> 4, BAM_CIGAR_OPS[op & 0xF]) for op in packed_cigar]
+
+    @property
+    def seq(self) -> str:
+        packed_seq = self._data[self._seq_offset : self._qual_offset]
+        return "".join([BAM_SEQ_BYTE_TO_BASES[byte] for byte in packed_seq])[
+            : self._seq_length
+        ]
+
+    @property
+    def qual(self) -> bytes:
+        """
+        The base qualities in the printable sam encoding, '*' when they are missing.
+        """
+        phred_qual = self._data[self._qual_offset : self._tags_offset]
+        if not phred_qual or phred_qual[0] == 0xFF:
+            return b"*"
+        return phred_qual.translate(PHRED_TO_SAM_QUAL)
+
+    def get_tag(self, tag: str) -> Optional[Union[str, int, float]]:
+        """
+        Find an optional field by its two letter key, the tags are scanned in place.
+        """
+        data = self._data
+        offset = self._tags_offset
+        tag_key = tag.encode()
+        while offset < len(data):
+            key = data[offset : offset + 2]
+            value, offset = read_bam_tag_value(data, chr(data[offset + 2]), offset + 3)
+            if key == tag_key:
+                return value
+        return None
+
+    @property
+    def md(self) -> str:
+        md = self.get_tag("MD")
+        return md if isinstance(md, str) else ""
+
+    def __getitem__(self, sam_column: str) -> str:
+        if sam_column == "RNAME":
+            return self.chrom
+        if sam_column == "POS":
+            return str(self.pos)
+        if sam_column == "FLAG":
+            return str(self.flag)
+        if sam_column == "SEQ":
+            return self.seq
+        if sam_column == "QUAL":
+            return self.qual.decode()
+        if sam_column == "MD":
+            return f"MD:Z:{self.md}"
+        if sam_column == "CIGAR":
+            return "".join(f"{count}{op}" for count, op in self.cigar_ops) or "*"
+        raise KeyError(sam_column)
+
+
+def iter_bam_records(
+    bam_reader: Union[BgzfReader, BgzfStreamReader], references: List[Tuple[str, int]]
+) -> Iterator[BamRecord]:
+    """
+    Decode alignment records from the current position of the reader until the end of
+    the file. Records are cut out of whole decompressed blocks rather than read one
+    field at a time.
+    """
+    for bam_record, _ in iter_bam_records_with_offsets(bam_reader, references):
+        yield bam_record
+
+
+def iter_bam_records_with_offsets(
+    bam_reader: Union[BgzfReader, BgzfStreamReader], references: List[Tuple[str, int]]
+) -> Iterator[Tuple[BamRecord, Optional[int]]]:
+    """
+    Decode alignment records like iter_bam_records, each along with the virtual offset
+    of the record after it that a BgzfReader can seek back to, None for a stream. A
+    record always ends in the block read last, as blocks are only read when the next
+    record does not fit.
+    """
+    buffer = b""
+    offset = 0
+    # Where the block read last starts in the buffer and in the file
+    block_start = 0
+    block_virtual_offset: Optional[int] = None
+    tell = bam_reader.tell if isinstance(bam_reader, BgzfReader) else lambda: None
+    while True:
+        if len(buffer) - offset < 4:
+            block_virtual_offset = tell()
+            block = bam_reader.read_block()
+            if not block:
+                break
+            buffer = buffer[offset:] + block
+            offset = 0
+            block_start = len(buffer) - len(block)
+            continue
+        (record_length,) = struct.unpack_from("<i", buffer, offset)
+        record_end = offset + 4 + record_length
+        if record_end > len(buffer):
+            block_virtual_offset = tell()
+            block = bam_reader.read_block()
+            if not block:
+                raise ValueError("Truncated BAM record at the end of the file")
+            buffer = buffer[offset:] + block
+            offset = 0
+            block_start = len(buffer) - len(block)
+            continue
+        yield (
+            BamRecord(buffer[offset + 4 : record_end], references),
+            None
+            if block_virtual_offset is None
+            else block_virtual_offset + record_end - block_start,
+        )
+        offset = record_end
+
+
+def read_bam_record(
+    bam_reader: BgzfReader, references: List[Tuple[str, int]]
+) -> Optional[BamRecord]:
+    """
+    Read the record at the current position of the reader, one field at a time so the
+    reader position stays exact.
+    """
+    record_length_bytes = bam_reader.read(4)
+    if len(record_length_bytes) < 4:
+        return None
+    (record_length,) = struct.unpack("<i", record_length_bytes)
+    return BamRecord(bam_reader.read(record_length), references)
+
+
+def iter_bam_records_in_regions(
+    bam_file: str,
+    bam_reader: BgzfReader,
+    references: List[Tuple[str, int]],
+    regions: RegionSet,
+) -> Iterator[BamRecord]:
+    """
+    Decode only the file chunks the BAM index lists for the regions, every chunk is read
+    once even when several regions share it. Without an index every record is decoded.
+
+    The index lists alignments by their forward span from their position, the queries
+    are widened by the lookbehind on both sides to also reach the reverse complemented
+    and clipped alignments whose walk lands in a region from outside of it.
+    """
+    index_file = find_alignment_index(bam_file)
+    if index_file is None:
+        yield from iter_bam_records(bam_reader, references)
+        return
+    alignment_index = read_alignment_index(index_file)
+    reference_ids = {name: index for index, (name, _) in enumerate(references)}
+    chunks = merge_chunks(
+        [
+            chunk
+            for region in regions
+            if region.chrom in reference_ids
+            for chunk in alignment_index.query(
+                reference_ids[region.chrom],
+                max(region.start - 1 - DEFAULT_LOOKBEHIND, 0),
+                region.end + DEFAULT_LOOKBEHIND,
+            )
+        ]
+    )
+    for chunk_start, chunk_end in chunks:
+        bam_reader.seek(chunk_start)
+        while bam_reader.tell() < chunk_end:
+            bam_record = read_bam_record(bam_reader, references)
+            if bam_record is None:
+                break
+            yield bam_record
+
+
+def build_bam_index(bam_file: str, index_file: Optional[str] = None) -> str:
+    """
+    Write a BAI index for a coordinate sorted BAM file, by default next to it.
+    """
+    index_file = index_file or f"{bam_file}.bai"
+    with BgzfReader(bam_file) as bam_reader:
+        _, references = read_bam_header(bam_reader)
+        alignment_index = AlignmentIndex(
+            BAI_MIN_SHIFT, BAI_DEPTH, [ReferenceIndex() for _ in references]
+        )
+        record_start = bam_reader.tell()
+        while True:
+            bam_record = read_bam_record(bam_reader, references)
+            if bam_record is None:
+                break
+            record_end = bam_reader.tell()
+            if bam_record.reference_id >= 0:
+                _, start, end = get_alignment_interval(bam_record)
+                add_to_reference_index(
+                    alignment_index.references[bam_record.reference_id],
+                    start - 1,
+                    end,
+                    (record_start, record_end),
+                )
+            record_start = record_end
+    write_bai_index(alignment_index, index_file)
+    return index_file
+
+
+def evaluate_bam_file(
+    bam_file: str,
+    threads: int = 0,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[VariantCounter, CoverageAccumulator]:
+    """
+    Evaluate the alignments of a BAM file, the BGZF blocks are decompressed by a pool of
+    threads when threads is above zero. With regions only the alignments overlapping
+    them are evaluated, an index next to the BAM file lets the others be skipped. With
+    a read filter only the alignments it passes are evaluated.
+    """
+    variant_to_read_depth = VariantCounter()
+    with BgzfReader(bam_file, threads) as bam_reader:
+        _, references = read_bam_header(bam_reader)
+        position_to_read_depth = CoverageAccumulator(dict(references))
+        if regions is None:
+            bam_records = iter_bam_records(bam_reader, references)
+        else:
+            bam_records = iter_bam_records_in_regions(
+                bam_file, bam_reader, references, regions
+            )
+        for bam_record_chunk in iter_chunks(bam_records):
+            bam_record_chunk = filter_sam_records(
+                bam_record_chunk, regions, read_filter
+            )
+            evaluate_sam_record_chunk(
+                bam_record_chunk, variant_to_read_depth, position_to_read_depth
+            )
+    return variant_to_read_depth, position_to_read_depth
@@ -0,0 +1,290 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .alignment import get_filter_parameters
+from .instrumentation import (
+    PipelineMetrics,
+    get_pipeline_metrics,
+    logger,
+    reset_pipeline_metrics,
+)
+from .output_files import OutputFile
+from .partials import PartialFile, write_partial_file
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .variant_calling import (
+    evaluate_sam_file,
+    write_position_depth_out_file,
+    write_variant_out_file,
+)
+
+
+@dataclass(frozen=True)
+class BatchSample:
+    name: str
+    sam_file: str
+
+
+def read_manifest(manifest_file: str) -> List[BatchSample]:
+    """
+    Read one sample per line, 'name<tab>path' or a bare path that is then named after
+    its file. Relative paths are taken from the manifest directory, blank lines and
+    '#' comments are skipped.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    samples = []
+    with open(manifest_file) as in_file:
+        for line in in_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            sam_file = os.path.join(manifest_dir, fields[-1])
+            if len(fields) == 1:
+                name = os.path.basename(sam_file).split(".")[0]
+            else:
+                name = fields[0]
+            samples.append(BatchSample(name, sam_file))
+    return samples
+
+
+def get_sample_out_files(
+    out_dir: str, sample_name: str, coverage_format: str, compress: bool
+) -> Tuple[str, str]:
+    """
+    The variant and coverage file paths of one sample in the output directory.
+    """
+    suffix = ".gz" if compress else ""
+    coverage_extension = "bedgraph" if coverage_format == "bedgraph" else "tsv"
+    return (
+        os.path.join(out_dir, f"{sample_name}.variants.tsv{suffix}"),
+        os.path.join(out_dir, f"{sample_name}.coverage.{coverage_extension}{suffix}"),
+    )
+
+
+def evaluate_sample(
+    sample: BatchSample,
+    out_dir: Optional[str],
+    partial_out_file: Optional[str] = None,
+    regions: Optional[RegionSet] = None,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    read_filter: Optional[ReadFilter] = None,
+):
+    """
+    Call the variants of one sample and write its outputs when given an output
+    directory, along with a partial for the variant matrix when given a partial file.
+    """
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(
+        sample.sam_file, 1, regions, read_filter=read_filter
+    )
+    if out_dir is not None:
+        variant_out_file, position_out_file = get_sample_out_files(
+            out_dir, sample.name, coverage_format, compress
+        )
+        with get_pipeline_metrics().stage("output writing"):
+            write_variant_out_file(
+                variant_to_read_depth,
+                position_to_read_depth,
+                variant_out_file,
+                compress,
+            )
+            write_position_depth_out_file(
+                position_to_read_depth, position_out_file, coverage_format, compress
+            )
+    if partial_out_file is not None:
+        with get_pipeline_metrics().stage("output writing"):
+            write_partial_file(
+                variant_to_read_depth,
+                position_to_read_depth,
+                partial_out_file,
+                parameters=get_filter_parameters(regions, read_filter),
+            )
+
+
+def evaluate_sample_in_worker(
+    sample: BatchSample,
+    out_dir: Optional[str],
+    partial_out_file: Optional[str] = None,
+    regions: Optional[RegionSet] = None,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    read_filter: Optional[ReadFilter] = None,
+) -> PipelineMetrics:
+    """
+    Evaluate a sample in a worker process, the metrics of the worker are sent back so
+    the parent can report them.
+    """
+    metrics = reset_pipeline_metrics(get_pipeline_metrics().progress_interval)
+    evaluate_sample(
+        sample,
+        out_dir,
+        partial_out_file,
+        regions,
+        coverage_format,
+        compress,
+        read_filter,
+    )
+    return metrics
+
+
+def iter_depths_at_positions(
+    depth_runs: Iterable[Tuple[int, int, int]], positions: Iterable[int]
+) -> Iterator[int]:
+    """
+    The read depth at each of the ascending positions, zero outside of the sorted
+    (start, stop, depth) runs.
+    """
+    depth_run_iterator = iter(depth_runs)
+    depth_run = next(depth_run_iterator, None)
+    for pos in positions:
+        while depth_run is not None and depth_run[1] <= pos:
+            depth_run = next(depth_run_iterator, None)
+        yield depth_run[2] if depth_run is not None and depth_run[0] <= pos else 0
+
+
+def write_variant_matrix(
+    sample_names: Sequence[str],
+    sample_partial_files: Sequence[PartialFile],
+    matrix_out_file: str,
+    compress: bool = False,
+):
+    """
+    Write one row per variant called in any sample with its read depth in every sample.
+    A sample without the variant gets 0 where its alignments cover the position and NA
+    where they do not. Rows are sorted by variant, the partials are read a chromosome
+    at a time so only the variants of one chromosome are held.
+    """
+    chroms = sorted(
+        {
+            chrom
+            for partial_file in sample_partial_files
+            for chrom in partial_file.reference_lengths
+        }
+    )
+    with OutputFile(matrix_out_file, compress) as out_file:
+        out_file.write("\t".join(["variant", *sample_names]) + "\n")
+        for chrom in chroms:
+            sample_alleles = [
+                {
+                    (pos, ref, alt): variant_read_depth
+                    for pos, ref, alt, variant_read_depth in partial_file.iter_variants(
+                        chrom
+                    )
+                }
+                for partial_file in sample_partial_files
+            ]
+            alleles = sorted(set().union(*sample_alleles))
+            sample_depths = [
+                list(
+                    iter_depths_at_positions(
+                        partial_file.iter_depth_runs(chrom),
+                        [pos for pos, _, _ in alleles],
+                    )
+                )
+                for partial_file in sample_partial_files
+            ]
+            for row, allele in enumerate(alleles):
+                cells = [
+                    str(allele_read_depths[allele])
+                    if allele in allele_read_depths
+                    else ("0" if depths[row] else "NA")
+                    for allele_read_depths, depths in zip(sample_alleles, sample_depths)
+                ]
+                out_file.write("\t".join([f"{chrom}-%d-%s-%s" % allele, *cells]) + "\n")
+
+
+def call_variants_on_batch(
+    samples: List[BatchSample],
+    out_dir: Optional[str] = None,
+    matrix_out_file: Optional[str] = None,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    read_filter: Optional[ReadFilter] = None,
+):
+    """
+    Call variants on many samples with one pool of worker processes, so the process
+    startup is paid once per worker rather than once per sample. The largest files are
+    handed out first, idle workers then pick up the smaller ones and the workers finish
+    close together.
+
+    Every sample gets its own variant and coverage files in the output directory, and
+    with a matrix file the variant read depths of all samples are merged into one
+    variant by sample table, see write_variant_matrix.
+    """
+    if out_dir is None and matrix_out_file is None:
+        raise ValueError("A batch needs an output directory, a matrix file or both")
+    sample_names = [sample.name for sample in samples]
+    if len(set(sample_names)) != len(sample_names):
+        raise ValueError("Sample names in a batch must be unique")
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    metrics = reset_pipeline_metrics()
+    samples_by_size = sorted(
+        samples, key=lambda sample: os.path.getsize(sample.sam_file), reverse=True
+    )
+    with ExitStack() as exit_stack:
+        # The matrix is merged from a partial per sample, kept next to the matrix file
+        partial_dir = None
+        if matrix_out_file is not None:
+            partial_dir = exit_stack.enter_context(
+                tempfile.TemporaryDirectory(
+                    dir=os.path.dirname(os.path.abspath(matrix_out_file))
+                )
+            )
+        sample_partial_files = {
+            sample.name: (
+                os.path.join(partial_dir, f"{index}.partial") if partial_dir else None
+            )
+            for index, sample in enumerate(samples)
+        }
+        if workers <= 1:
+            for sample in samples_by_size:
+                evaluate_sample(
+                    sample,
+                    out_dir,
+                    sample_partial_files[sample.name],
+                    regions,
+                    coverage_format,
+                    compress,
+                    read_filter,
+                )
+                logger.info("Finished sample %s", sample.name)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                future_to_sample = {
+                    executor.submit(
+                        evaluate_sample_in_worker,
+                        sample,
+                        out_dir,
+                        sample_partial_files[sample.name],
+                        regions,
+                        coverage_format,
+                        compress,
+                        read_filter,
+                    ): sample
+                    for sample in samples_by_size
+                }
+                for future in as_completed(future_to_sample):
+                    metrics.merge(future.result())
+                    logger.info("Finished sample %s", future_to_sample[future].name)
+        if matrix_out_file is not None and partial_dir is not None:
+            with metrics.stage("output writing"):
+                write_variant_matrix(
+                    sample_names,
+                    [
+                        exit_stack.enter_context(
+                            PartialFile(os.path.join(partial_dir, f"{index}.partial"))
+                        )
+                        for index in range(len(samples))
+                    ],
+                    matrix_out_file,
+                    compress,
+                )
+    metrics.log_summary()
@@ -0,0 +1,288 @@
+import gzip
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Deque, Iterator, Optional, Tuple
+
+# A BGZF file is a series of gzip members of at most 64kb, each carrying its own
+# compressed size in a "BC" extra field. Offsets into the file are virtual offsets, the
+# compressed offset of a block shifted left 16 bits plus the offset within the block.
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_HEADER_SIZE = BGZF_HEADER.size
+BGZF_MAX_BLOCK_SIZE = 1 << 16
+# Leave room for the header and footer should the data not compress at all
+BGZF_MAX_DATA_SIZE = BGZF_MAX_BLOCK_SIZE - 1024
+BGZF_EOF_BLOCK = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+# Number of blocks handed to the decompression threads ahead of the reader
+BGZF_READAHEAD_BLOCKS = 64
+
+
+def make_virtual_offset(block_offset: int, within_block_offset: int) -> int:
+    return (block_offset << 16) | within_block_offset
+
+
+def split_virtual_offset(virtual_offset: int) -> Tuple[int, int]:
+    return virtual_offset >> 16, virtual_offset & 0xFFFF
+
+
+def is_bgzf_file(path: str) -> bool:
+    with open(path, "rb") as in_file:
+        header = in_file.read(BGZF_HEADER_SIZE)
+    if len(header) < BGZF_HEADER_SIZE:
+        return False
+    id1, id2, _, flag, _, _, _, _, si1, si2, _, _ = BGZF_HEADER.unpack(header)
+    return (id1, id2, flag, si1, si2) == (31, 139, 4, 66, 67)
+
+
+def read_raw_block(in_file: BinaryIO) -> Optional[Tuple[int, bytes]]:
+    """
+    Read the next compressed block, report its file offset and its deflate payload.
+    """
+    block_offset = in_file.tell()
+    header = in_file.read(BGZF_HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < BGZF_HEADER_SIZE:
+        raise ValueError(f"Truncated BGZF block header at offset {block_offset}")
+    id1, id2, _, flag, _, _, _, extra_length, si1, si2, _, block_size = (
+        BGZF_HEADER.unpack(header)
+    )
+    if (id1, id2, flag, si1, si2) != (31, 139, 4, 66, 67):
+        raise ValueError(f"Invalid BGZF block header at offset {block_offset}")
+    # The extra field is 6 bytes for the BC subfield, skip anything else it holds
+    in_file.seek(extra_length - 6, 1)
+    remaining = block_size + 1 - BGZF_HEADER_SIZE - (extra_length - 6)
+    block = in_file.read(remaining)
+    if len(block) < remaining:
+        raise ValueError(f"Truncated BGZF block at offset {block_offset}")
+    return block_offset, block[:-8]  # Drop the crc32 and size footer
+
+
+def decompress_block(deflate_payload: bytes) -> bytes:
+    return zlib.decompress(deflate_payload, -15)
+
+
+def iter_bgzf_block_offsets(path: str) -> Iterator[int]:
+    """
+    Yield the compressed offset of every block without decompressing any of them, the
+    block boundaries are natural split points for parallel readers.
+    """
+    with open(path, "rb") as in_file:
+        while True:
+            raw_block = read_raw_block(in_file)
+            if raw_block is None:
+                break
+            yield raw_block[0]
+
+
+class BgzfReader:
+    """
+    Random access reader over the decompressed stream of a BGZF file. Blocks can be
+    decompressed ahead of the reader by a thread pool, zlib releases the GIL.
+    """
+
+    def __init__(self, path: str, threads: int = 0):
+        self._file = open(path, "rb")
+        self._executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        self._pending: Deque[Tuple[int, "Future[bytes]"]] = deque()
+        self._next_raw_offset = 0  # Where the readahead continues reading raw blocks
+        self._block_offset = 0
+        self._next_block_offset = 0
+        self._block_data = b""
+        self._within_block_offset = 0
+
+    def __enter__(self) -> "BgzfReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        self._file.close()
+
+    def tell(self) -> int:
+        """
+        The virtual offset of the next byte to be read.
+        """
+        if self._within_block_offset == len(self._block_data):
+            return make_virtual_offset(self._next_block_offset, 0)
+        return make_virtual_offset(self._block_offset, self._within_block_offset)
+
+    def seek(self, virtual_offset: int):
+        block_offset, within_block_offset = split_virtual_offset(virtual_offset)
+        self._pending.clear()
+        self._next_raw_offset = block_offset
+        self._load_block()
+        if within_block_offset > len(self._block_data):
+            raise ValueError(f"Virtual offset {virtual_offset} is past its block")
+        self._within_block_offset = within_block_offset
+
+    def _next_decompressed_block(self) -> Optional[Tuple[int, int, bytes]]:
+        if self._executor is None:
+            self._file.seek(self._next_raw_offset)
+            raw_block = read_raw_block(self._file)
+            if raw_block is None:
+                return None
+            self._next_raw_offset = self._file.tell()
+            return raw_block[0], self._next_raw_offset, decompress_block(raw_block[1])
+        self._file.seek(self._next_raw_offset)
+        while len(self._pending) < BGZF_READAHEAD_BLOCKS:
+            raw_block = read_raw_block(self._file)
+            if raw_block is None:
+                break
+            self._pending.append(
+                (raw_block[0], self._executor.submit(decompress_block, raw_block[1]))
+            )
+        self._next_raw_offset = self._file.tell()
+        if not self._pending:
+            return None
+        block_offset, decompressed_block = self._pending.popleft()
+        next_block_offset = (
+            self._pending[0][0] if self._pending else self._next_raw_offset
+        )
+        return block_offset, next_block_offset, decompressed_block.result()
+
+    def _load_block(self) -> bool:
+        decompressed_block = self._next_decompressed_block()
+        if decompressed_block is None:
+            self._block_offset = self._next_block_offset = self._next_raw_offset
+            self._block_data = b""
+            self._within_block_offset = 0
+            return False
+        self._block_offset, self._next_block_offset, self._block_data = (
+            decompressed_block
+        )
+        self._within_block_offset = 0
+        return True
+
+    def read_block(self) -> bytes:
+        """
+        Read the rest of the current block, or the whole next block when the current one
+        is used up. An empty result means the end of the file.
+        """
+        while self._within_block_offset == len(self._block_data):
+            if not self._load_block():
+                return b""
+        data = self._block_data[self._within_block_offset :]
+        self._within_block_offset = len(self._block_data)
+        return data
+
+    def readline(self) -> bytes:
+        """
+        Read up to and including the next newline, or to the end of the file.
+        """
+        pieces = []
+        while True:
+            if self._within_block_offset == len(self._block_data):
+                if not self._load_block():
+                    break
+                continue
+            line_end = self._block_data.find(b"\n", self._within_block_offset)
+            stop = len(self._block_data) if line_end < 0 else line_end + 1
+            pieces.append(self._block_data[self._within_block_offset : stop])
+            self._within_block_offset = stop
+            if line_end >= 0:
+                break
+        return b"".join(pieces)
+
+    def read(self, size: int) -> bytes:
+        pieces = []
+        while size > 0:
+            if self._within_block_offset == len(self._block_data):
+                if not self._load_block():
+                    break
+                continue
+            stop = self._within_block_offset + size
+            piece = self._block_data[self._within_block_offset : stop]
+            self._within_block_offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return b"".join(pieces)
+
+
+class BgzfStreamReader:
+    """
+    Front to back reader over the decompressed data of a BGZF stream that cannot seek,
+    such as a pipe. BGZF blocks are gzip members, so the gzip module reads them in turn.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._gzip_file = gzip.GzipFile(fileobj=stream, mode="rb")
+
+    def __enter__(self) -> "BgzfStreamReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Closing the gzip reader leaves the stream it reads open
+        self._gzip_file.close()
+
+    def read(self, size: int) -> bytes:
+        return self._gzip_file.read(size)
+
+    def read_block(self) -> bytes:
+        """
+        Read up to a block worth of data, an empty result means the end of the stream.
+        """
+        return self._gzip_file.read1(BGZF_MAX_BLOCK_SIZE)
+
+
+class BgzfWriter:
+    """
+    Write a BGZF file, data is buffered and compressed one block at a time.
+    """
+
+    def __init__(self, path: str, compress_level: int = 6):
+        self._file = open(path, "wb")
+        self._compress_level = compress_level
+        self._buffer = bytearray()
+
+    def __enter__(self) -> "BgzfWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tell(self) -> int:
+        """
+        The virtual offset the next byte written will have.
+        """
+        return make_virtual_offset(self._file.tell(), len(self._buffer))
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= BGZF_MAX_DATA_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_MAX_DATA_SIZE]))
+            del self._buffer[:BGZF_MAX_DATA_SIZE]
+
+    def flush(self):
+        """
+        Compress whatever is buffered into a block of its own.
+        """
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _write_block(self, data: bytes):
+        compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED, -15)
+        deflate_payload = compressor.compress(data) + compressor.flush()
+        block_size = BGZF_HEADER_SIZE + len(deflate_payload) + 8
+        self._file.write(
+            BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+        )
+        self._file.write(deflate_payload)
+        self._file.write(struct.pack("<2I", zlib.crc32(data), len(data)))
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.write(BGZF_EOF_BLOCK)
+        self._file.close()
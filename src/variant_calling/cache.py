@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+from . import __version__
+from .alignment import MIN_COVERAGE_QUALITY
+from .instrumentation import get_pipeline_metrics, logger
+from .result_store import hash_input_file
+
+# Cache directories are kept below this many bytes by default
+DEFAULT_CACHE_MAX_BYTES = 10 << 30
+# The hashes of inputs are remembered in this file of a cache directory, by path
+INPUT_HASHES_FILE = "input_hashes.json"
+
+
+def fingerprint_input_file(
+    sam_file: str, input_hashes: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    The fingerprint of an input, the hash of its content, so a copied or restored input
+    is recognised as the same one. Given the hashes remembered by path, an input whose
+    size and modification time are unchanged since it was hashed is not read again, a
+    new hash is remembered in input_hashes.
+    """
+    if input_hashes is None:
+        return hash_input_file(sam_file)
+    input_stat = os.stat(sam_file)
+    input_path = os.path.abspath(sam_file)
+    input_stamp = [input_stat.st_size, input_stat.st_mtime_ns]
+    remembered = input_hashes.get(input_path)
+    if remembered is not None and remembered["stamp"] == input_stamp:
+        return remembered["hash"]
+    input_hash = hash_input_file(sam_file)
+    input_hashes[input_path] = {"stamp": input_stamp, "hash": input_hash}
+    return input_hash
+
+
+def get_result_fingerprint(
+    sam_file: str,
+    parameters: Dict[str, Any],
+    input_hashes: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    The cache key of a run, the fingerprint of its input together with the calling
+    parameters that shape its outputs and the version of the package.
+    """
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "input": fingerprint_input_file(sam_file, input_hashes),
+                "version": __version__,
+                "min_coverage_quality": MIN_COVERAGE_QUALITY,
+                "parameters": parameters,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+
+def get_directory_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class ResultCache:
+    """
+    A directory of the outputs of earlier runs, one subdirectory per result fingerprint
+    holding a copy of every output under its role, such as "variants" or "coverage".
+    The modification time of an entry is refreshed whenever it is used, entries that
+    went unused the longest are evicted once the directory grows past max_bytes.
+
+    Outputs are copied in and out rather than hard linked, an output file that is later
+    written over in place would otherwise change the cached copy along with it.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fingerprint(self, sam_file: str, parameters: Dict[str, Any]) -> str:
+        """
+        The cache key of a run, see get_result_fingerprint. The hashes of inputs are
+        remembered in the cache directory, an input is only hashed again once its size
+        or modification time changes.
+        """
+        input_hashes_file = os.path.join(self.cache_dir, INPUT_HASHES_FILE)
+        try:
+            with open(input_hashes_file) as in_file:
+                input_hashes = json.load(in_file)
+        except (OSError, ValueError):
+            input_hashes = {}
+        fingerprint = get_result_fingerprint(sam_file, parameters, input_hashes)
+        temporary_file = f"{input_hashes_file}.tmp{os.getpid()}"
+        with open(temporary_file, "w") as out_file:
+            json.dump(input_hashes, out_file)
+        os.replace(temporary_file, input_hashes_file)
+        return fingerprint
+
+    def fetch(self, fingerprint: str, out_files: Dict[str, str]) -> bool:
+        """
+        Copy the cached outputs of a fingerprint to out_files, keyed by role. Reports
+        whether there was an entry with every output, counted as a cache hit or miss.
+        """
+        metrics = get_pipeline_metrics()
+        entry_dir = os.path.join(self.cache_dir, fingerprint)
+        cached_files = {role: os.path.join(entry_dir, role) for role in out_files}
+        if not all(map(os.path.exists, cached_files.values())):
+            metrics.cache_misses += 1
+            logger.info("Result cache miss for %s", fingerprint)
+            return False
+        with metrics.stage("output writing"):
+            for role, cached_file in cached_files.items():
+                shutil.copyfile(cached_file, out_files[role])
+        os.utime(entry_dir)
+        metrics.cache_hits += 1
+        logger.info("Result cache hit for %s", fingerprint)
+        return True
+
+    def store(self, fingerprint: str, out_files: Dict[str, str]):
+        """
+        Copy the outputs of a run into the entry of its fingerprint, then evict the
+        least recently used entries past the size limit. The entry is gathered in a
+        temporary directory and renamed into place, so readers never see half of it.
+        """
+        entry_dir = os.path.join(self.cache_dir, fingerprint)
+        temporary_dir = f"{entry_dir}.tmp{os.getpid()}"
+        os.makedirs(temporary_dir, exist_ok=True)
+        for role, out_file in out_files.items():
+            shutil.copyfile(out_file, os.path.join(temporary_dir, role))
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(temporary_dir, entry_dir)
+        self.evict()
+
+    def evict(self):
+        entries = sorted(
+            (
+                entry
+                for entry in os.scandir(self.cache_dir)
+                if entry.is_dir() and ".tmp" not in entry.name
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        entry_sizes = [get_directory_size(entry.path) for entry in entries]
+        cache_size = sum(entry_sizes)
+        for entry, entry_size in zip(entries, entry_sizes):
+            if cache_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry.path, ignore_errors=True)
+            cache_size -= entry_size
+            logger.info("Evicted %s from the result cache", entry.name)
@@ -0,0 +1,311 @@
+import gzip
+import os
+import pickle
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .alignment import (
+    evaluate_sam_record_chunk,
+    filter_sam_records,
+    get_filter_parameters,
+)
+from .bam import is_bam_file, iter_bam_records_with_offsets, read_bam_header
+from .bgzf import BgzfReader
+from .coverage import CoverageAccumulator
+from .instrumentation import get_pipeline_metrics, logger
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .sam_reader import (
+    SamBytesRecord,
+    iter_chunks,
+    iter_sam_line_blocks,
+    parse_reference_lengths,
+    read_sam_header,
+)
+from .variant_counter import VariantCounter
+
+# Seconds between two checkpoints at the least
+DEFAULT_CHECKPOINT_INTERVAL = 300.0
+# The share of the run time checkpoints may take, after a slow checkpoint the next one
+# waits until the time spent on checkpoints is back within it
+CHECKPOINT_TIME_BUDGET = 0.02
+# Checkpoints are pickled through a fast gzip level, depth pages are mostly runs
+CHECKPOINT_COMPRESS_LEVEL = 1
+CHECKPOINT_MAGIC = b"VCCKPT3\n"
+
+
+@dataclass
+class Checkpoint:
+    """
+    The running totals of an evaluation along with where in the input it stopped, a
+    byte offset into a sam file or a virtual offset into a BAM file. The input size and
+    modification time tell whether the input is still the one it was taken from, the
+    parameters which regions and read filter its alignments were evaluated with. The
+    reads, bases and read filter rejections counted up to the offset are restored into
+    the pipeline metrics of a resumed run.
+
+    Checkpoints are pickles, which run code of their choosing when loaded. Only resume
+    from checkpoint files this package wrote, never from untrusted paths.
+    """
+
+    sam_file: str
+    input_size: int
+    input_mtime_ns: int
+    parameters: Dict[str, Any]
+    offset: int
+    variant_to_read_depth: VariantCounter
+    position_to_read_depth: CoverageAccumulator
+    reads: int = 0
+    bases: int = 0
+    rejected_reads: Dict[str, int] = field(default_factory=dict)
+
+
+def get_input_stamp(sam_file: str) -> Tuple[int, int]:
+    input_stat = os.stat(sam_file)
+    return input_stat.st_size, input_stat.st_mtime_ns
+
+
+def write_checkpoint(checkpoint: Checkpoint, checkpoint_file: str):
+    """
+    Write a checkpoint atomically, it goes to a temporary file that is synced and then
+    renamed over the previous checkpoint, so a run killed part way through a write
+    leaves the previous one intact.
+    """
+    temporary_file = f"{checkpoint_file}.tmp"
+    with open(temporary_file, "wb") as out_file:
+        with gzip.GzipFile(
+            fileobj=out_file, mode="wb", compresslevel=CHECKPOINT_COMPRESS_LEVEL
+        ) as gzip_file:
+            gzip_file.write(CHECKPOINT_MAGIC)
+            pickle.dump(checkpoint, gzip_file, protocol=pickle.HIGHEST_PROTOCOL)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(temporary_file, checkpoint_file)
+
+
+def read_checkpoint(
+    checkpoint_file: str,
+    sam_file: str,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Optional[Checkpoint]:
+    """
+    Read the checkpoint of an earlier run on sam_file, None when there is none yet. A
+    checkpoint of another input, or of one that has changed since, is refused, as is
+    one taken with other regions or another read filter. The checkpoint is unpickled,
+    see Checkpoint, so checkpoint_file has to be trusted.
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    with gzip.open(checkpoint_file, "rb") as in_file:
+        if in_file.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError(f"{checkpoint_file} is not a checkpoint file")
+        checkpoint: Checkpoint = pickle.load(in_file)
+    if (
+        os.path.abspath(checkpoint.sam_file) != os.path.abspath(sam_file)
+        or (checkpoint.input_size, checkpoint.input_mtime_ns)
+        != get_input_stamp(sam_file)
+    ):
+        raise ValueError(
+            f"{checkpoint_file} was taken from {checkpoint.sam_file} as it was then, "
+            f"not from the current {sam_file}"
+        )
+    if checkpoint.parameters != get_filter_parameters(regions, read_filter):
+        raise ValueError(
+            f"{checkpoint_file} was taken with other regions or another read filter "
+            "than this run has"
+        )
+    return checkpoint
+
+
+class Checkpointer:
+    """
+    Writes checkpoints of a running evaluation, at most every interval seconds and
+    never more often than keeps their cost within CHECKPOINT_TIME_BUDGET of the run
+    time. The time spent is measured as the "checkpointing" stage.
+    """
+
+    def __init__(
+        self,
+        checkpoint_file: str,
+        sam_file: str,
+        interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+        regions: Optional[RegionSet] = None,
+        read_filter: Optional[ReadFilter] = None,
+    ):
+        self.checkpoint_file = checkpoint_file
+        self.sam_file = sam_file
+        self.interval = interval
+        self.input_stamp = get_input_stamp(sam_file)
+        self.parameters = get_filter_parameters(regions, read_filter)
+        # The counts of the metrics from before this evaluation stay out of checkpoints
+        metrics = get_pipeline_metrics()
+        self._start_counts = metrics.reads, metrics.bases, dict(metrics.rejected_reads)
+        self.checkpoints = 0
+        self.seconds = 0.0
+        self._start_time = self._next_time = time.perf_counter()
+        self._next_time += interval
+
+    def maybe_write(
+        self,
+        offset: int,
+        variant_to_read_depth: VariantCounter,
+        position_to_read_depth: CoverageAccumulator,
+    ):
+        now = time.perf_counter()
+        if now < self._next_time:
+            return
+        metrics = get_pipeline_metrics()
+        start_reads, start_bases, start_rejected_reads = self._start_counts
+        with metrics.stage("checkpointing"):
+            write_checkpoint(
+                Checkpoint(
+                    self.sam_file,
+                    *self.input_stamp,
+                    self.parameters,
+                    offset,
+                    variant_to_read_depth,
+                    position_to_read_depth,
+                    metrics.reads - start_reads,
+                    metrics.bases - start_bases,
+                    {
+                        filter_name: reads - start_rejected_reads.get(filter_name, 0)
+                        for filter_name, reads in metrics.rejected_reads.items()
+                    },
+                ),
+                self.checkpoint_file,
+            )
+        checkpoint_seconds = time.perf_counter() - now
+        self.checkpoints += 1
+        self.seconds += checkpoint_seconds
+        self._next_time = time.perf_counter() + max(
+            self.interval, checkpoint_seconds / CHECKPOINT_TIME_BUDGET
+        )
+        logger.info(
+            "Checkpoint at offset %d took %.2f seconds, %.1f%% of the run so far",
+            offset,
+            checkpoint_seconds,
+            100 * self.seconds / (time.perf_counter() - self._start_time),
+        )
+
+
+def iter_sam_chunks_with_offsets(
+    sam_file: str, start: int
+) -> Iterator[Tuple[List[Any], Optional[int]]]:
+    """
+    Yield chunks of the alignments of a sam file from the byte offset start on, the
+    last chunk of every block comes with the offset of the next block.
+    """
+    for sam_lines, block_end in iter_sam_line_blocks(
+        sam_file, start, os.path.getsize(sam_file)
+    ):
+        sam_record_chunks = list(iter_chunks(map(SamBytesRecord, sam_lines)))
+        for sam_record_chunk in sam_record_chunks[:-1]:
+            yield sam_record_chunk, None
+        yield (sam_record_chunks[-1] if sam_record_chunks else []), block_end
+
+
+def iter_bam_chunks_with_offsets(
+    bam_reader: BgzfReader, references: List[Tuple[str, int]]
+) -> Iterator[Tuple[List[Any], Optional[int]]]:
+    """
+    Yield chunks of the alignments of a BAM file from the position of the reader on,
+    each with the virtual offset of the alignment after it.
+    """
+    for bam_records_with_offsets in iter_chunks(
+        iter_bam_records_with_offsets(bam_reader, references)
+    ):
+        yield (
+            [bam_record for bam_record, _ in bam_records_with_offsets],
+            bam_records_with_offsets[-1][1],
+        )
+
+
+def evaluate_record_chunks(
+    record_chunks: Iterator[Tuple[List[Any], Optional[int]]],
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: CoverageAccumulator,
+    checkpointer: Checkpointer,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+):
+    for record_chunk, offset in record_chunks:
+        record_chunk = filter_sam_records(record_chunk, regions, read_filter)
+        evaluate_sam_record_chunk(
+            record_chunk, variant_to_read_depth, position_to_read_depth
+        )
+        if offset is not None:
+            checkpointer.maybe_write(
+                offset, variant_to_read_depth, position_to_read_depth
+            )
+
+
+def evaluate_sam_file_checkpointed(
+    sam_file: str,
+    checkpoint_file: str,
+    resume: bool = False,
+    regions: Optional[RegionSet] = None,
+    threads: int = 0,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[VariantCounter, CoverageAccumulator]:
+    """
+    Evaluate a sam or BAM file in one pass while writing checkpoints of the running
+    totals, see Checkpointer. With resume the evaluation picks up from the checkpoint
+    an earlier run left, or starts over when there is none. BAM blocks are decompressed
+    by threads when threads is above zero. The checkpoint is unpickled, see Checkpoint,
+    so checkpoint_file has to be trusted.
+    """
+    checkpoint = None
+    if resume:
+        checkpoint = read_checkpoint(checkpoint_file, sam_file, regions, read_filter)
+    checkpointer = Checkpointer(
+        checkpoint_file, sam_file, checkpoint_interval, regions, read_filter
+    )
+    if checkpoint is not None:
+        logger.info("Resuming %s from offset %d", sam_file, checkpoint.offset)
+        metrics = get_pipeline_metrics()
+        metrics.reads += checkpoint.reads
+        metrics.bases += checkpoint.bases
+        for filter_name, reads in checkpoint.rejected_reads.items():
+            metrics.rejected_reads[filter_name] = (
+                metrics.rejected_reads.get(filter_name, 0) + reads
+            )
+        variant_to_read_depth = checkpoint.variant_to_read_depth
+    else:
+        variant_to_read_depth = VariantCounter()
+    if is_bam_file(sam_file):
+        with BgzfReader(sam_file, threads) as bam_reader:
+            _, references = read_bam_header(bam_reader)
+            if checkpoint is not None:
+                position_to_read_depth = checkpoint.position_to_read_depth
+                bam_reader.seek(checkpoint.offset)
+            else:
+                position_to_read_depth = CoverageAccumulator(dict(references))
+            evaluate_record_chunks(
+                iter_bam_chunks_with_offsets(bam_reader, references),
+                variant_to_read_depth,
+                position_to_read_depth,
+                checkpointer,
+                regions,
+                read_filter,
+            )
+        return variant_to_read_depth, position_to_read_depth
+    header_lines, start = read_sam_header(sam_file)
+    if checkpoint is not None:
+        position_to_read_depth = checkpoint.position_to_read_depth
+        start = checkpoint.offset
+    else:
+        position_to_read_depth = CoverageAccumulator(
+            parse_reference_lengths(header_lines)
+        )
+    evaluate_record_chunks(
+        iter_sam_chunks_with_offsets(sam_file, start),
+        variant_to_read_depth,
+        position_to_read_depth,
+        checkpointer,
+        regions,
+        read_filter,
+    )
+    return variant_to_read_depth, position_to_read_depth
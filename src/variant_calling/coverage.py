@@ -0,0 +1,590 @@
+import math
+from array import array
+from itertools import accumulate, chain, islice, repeat
+from multiprocessing.shared_memory import SharedMemory
+from operator import add
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from .models import GenomicPosition
+
+# Each chromosome is stored as a sparse set of fixed size pages, a page is only
+# allocated once a read touches it. Depths are unsigned 32 bit ints, 4 bytes per base.
+PAGE_SHIFT = 16
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+EMPTY_PAGE = array("I", bytes(4 * PAGE_SIZE))
+# A private page, or a view of a page in a shared memory array
+Page = Union[array, memoryview]
+# Pages are added together around stretches of at least this many zero entries
+ZERO_STRETCH_SIZE = 256
+ZERO_STRETCH = bytes(4 * ZERO_STRETCH_SIZE)
+# Base count pages hold a count per base in this order for every position, so the
+# counts of one position sit next to each other
+BASE_COUNT_ORDER = "ACGTN"
+BASE_COUNT_WIDTH = len(BASE_COUNT_ORDER)
+# Maps a base character to its index in BASE_COUNT_ORDER, anything unknown counts as N
+BASE_CODE_TABLE = bytes(
+    "ACGT".find(chr(byte).upper()) if chr(byte).upper() in "ACGT" else 4
+    for byte in range(256)
+)
+# Per base code, maps that code to 1 and every other code to 0
+BASE_CODE_MASKS = [
+    bytes(int(code == base_code) for code in range(256))
+    for base_code in range(BASE_COUNT_WIDTH)
+]
+EMPTY_BASE_COUNT_PAGE = array("I", bytes(4 * BASE_COUNT_WIDTH * PAGE_SIZE))
+
+
+def iter_page_runs(
+    page: Page, start: int = 0, stop: int = PAGE_SIZE
+) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield (start, stop, depth) for the runs of equal depth in page[start:stop]. The end
+    of every run is found by galloping then bisecting with slice comparisons, so the
+    python level work grows with the number of runs rather than with the positions.
+    """
+    # Slices of a shared page view compare several times slower than those of an
+    # array, the page is read from one transient copy instead
+    if not isinstance(page, array):
+        page_view, page = page, array("I")
+        page.frombytes(page_view.cast("B"))
+    while start < stop:
+        run_depth = page[start : start + 1]
+        run_stop = next_stop = start + 1
+        step = 1
+        # Every depth in [start, run_stop) matches, some in [run_stop, next_stop) differ
+        while run_stop < stop:
+            next_stop = min(run_stop + step, stop)
+            if page[run_stop:next_stop] != run_depth * (next_stop - run_stop):
+                break
+            run_stop = next_stop
+            step *= 2
+        while run_stop < stop and next_stop - run_stop > 1:
+            middle = (run_stop + next_stop) // 2
+            if page[run_stop:middle] == run_depth * (middle - run_stop):
+                run_stop = middle
+            else:
+                next_stop = middle
+        yield start, run_stop, run_depth[0]
+        start = run_stop
+
+
+def iter_nonzero_spans(page: Page) -> Iterator[Tuple[int, int]]:
+    """
+    Yield the half open spans of a page between its stretches of at least
+    ZERO_STRETCH_SIZE zero entries. The stretches are found by byte comparisons and
+    searches over the page, so the python level work grows with their number and
+    length in stretches rather than with the positions.
+    """
+    page_bytes = bytes(memoryview(page).cast("B"))
+    position = 0
+    while True:
+        while page_bytes.startswith(ZERO_STRETCH, position):
+            position += len(ZERO_STRETCH)
+        zero_bytes = page_bytes[position : position + len(ZERO_STRETCH)]
+        position += len(zero_bytes) - len(zero_bytes.lstrip(b"\0"))
+        if position == len(page_bytes):
+            return
+        start = position // 4
+        position = page_bytes.find(ZERO_STRETCH, position)
+        if position == -1:
+            yield start, len(page_bytes) // 4
+            return
+        # A stretch found off the entry boundaries still holds only zero entries
+        yield start, -(-position // 4)
+
+
+def add_page(page: Page, other_page: Page):
+    """
+    Add the entries of other_page into page, skipping its stretches of zeros.
+    """
+    for start, stop in iter_nonzero_spans(other_page):
+        page[start:stop] = array(
+            "I", map(add, page[start:stop], other_page[start:stop])
+        )
+
+
+def merge_depth_runs(
+    position_depths: Iterable[Tuple[str, int, int]]
+) -> Iterator[Tuple[str, int, int, int]]:
+    """
+    Merge sorted (chrom, pos, depth) rows into (chrom, start, stop, depth) runs of
+    adjacent positions with the same depth, like iter_depth_runs reports.
+    """
+    run_chrom, run_start, run_stop, run_depth = "", 0, 0, 0
+    for chrom, pos, depth in position_depths:
+        if chrom == run_chrom and pos == run_stop and depth == run_depth:
+            run_stop += 1
+            continue
+        if run_depth:
+            yield run_chrom, run_start, run_stop, run_depth
+        run_chrom, run_start, run_stop, run_depth = chrom, pos, pos + 1, depth
+    if run_depth:
+        yield run_chrom, run_start, run_stop, run_depth
+
+
+class CoverageAccumulator(Mapping[GenomicPosition, int]):
+    """
+    Read depth for every covered reference position, backed by compact integer arrays
+    per chromosome instead of one dict entry per base.
+
+    Behaves as a read only mapping of GenomicPosition to read depth, positions with a
+    depth of zero are not part of the mapping.
+    """
+
+    def __init__(self, reference_lengths: Optional[Dict[str, int]] = None):
+        # Chromosomes keep the @SQ header order when it is known, otherwise the order
+        # they are first seen in
+        self.reference_lengths: Dict[str, int] = dict(reference_lengths or {})
+        self._pages: Dict[str, Dict[int, Page]] = {
+            chrom: {} for chrom in self.reference_lengths
+        }
+
+    def _get_page(self, chrom: str, page_index: int) -> Page:
+        chrom_pages = self._pages.get(chrom)
+        if chrom_pages is None:
+            chrom_pages = self._pages[chrom] = {}
+        page = chrom_pages.get(page_index)
+        if page is None:
+            page = chrom_pages[page_index] = array("I", EMPTY_PAGE)
+        return page
+
+    def add_interval(self, chrom: str, start: int, stop: int, depth: int = 1):
+        """
+        Add depth, one read by default, to every position in the half open interval
+        [start, stop).
+        """
+        while start < stop:
+            page_index = start >> PAGE_SHIFT
+            offset = start & PAGE_MASK
+            block_stop = min(stop - start + offset, PAGE_SIZE)
+            page = self._get_page(chrom, page_index)
+            page[offset:block_stop] = array(
+                "I", [page_depth + depth for page_depth in page[offset:block_stop]]
+            )
+            start += block_stop - offset
+
+    def add_intervals(
+        self, chrom: str, intervals: Iterable[Tuple[int, int]], depth: int = 1
+    ):
+        """
+        Add depth to every position of each half open interval, such as those of a chunk
+        of alignments. Overlapping intervals are added as one cluster, so a position is
+        written once however many of them cover it.
+        """
+        cluster: List[Tuple[int, int]] = []
+        cluster_stop = 0
+        for start, stop in sorted(intervals):
+            if start >= cluster_stop and cluster:
+                self._add_cluster(chrom, cluster, depth)
+                cluster = []
+            cluster.append((start, stop))
+            cluster_stop = max(cluster_stop, stop)
+        if cluster:
+            self._add_cluster(chrom, cluster, depth)
+
+    def _add_cluster(self, chrom: str, cluster: List[Tuple[int, int]], depth: int):
+        """
+        Add depth to a cluster of overlapping intervals. The depth added between two
+        interval ends is summed from the depth changes at the ends, then repeated over
+        the positions in between.
+        """
+        if len(cluster) == 1:
+            self.add_interval(chrom, *cluster[0], depth)
+            return
+        depth_changes: Dict[int, int] = {}
+        for start, stop in cluster:
+            depth_changes[start] = depth_changes.get(start, 0) + depth
+            depth_changes[stop] = depth_changes.get(stop, 0) - depth
+        positions = sorted(depth_changes)
+        run_depths = accumulate(depth_changes[pos] for pos in positions)
+        added_depths = chain.from_iterable(
+            repeat(run_depth, run_stop - run_start)
+            for run_start, run_stop, run_depth in zip(
+                positions, positions[1:], run_depths
+            )
+        )
+        start, stop = positions[0], positions[-1]
+        while start < stop:
+            page_index = start >> PAGE_SHIFT
+            offset = start & PAGE_MASK
+            block_stop = min(stop - start + offset, PAGE_SIZE)
+            page = self._get_page(chrom, page_index)
+            page[offset:block_stop] = array(
+                "I",
+                map(
+                    add,
+                    page[offset:block_stop],
+                    islice(added_depths, block_stop - offset),
+                ),
+            )
+            start += block_stop - offset
+
+    def add_depth_runs(self, depth_runs: Iterable[Tuple[str, int, int, int]]):
+        """
+        Add (chrom, start, stop, depth) runs as iter_depth_runs reports them.
+        """
+        for chrom, start, stop, depth in depth_runs:
+            self.add_interval(chrom, start, stop, depth)
+
+    def merge(self, other: "CoverageAccumulator"):
+        """
+        Add the read depths of another accumulator into this one.
+        """
+        for chrom, length in other.reference_lengths.items():
+            self.reference_lengths.setdefault(chrom, length)
+        for chrom, other_pages in other._pages.items():
+            chrom_pages = self._pages.setdefault(chrom, {})
+            for page_index, other_page in other_pages.items():
+                page = chrom_pages.get(page_index)
+                if page is None:
+                    chrom_pages[page_index] = array("I", other_page)
+                else:
+                    add_page(page, other_page)
+
+    def subset(
+        self, intervals: Dict[str, List[Tuple[int, int]]]
+    ) -> "CoverageAccumulator":
+        """
+        A copy holding only the depths inside the half open intervals per chromosome.
+        """
+        coverage_subset = CoverageAccumulator(self.reference_lengths)
+        for chrom, chrom_intervals in intervals.items():
+            chrom_pages = self._pages.get(chrom, {})
+            for start, stop in chrom_intervals:
+                while start < stop:
+                    page_index = start >> PAGE_SHIFT
+                    offset = start & PAGE_MASK
+                    block_stop = min(stop - start + offset, PAGE_SIZE)
+                    page = chrom_pages.get(page_index)
+                    if page is not None:
+                        # An array slice only takes arrays, a view takes shared pages
+                        memoryview(coverage_subset._get_page(chrom, page_index))[
+                            offset:block_stop
+                        ] = page[offset:block_stop]
+                    start += block_stop - offset
+        return coverage_subset
+
+    def depth(self, chrom: str, pos: int) -> int:
+        chrom_pages = self._pages.get(chrom)
+        if not chrom_pages:
+            return 0
+        page = chrom_pages.get(pos >> PAGE_SHIFT)
+        if page is None:
+            return 0
+        return page[pos & PAGE_MASK]
+
+    def iter_depth_runs(self) -> Iterator[Tuple[str, int, int, int]]:
+        """
+        Yield (chrom, start, stop, depth) for every run of adjacent positions with the
+        same read depth, as half open [start, stop) position intervals sorted within
+        each chromosome. Uncovered positions are left out.
+        """
+        for chrom, chrom_pages in self._pages.items():
+            run_start = run_stop = run_depth = 0
+            for page_index in sorted(chrom_pages):
+                page_start = page_index << PAGE_SHIFT
+                for start, stop, depth in iter_page_runs(chrom_pages[page_index]):
+                    start += page_start
+                    if depth == run_depth and start == run_stop:
+                        run_stop = stop + page_start
+                        continue
+                    if run_depth:
+                        yield chrom, run_start, run_stop, run_depth
+                    run_start, run_stop, run_depth = start, stop + page_start, depth
+            if run_depth:
+                yield chrom, run_start, run_stop, run_depth
+
+    def iter_depths(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yield (chrom, pos, depth) for every covered position, sorted by position within
+        each chromosome.
+        """
+        for chrom, start, stop, depth in self.iter_depth_runs():
+            for pos in range(start, stop):
+                yield chrom, pos, depth
+
+    def pop_depths(
+        self, chrom: str, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        Yield (pos, depth) for the covered positions of a chromosome in [start, stop) in
+        order and drop them, pages that end before stop are freed. Without a start or
+        stop the range is open on that side.
+        """
+        chrom_pages = self._pages.get(chrom, {})
+        for page_index in sorted(chrom_pages):
+            page_start = page_index << PAGE_SHIFT
+            if stop is not None and page_start >= stop:
+                break
+            start_offset = 0 if start is None else max(start - page_start, 0)
+            if start_offset >= PAGE_SIZE:
+                continue
+            stop_offset = PAGE_SIZE
+            if stop is not None:
+                stop_offset = min(stop - page_start, PAGE_SIZE)
+            page = chrom_pages[page_index]
+            for run_start, run_stop, depth in iter_page_runs(
+                page, start_offset, stop_offset
+            ):
+                if depth:
+                    for offset in range(run_start, run_stop):
+                        yield page_start + offset, depth
+            if stop_offset == PAGE_SIZE:
+                del chrom_pages[page_index]
+            else:
+                page[start_offset:stop_offset] = EMPTY_PAGE[start_offset:stop_offset]
+
+    def __getitem__(self, position: GenomicPosition) -> int:
+        depth = self.depth(position.chrom, position.pos)
+        if not depth:
+            raise KeyError(position)
+        return depth
+
+    def __iter__(self) -> Iterator[GenomicPosition]:
+        for chrom, pos, _ in self.iter_depths():
+            yield GenomicPosition(chrom, pos)
+
+    def __len__(self) -> int:
+        # Views of shared pages can not count their zeros, they are counted in a copy
+        return sum(
+            PAGE_SIZE - (page if isinstance(page, array) else array("I", page)).count(0)
+            for chrom_pages in self._pages.values()
+            for page in chrom_pages.values()
+        )
+
+    def nbytes(self) -> int:
+        """
+        The memory used by the depth arrays.
+        """
+        return sum(
+            page.itemsize * len(page)
+            for chrom_pages in self._pages.values()
+            for page in chrom_pages.values()
+        )
+
+
+class SharedCoverageAccumulator(CoverageAccumulator):
+    """
+    Read depths of every position of the @SQ references, held in one shared memory
+    array per chromosome. The process that creates it owns the arrays, worker processes
+    attach to them by name and add their depths in place. Depths outside a reference,
+    such as the odd position before its start, go to private pages.
+
+    Workers that add to the same arrays must own disjoint ranges of positions, see own.
+    The depths are read straight from the arrays, which are released with close, or
+    from a private copy.
+    """
+
+    def __init__(
+        self,
+        reference_lengths: Dict[str, int],
+        shared_memory_names: Optional[Dict[str, str]] = None,
+    ):
+        super().__init__(reference_lengths)
+        self._shared_memories: Dict[str, SharedMemory] = {}
+        self._owned_spans: Optional[Dict[str, Tuple[float, float]]] = None
+        for chrom, length in self.reference_lengths.items():
+            page_count = (length >> PAGE_SHIFT) + 1
+            if shared_memory_names is None:
+                shared_memory = SharedMemory(
+                    create=True, size=page_count * PAGE_SIZE * EMPTY_PAGE.itemsize
+                )
+            else:
+                shared_memory = SharedMemory(shared_memory_names[chrom])
+            self._shared_memories[chrom] = shared_memory
+            assert shared_memory.buf is not None
+            depths = shared_memory.buf.cast("I")
+            self._pages[chrom] = {
+                page_index: depths[page_start : page_start + PAGE_SIZE]
+                for page_index, page_start in enumerate(
+                    range(0, page_count << PAGE_SHIFT, PAGE_SIZE)
+                )
+            }
+            depths.release()
+
+    @property
+    def shared_memory_names(self) -> Dict[str, str]:
+        return {
+            chrom: shared_memory.name
+            for chrom, shared_memory in self._shared_memories.items()
+        }
+
+    def own(self, start: Optional[GenomicPosition], stop: Optional[GenomicPosition]):
+        """
+        Only add depths at the positions from start up to but excluding stop from now
+        on, in @SQ order. Without a start or stop the range is open on that side.
+        """
+        chroms = list(self.reference_lengths)
+        start_index = 0 if start is None else chroms.index(start.chrom)
+        stop_index = len(chroms) - 1 if stop is None else chroms.index(stop.chrom)
+        self._owned_spans = {}
+        for chrom_index in range(start_index, stop_index + 1):
+            span_start = -math.inf
+            if start is not None and chrom_index == start_index:
+                span_start = start.pos
+            span_stop = math.inf
+            if stop is not None and chrom_index == stop_index:
+                span_stop = stop.pos
+            self._owned_spans[chroms[chrom_index]] = (span_start, span_stop)
+
+    def owns(self, chrom: str, pos: int) -> bool:
+        if self._owned_spans is None:
+            return True
+        span_start, span_stop = self._owned_spans.get(chrom, (0, 0))
+        return span_start <= pos < span_stop
+
+    def add_interval(self, chrom: str, start: int, stop: int, depth: int = 1):
+        if self._owned_spans is not None:
+            span_start, span_stop = self._owned_spans.get(chrom, (0, 0))
+            start, stop = max(start, span_start), min(stop, span_stop)  # type: ignore
+        super().add_interval(chrom, start, stop, depth)
+
+    def add_intervals(
+        self, chrom: str, intervals: Iterable[Tuple[int, int]], depth: int = 1
+    ):
+        if self._owned_spans is not None:
+            span_start, span_stop = self._owned_spans.get(chrom, (0, 0))
+            intervals = [
+                (max(start, span_start), min(stop, span_stop))  # type: ignore
+                for start, stop in intervals
+                if start < span_stop and stop > span_start
+            ]
+        super().add_intervals(chrom, intervals, depth)
+
+    def get_private_coverage(self) -> CoverageAccumulator:
+        """
+        The depths added to private pages rather than to the shared arrays.
+        """
+        private_coverage = CoverageAccumulator()
+        for chrom, chrom_pages in self._pages.items():
+            for page_index, page in chrom_pages.items():
+                if isinstance(page, array):
+                    private_coverage._get_page(chrom, page_index)[:] = page
+        return private_coverage
+
+    def copy(self) -> CoverageAccumulator:
+        """
+        A copy in ordinary private pages, the pages without any depth are left out.
+        """
+        coverage = CoverageAccumulator(self.reference_lengths)
+        for chrom, chrom_pages in self._pages.items():
+            for page_index, page in chrom_pages.items():
+                if page != EMPTY_PAGE:
+                    page_copy = array("I")
+                    page_copy.frombytes(memoryview(page).cast("B"))
+                    coverage._pages[chrom][page_index] = page_copy
+        return coverage
+
+    def close(self, unlink: bool = False):
+        """
+        Release the shared arrays of this process, unlink frees them for every process
+        and is up to the one that created them.
+        """
+        for chrom, shared_memory in self._shared_memories.items():
+            for page in self._pages.pop(chrom, {}).values():
+                if isinstance(page, memoryview):
+                    page.release()
+            shared_memory.close()
+            if unlink:
+                shared_memory.unlink()
+        self._shared_memories.clear()
+
+
+class BaseCountAccumulator:
+    """
+    Counts of the quality passing read bases over A, C, G, T and N for every covered
+    reference position, in sparse pages of interleaved count vectors per chromosome.
+    A depth page next to every count page holds the sum of each count vector, so the
+    covered positions are found as runs without summing the counts.
+    """
+
+    def __init__(self):
+        self._pages: Dict[str, Dict[int, array]] = {}
+        self._depths = CoverageAccumulator()
+
+    def _get_page(self, chrom: str, page_index: int) -> array:
+        chrom_pages = self._pages.setdefault(chrom, {})
+        page = chrom_pages.get(page_index)
+        if page is None:
+            page = chrom_pages[page_index] = array("I", EMPTY_BASE_COUNT_PAGE)
+        return page
+
+    def add_bases(self, chrom: str, start: int, bases: bytes):
+        """
+        Count one read base at every position from start on, the bases are in reference
+        order. Each base is added across a whole block with one strided slice per base
+        that occurs in it rather than one update per position.
+        """
+        base_codes = bases.translate(BASE_CODE_TABLE)
+        stop = start + len(base_codes)
+        self._depths.add_interval(chrom, start, stop)
+        while start < stop:
+            offset = start & PAGE_MASK
+            block_stop = min(stop - start + offset, PAGE_SIZE)
+            block_codes = base_codes[: block_stop - offset]
+            base_codes = base_codes[block_stop - offset :]
+            page = self._get_page(chrom, start >> PAGE_SHIFT)
+            for base_code, base_code_mask in enumerate(BASE_CODE_MASKS):
+                if base_code not in block_codes:
+                    continue
+                counts = slice(
+                    BASE_COUNT_WIDTH * offset + base_code,
+                    BASE_COUNT_WIDTH * block_stop,
+                    BASE_COUNT_WIDTH,
+                )
+                page[counts] = array(
+                    "I", map(add, page[counts], block_codes.translate(base_code_mask))
+                )
+            start += block_stop - offset
+
+    def merge(self, other: "BaseCountAccumulator"):
+        """
+        Add the base counts of another accumulator into this one.
+        """
+        self._depths.merge(other._depths)
+        for chrom, other_pages in other._pages.items():
+            chrom_pages = self._pages.setdefault(chrom, {})
+            for page_index, other_page in other_pages.items():
+                page = chrom_pages.get(page_index)
+                if page is None:
+                    chrom_pages[page_index] = array("I", other_page)
+                else:
+                    add_page(page, other_page)
+
+    def base_counts(self, chrom: str, pos: int) -> Tuple[int, ...]:
+        """
+        The counts of a position in BASE_COUNT_ORDER.
+        """
+        page = self._pages.get(chrom, {}).get(pos >> PAGE_SHIFT)
+        if page is None:
+            return (0,) * BASE_COUNT_WIDTH
+        offset = BASE_COUNT_WIDTH * (pos & PAGE_MASK)
+        return tuple(page[offset : offset + BASE_COUNT_WIDTH])
+
+    def depth(self, chrom: str, pos: int) -> int:
+        return self._depths.depth(chrom, pos)
+
+    def iter_base_counts(self) -> Iterator[Tuple[str, int, Tuple[int, ...]]]:
+        """
+        Yield (chrom, pos, counts in BASE_COUNT_ORDER) for every covered position,
+        sorted by position within each chromosome.
+        """
+        for chrom, start, stop, _ in self._depths.iter_depth_runs():
+            while start < stop:
+                offset = start & PAGE_MASK
+                block_stop = min(stop - start + offset, PAGE_SIZE)
+                page = self._pages[chrom][start >> PAGE_SHIFT]
+                counts_start = BASE_COUNT_WIDTH * offset
+                counts_stop = BASE_COUNT_WIDTH * block_stop
+                # One strided column per base, zipped back into count vectors
+                base_columns = [
+                    page[counts_start + base_code : counts_stop : BASE_COUNT_WIDTH]
+                    for base_code in range(BASE_COUNT_WIDTH)
+                ]
+                yield from zip(
+                    repeat(chrom),
+                    range(start, start + block_stop - offset),
+                    zip(*base_columns),
+                )
+                start += block_stop - offset
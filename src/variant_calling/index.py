@@ -0,0 +1,354 @@
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from .bgzf import BgzfReader, BgzfWriter
+
+# A BAI index is a CSI index with the binning scheme fixed at 16kb leaves and 5 levels
+BAI_MIN_SHIFT = 14
+BAI_DEPTH = 5
+BAI_MAGIC = b"BAI\x01"
+CSI_MAGIC = b"CSI\x01"
+TABIX_MAGIC = b"TBI\x01"
+# Tabix format flag for zero based, half open coordinates like BED
+TABIX_FORMAT_UCSC = 0x10000
+# Holds the mapped and unmapped read counts rather than chunks
+BAI_PSEUDO_BIN = 37450
+# Chunks this close together are read in one go rather than seeking between them
+CHUNK_MERGE_GAP = 1 << 16
+
+Chunk = Tuple[int, int]  # Start and end virtual offsets
+
+
+@dataclass
+class ReferenceIndex:
+    bins: Dict[int, List[Chunk]] = field(default_factory=dict)
+    # Smallest virtual offset of a read overlapping each leaf sized window, BAI only
+    linear_index: List[int] = field(default_factory=list)
+
+
+@dataclass
+class AlignmentIndex:
+    min_shift: int
+    depth: int
+    references: List[ReferenceIndex]
+
+    def query(self, reference_id: int, start: int, end: int) -> List[Chunk]:
+        """
+        The merged file chunks that hold every alignment overlapping the zero based,
+        half open interval [start, end) of a reference.
+        """
+        if reference_id < 0 or reference_id >= len(self.references):
+            return []
+        reference_index = self.references[reference_id]
+        min_offset = 0
+        linear_window = start >> self.min_shift
+        if reference_index.linear_index:
+            min_offset = reference_index.linear_index[
+                min(linear_window, len(reference_index.linear_index) - 1)
+            ]
+        chunks = [
+            chunk
+            for bin_number in reg2bins(start, end, self.min_shift, self.depth)
+            for chunk in reference_index.bins.get(bin_number, [])
+            if chunk[1] > min_offset
+        ]
+        return merge_chunks(chunks)
+
+
+@dataclass
+class TabixColumns:
+    """
+    Where the sequence name, start and end of a record sit in a tab separated line,
+    as the one based column numbers tabix uses. An end column of 0 means one base.
+    """
+
+    seq: int = 1
+    begin: int = 2
+    end: int = 3
+    format: int = TABIX_FORMAT_UCSC
+    meta: str = "#"
+    skip: int = 0
+
+
+# bedGraph and BED lines, 'chrom start end ...' with zero based, half open coordinates
+TABIX_BED_COLUMNS = TabixColumns()
+
+
+class TabixIndexBuilder:
+    """
+    Collect the tabix index of a BGZF compressed, sorted text file line by line while
+    it is written.
+    """
+
+    def __init__(self, columns: TabixColumns = TABIX_BED_COLUMNS):
+        self.columns = columns
+        self.names: List[str] = []
+        self.references: List[ReferenceIndex] = []
+        self._reference_ids: Dict[str, int] = {}
+        self._meta = columns.meta.encode()
+
+    def add_line(self, line: bytes, chunk: Chunk):
+        """
+        Record a line along with the virtual offsets it was written between.
+        """
+        if line.startswith(self._meta):
+            return
+        fields = line.rstrip(b"\n").split(b"\t")
+        chrom = fields[self.columns.seq - 1].decode()
+        start = int(fields[self.columns.begin - 1])
+        if not self.columns.format & TABIX_FORMAT_UCSC:
+            start -= 1
+        end = int(fields[self.columns.end - 1]) if self.columns.end else start + 1
+        # Reverse reads walk the reference backwards and can cover positions before
+        # the start, bins and linear windows only exist from zero on
+        start = max(start, 0)
+        reference_id = self._reference_ids.get(chrom)
+        if reference_id is None:
+            reference_id = self._reference_ids[chrom] = len(self.names)
+            self.names.append(chrom)
+            self.references.append(ReferenceIndex())
+        add_to_reference_index(
+            self.references[reference_id], start, max(end, start + 1), chunk
+        )
+
+    def write(self, index_file: str):
+        names = b"".join(name.encode() + b"\x00" for name in self.names)
+        with BgzfWriter(index_file) as out_file:
+            out_file.write(TABIX_MAGIC)
+            out_file.write(
+                struct.pack(
+                    "<8i",
+                    len(self.names),
+                    self.columns.format,
+                    self.columns.seq,
+                    self.columns.begin,
+                    self.columns.end,
+                    ord(self.columns.meta),
+                    self.columns.skip,
+                    len(names),
+                )
+            )
+            out_file.write(names)
+            write_bai_references(out_file, self.references)
+
+
+def reg2bin(
+    start: int, end: int, min_shift: int = BAI_MIN_SHIFT, depth: int = BAI_DEPTH
+) -> int:
+    """
+    The smallest bin that fully holds the zero based, half open interval [start, end).
+    """
+    end -= 1
+    shift = min_shift
+    first_bin = ((1 << depth * 3) - 1) // 7
+    for level in range(depth, 0, -1):
+        if start >> shift == end >> shift:
+            return first_bin + (start >> shift)
+        shift += 3
+        first_bin -= 1 << (level - 1) * 3
+    return 0
+
+
+def reg2bins(
+    start: int, end: int, min_shift: int = BAI_MIN_SHIFT, depth: int = BAI_DEPTH
+) -> List[int]:
+    """
+    Every bin that may hold alignments overlapping the interval [start, end).
+    """
+    bins: List[int] = []
+    end -= 1
+    shift = min_shift + depth * 3
+    first_bin = 0
+    for level in range(depth + 1):
+        bins.extend(range(first_bin + (start >> shift), first_bin + (end >> shift) + 1))
+        shift -= 3
+        first_bin += 1 << level * 3
+    return bins
+
+
+def merge_chunks(chunks: List[Chunk]) -> List[Chunk]:
+    """
+    Sort chunks and merge those that overlap or sit close together in the file.
+    """
+    merged_chunks: List[Chunk] = []
+    for chunk_start, chunk_end in sorted(chunks):
+        if merged_chunks and (chunk_start >> 16) - (
+            merged_chunks[-1][1] >> 16
+        ) <= CHUNK_MERGE_GAP:
+            if chunk_end > merged_chunks[-1][1]:
+                merged_chunks[-1] = (merged_chunks[-1][0], chunk_end)
+        else:
+            merged_chunks.append((chunk_start, chunk_end))
+    return merged_chunks
+
+
+def read_struct(in_file: BinaryIO, fmt: str) -> Tuple:
+    return struct.unpack(fmt, in_file.read(struct.calcsize(fmt)))
+
+
+def read_reference_bins(
+    in_file: BinaryIO, with_loffset: bool
+) -> Dict[int, List[Chunk]]:
+    bins: Dict[int, List[Chunk]] = {}
+    (bin_count,) = read_struct(in_file, "<i")
+    for _ in range(bin_count):
+        (bin_number,) = read_struct(in_file, "<I")
+        if with_loffset:
+            read_struct(in_file, "<Q")
+        (chunk_count,) = read_struct(in_file, "<i")
+        chunk_offsets = read_struct(in_file, f"<{2 * chunk_count}Q")
+        if bin_number != BAI_PSEUDO_BIN or with_loffset:
+            bins[bin_number] = list(zip(chunk_offsets[::2], chunk_offsets[1::2]))
+    return bins
+
+
+def read_bai_references(
+    in_file: BinaryIO, reference_count: int
+) -> List[ReferenceIndex]:
+    """
+    Read the per reference bins and linear index BAI and tabix indexes share.
+    """
+    references: List[ReferenceIndex] = []
+    for _ in range(reference_count):
+        bins = read_reference_bins(in_file, with_loffset=False)
+        (linear_window_count,) = read_struct(in_file, "<i")
+        linear_index = list(read_struct(in_file, f"<{linear_window_count}Q"))
+        references.append(ReferenceIndex(bins, linear_index))
+    return references
+
+
+def read_bai_index(in_file: BinaryIO) -> AlignmentIndex:
+    (reference_count,) = read_struct(in_file, "<i")
+    return AlignmentIndex(
+        BAI_MIN_SHIFT, BAI_DEPTH, read_bai_references(in_file, reference_count)
+    )
+
+
+def read_csi_index(in_file: BinaryIO) -> AlignmentIndex:
+    min_shift, depth, aux_length = read_struct(in_file, "<3i")
+    in_file.read(aux_length)
+    (reference_count,) = read_struct(in_file, "<i")
+    references = [
+        ReferenceIndex(read_reference_bins(in_file, with_loffset=True))
+        for _ in range(reference_count)
+    ]
+    return AlignmentIndex(min_shift, depth, references)
+
+
+def read_alignment_index(index_file: str) -> AlignmentIndex:
+    """
+    Read a BAI index, or a CSI index which is itself BGZF compressed.
+    """
+    with open(index_file, "rb") as in_file:
+        if in_file.read(4) == BAI_MAGIC:
+            return read_bai_index(in_file)
+    with BgzfReader(index_file) as bgzf_reader:
+        if bgzf_reader.read(4) != CSI_MAGIC:
+            raise ValueError(f"{index_file} is not a BAI or CSI index")
+        return read_csi_index(bgzf_reader)  # type: ignore
+
+
+def write_bai_references(
+    out_file: Union[BinaryIO, BgzfWriter], references: List[ReferenceIndex]
+):
+    for reference_index in references:
+        out_file.write(struct.pack("<i", len(reference_index.bins)))
+        for bin_number, chunks in sorted(reference_index.bins.items()):
+            out_file.write(struct.pack("<Ii", bin_number, len(chunks)))
+            for chunk in chunks:
+                out_file.write(struct.pack("<2Q", *chunk))
+        out_file.write(struct.pack("<i", len(reference_index.linear_index)))
+        for linear_offset in reference_index.linear_index:
+            out_file.write(struct.pack("<Q", linear_offset))
+
+
+def write_bai_index(alignment_index: AlignmentIndex, index_file: str):
+    with open(index_file, "wb") as out_file:
+        out_file.write(BAI_MAGIC)
+        out_file.write(struct.pack("<i", len(alignment_index.references)))
+        write_bai_references(out_file, alignment_index.references)
+
+
+def add_to_reference_index(
+    reference_index: ReferenceIndex,
+    start: int,
+    end: int,
+    chunk: Chunk,
+):
+    """
+    Record that the alignment stored in chunk covers the half open [start, end).
+    Alignments must be added in file order.
+    """
+    bin_chunks = reference_index.bins.setdefault(reg2bin(start, end), [])
+    if bin_chunks and bin_chunks[-1][1] == chunk[0]:
+        bin_chunks[-1] = (bin_chunks[-1][0], chunk[1])
+    else:
+        bin_chunks.append(chunk)
+    linear_index = reference_index.linear_index
+    for window in range(start >> BAI_MIN_SHIFT, ((end - 1) >> BAI_MIN_SHIFT) + 1):
+        if window >= len(linear_index):
+            linear_index.extend([0] * (window + 1 - len(linear_index)))
+        if not linear_index[window]:
+            linear_index[window] = chunk[0]
+
+
+def find_alignment_index(bam_file: str) -> Optional[str]:
+    """
+    Look for the index samtools would use, 'x.bam.bai', 'x.bai', 'x.bam.csi' or 'x.csi'.
+    """
+    bam_root = bam_file[:-4] if bam_file.endswith(".bam") else bam_file
+    for index_file in [
+        f"{bam_file}.bai",
+        f"{bam_root}.bai",
+        f"{bam_file}.csi",
+        f"{bam_root}.csi",
+    ]:
+        if os.path.exists(index_file):
+            return index_file
+    return None
+
+
+def read_tabix_index(index_file: str) -> Tuple[TabixColumns, List[str], AlignmentIndex]:
+    with BgzfReader(index_file) as bgzf_reader:
+        if bgzf_reader.read(4) != TABIX_MAGIC:
+            raise ValueError(f"{index_file} is not a tabix index")
+        reference_count, tabix_format, seq, begin, end, meta, skip, names_length = (
+            read_struct(bgzf_reader, "<8i")  # type: ignore
+        )
+        names = bgzf_reader.read(names_length).rstrip(b"\x00").decode().split("\x00")
+        references = read_bai_references(bgzf_reader, reference_count)  # type: ignore
+    columns = TabixColumns(seq, begin, end, tabix_format, chr(meta), skip)
+    return columns, names, AlignmentIndex(BAI_MIN_SHIFT, BAI_DEPTH, references)
+
+
+def iter_tabix_lines(
+    bgzf_file: str, chrom: str, start: int, end: int, index_file: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Fetch the lines of a tabix indexed file that overlap the zero based, half open
+    interval [start, end) of a sequence, only the blocks the index lists are read.
+    """
+    columns, names, tabix_index = read_tabix_index(index_file or f"{bgzf_file}.tbi")
+    if chrom not in names:
+        return
+    chunks = tabix_index.query(names.index(chrom), start, end)
+    with BgzfReader(bgzf_file) as bgzf_reader:
+        for chunk_start, chunk_end in chunks:
+            bgzf_reader.seek(chunk_start)
+            while bgzf_reader.tell() < chunk_end:
+                line = bgzf_reader.readline().decode()
+                if not line:
+                    break
+                fields = line.rstrip("\n").split("\t")
+                line_start = int(fields[columns.begin - 1])
+                if not columns.format & TABIX_FORMAT_UCSC:
+                    line_start -= 1
+                line_end = (
+                    int(fields[columns.end - 1]) if columns.end else line_start + 1
+                )
+                if fields[columns.seq - 1] == chrom and line_start < end and (
+                    max(line_end, line_start + 1) > start
+                ):
+                    yield line
@@ -0,0 +1,236 @@
+import cProfile
+import io
+import logging
+import pstats
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("variant_calling")
+
+# Seconds between two progress messages
+PROGRESS_INTERVAL_SECONDS = 10.0
+# Number of functions the profile summary lists
+PROFILE_SUMMARY_LINES = 25
+# The stages in pipeline order, used to order the summary
+PIPELINE_STAGES = [
+    "record parsing",
+    "coverage extraction",
+    "variant extraction",
+    "aggregation",
+    "output writing",
+]
+
+
+@dataclass
+class QueueMetrics:
+    """
+    How full a bounded queue between two stages ran and how long each side waited on
+    it. A producer waiting on a full queue is held back by the stage after it, a
+    consumer waiting on an empty queue by the stage before it.
+    """
+
+    capacity: int
+    puts: int = 0
+    depth_total: int = 0
+    max_depth: int = 0
+    put_wait_seconds: float = 0.0
+    get_wait_seconds: float = 0.0
+
+    def add_put(self, depth: int, wait_seconds: float):
+        self.puts += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        self.put_wait_seconds += wait_seconds
+
+    def merge(self, other: "QueueMetrics"):
+        self.capacity = max(self.capacity, other.capacity)
+        self.puts += other.puts
+        self.depth_total += other.depth_total
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.put_wait_seconds += other.put_wait_seconds
+        self.get_wait_seconds += other.get_wait_seconds
+
+
+class PipelineMetrics:
+    """
+    Time spent per pipeline stage along with the reads and reference bases evaluated so
+    far, the reads each read filter rejected and the result cache hits and misses.
+    Progress is logged every progress_interval seconds.
+    """
+
+    def __init__(self, progress_interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.progress_interval = progress_interval
+        self.stage_seconds: Dict[str, float] = {}
+        self.queues: Dict[str, QueueMetrics] = {}
+        self.reads = 0
+        self.bases = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rejected_reads: Dict[str, int] = {}
+        self.start_time = time.perf_counter()
+        self._last_progress_time = self.start_time
+
+    @contextmanager
+    def stage(self, stage_name: str) -> Iterator[None]:
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage_name] = (
+                self.stage_seconds.get(stage_name, 0.0)
+                + time.perf_counter()
+                - stage_start
+            )
+
+    def add_reads(self, sam_records: List[Any], bases: int):
+        """
+        Count a chunk of evaluated alignments and the reference bases they covered.
+        """
+        if not sam_records:
+            return
+        self.reads += len(sam_records)
+        self.bases += bases
+        self.log_progress(f"{sam_records[-1]['RNAME']}:{sam_records[-1]['POS']}")
+
+    @contextmanager
+    def uncounted(self) -> Iterator[None]:
+        """
+        Leave the reads, bases and read filter rejections within the block out of the
+        counts, such as those of alignments another process counts as well. The time
+        spent is still added to the stages.
+        """
+        reads, bases, rejected_reads = self.reads, self.bases, self.rejected_reads
+        self.rejected_reads = dict(rejected_reads)
+        try:
+            yield
+        finally:
+            self.reads, self.bases, self.rejected_reads = reads, bases, rejected_reads
+
+    def log_progress(self, location: Optional[str] = None):
+        """
+        Log the reads and bases per second so far once the progress interval has passed
+        since the last time, along with where in the alignments the run is when known.
+        """
+        now = time.perf_counter()
+        if now - self._last_progress_time < self.progress_interval:
+            return
+        self._last_progress_time = now
+        elapsed = now - self.start_time
+        logger.info(
+            "%d reads, %.0f reads/sec, %.0f bases/sec%s",
+            self.reads,
+            self.reads / elapsed,
+            self.bases / elapsed,
+            f", at {location}" if location else "",
+        )
+
+    def get_queue_metrics(self, queue_name: str, capacity: int) -> QueueMetrics:
+        queue_metrics = self.queues.get(queue_name)
+        if queue_metrics is None:
+            queue_metrics = self.queues[queue_name] = QueueMetrics(capacity)
+        return queue_metrics
+
+    def merge(self, other: "PipelineMetrics"):
+        """
+        Add the counts of another process into these ones.
+        """
+        for stage_name, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage_name] = (
+                self.stage_seconds.get(stage_name, 0.0) + seconds
+            )
+        for queue_name, queue_metrics in other.queues.items():
+            self.get_queue_metrics(queue_name, queue_metrics.capacity).merge(
+                queue_metrics
+            )
+        self.reads += other.reads
+        self.bases += other.bases
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        for filter_name, reads in other.rejected_reads.items():
+            self.rejected_reads[filter_name] = (
+                self.rejected_reads.get(filter_name, 0) + reads
+            )
+
+    def log_summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        logger.info(
+            "Evaluated %d reads and %d bases in %.2f seconds, %.0f reads/sec",
+            self.reads,
+            self.bases,
+            elapsed,
+            self.reads / elapsed if elapsed else 0.0,
+        )
+        if self.cache_hits or self.cache_misses:
+            logger.info(
+                "Result cache: %d hits, %d misses", self.cache_hits, self.cache_misses
+            )
+        for filter_name, reads in sorted(self.rejected_reads.items()):
+            logger.info("  rejected by %-17s %10d reads", filter_name, reads)
+        stage_names = sorted(
+            self.stage_seconds,
+            key=lambda stage_name: (
+                PIPELINE_STAGES.index(stage_name)
+                if stage_name in PIPELINE_STAGES
+                else len(PIPELINE_STAGES)
+            ),
+        )
+        # Stage times are summed over every worker and can add up past the wall time
+        for stage_name in stage_names:
+            logger.info(
+                "  %-20s %10.3f sec",
+                stage_name,
+                self.stage_seconds[stage_name],
+            )
+        for queue_name, queue_metrics in self.queues.items():
+            logger.info(
+                "  queue %-14s mean depth %.1f of %d, producer blocked %.3f sec, "
+                "consumer starved %.3f sec",
+                queue_name,
+                queue_metrics.depth_total / max(queue_metrics.puts, 1),
+                queue_metrics.capacity,
+                queue_metrics.put_wait_seconds,
+                queue_metrics.get_wait_seconds,
+            )
+
+
+pipeline_metrics = PipelineMetrics()
+
+
+def get_pipeline_metrics() -> PipelineMetrics:
+    return pipeline_metrics
+
+
+def reset_pipeline_metrics(
+    progress_interval: float = PROGRESS_INTERVAL_SECONDS,
+) -> PipelineMetrics:
+    """
+    Start counting from zero, each run of the pipeline and each worker process does so.
+    """
+    global pipeline_metrics
+    pipeline_metrics = PipelineMetrics(progress_interval)
+    return pipeline_metrics
+
+
+@contextmanager
+def profiled(profile_file: Optional[str]) -> Iterator[None]:
+    """
+    Run the body under cProfile and dump the pstats to profile_file, the heaviest
+    functions by cumulative time are logged as well. Does nothing without a file.
+    """
+    if not profile_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(
+            PROFILE_SUMMARY_LINES
+        )
+        logger.info("Profile written to %s\n%s", profile_file, summary.getvalue())
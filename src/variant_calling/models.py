@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+
+# Frozen so we can use it as a dict key
+@dataclass(order=True, frozen=True)
+class Variant:
+    chrom: str
+    pos: int
+    ref: str
+    alt: str
+
+    def to_str(self):
+        return f"{self.chrom}-{self.pos}-{self.ref}-{self.alt}"
+
+
+@dataclass(order=True, frozen=True)
+class GenomicPosition:
+    chrom: str
+    pos: int
+
+    def to_str(self):
+        return f"{self.chrom}-{self.pos}"
+
+
+@dataclass(order=True, frozen=True)
+class GenomicRegion:
+    """
+    A one based, inclusive reference interval, as written in 'chr19:71000-80000'.
+    """
+
+    chrom: str
+    start: int
+    end: int
+
+    def to_str(self):
+        return f"{self.chrom}:{self.start}-{self.end}"
+
+
+@dataclass(frozen=True)
+class PositionResult:
+    """
+    The final read depth of a position and the read depth of each variant called there.
+    """
+
+    chrom: str
+    pos: int
+    read_depth: int
+    variant_read_depths: Tuple[Tuple[Variant, int], ...] = ()
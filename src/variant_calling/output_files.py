@@ -0,0 +1,107 @@
+import threading
+from queue import Queue
+from typing import Iterable, List, Optional
+
+from .bgzf import BgzfWriter
+from .index import TabixColumns, TabixIndexBuilder
+
+# Bytes of text gathered before they are handed to the compression thread
+OUTPUT_BATCH_SIZE = 1 << 16
+# Batches that may wait for the compression thread before writers block
+OUTPUT_QUEUE_SIZE = 16
+
+
+class OutputFile:
+    """
+    A text output file. Plain files are written directly, compressed ones are handed in
+    batches through a bounded queue to a thread that BGZF compresses them, so the
+    compression overlaps with the calling. Given tabix columns a compressed file gets
+    a '.tbi' index next to it, its lines must then be sorted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compress: bool = False,
+        tabix_columns: Optional[TabixColumns] = None,
+    ):
+        self.path = path
+        self.compress = compress
+        self._batch: List[str] = []
+        self._batch_size = 0
+        self._error: Optional[BaseException] = None
+        if not compress:
+            self._text_file = open(path, "w")
+            return
+        self._tabix_index = TabixIndexBuilder(tabix_columns) if tabix_columns else None
+        self._queue: "Queue[Optional[bytes]]" = Queue(OUTPUT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._compress_batches, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "OutputFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text: str):
+        if not self.compress:
+            self._text_file.write(text)
+            return
+        self._batch.append(text)
+        self._batch_size += len(text)
+        if self._batch_size >= OUTPUT_BATCH_SIZE:
+            self._send_batch()
+
+    def writelines(self, lines: Iterable[str]):
+        if not self.compress:
+            self._text_file.writelines(lines)
+            return
+        for line in lines:
+            self.write(line)
+
+    def _send_batch(self):
+        if self._error is not None:
+            raise self._error
+        if self._batch:
+            self._queue.put("".join(self._batch).encode())
+        self._batch.clear()
+        self._batch_size = 0
+
+    def _compress_batches(self):
+        try:
+            with BgzfWriter(self.path) as bgzf_writer:
+                while True:
+                    batch = self._queue.get()
+                    if batch is None:
+                        break
+                    if self._tabix_index is None:
+                        bgzf_writer.write(batch)
+                        continue
+                    for line in batch.splitlines(keepends=True):
+                        line_start = bgzf_writer.tell()
+                        bgzf_writer.write(line)
+                        self._tabix_index.add_line(
+                            line, (line_start, bgzf_writer.tell())
+                        )
+            if self._tabix_index is not None:
+                self._tabix_index.write(f"{self.path}.tbi")
+        except BaseException as error:
+            self._error = error
+            # Keep draining so writers blocked on a full queue are released
+            while self._queue.get() is not None:
+                pass
+
+    def close(self):
+        if not self.compress:
+            self._text_file.close()
+            return
+        if not self._thread.is_alive():
+            return
+        if self._error is None and self._batch:
+            self._queue.put("".join(self._batch).encode())
+        self._batch.clear()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,319 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from typing import Any, Dict, List, Optional, Tuple
+
+from .alignment import DEFAULT_LOOKBEHIND, evaluate_sam_record_chunk, filter_sam_records
+from .coverage import CoverageAccumulator, SharedCoverageAccumulator
+from .instrumentation import (
+    PipelineMetrics,
+    get_pipeline_metrics,
+    reset_pipeline_metrics,
+)
+from .models import GenomicPosition
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .sam_reader import (
+    find_sam_record_offset,
+    iter_sam_record_chunks,
+    parse_reference_lengths,
+    read_sam_header,
+    read_sam_record_key,
+    split_sam_file,
+)
+from .variant_counter import VariantCounter
+
+ShardResult = Tuple[VariantCounter, CoverageAccumulator]
+OwnedRangeResult = Tuple[
+    VariantCounter, List[Tuple[str, int, int, int]], PipelineMetrics
+]
+
+
+def evaluate_sam_file_range(
+    sam_file: str,
+    start: int,
+    stop: int,
+    reference_lengths: Dict[str, int],
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> ShardResult:
+    """
+    Evaluate the alignment records in the byte range [start, stop) of a sam file, report
+    the variant read depths and the position read depths of that range. With regions
+    only the alignments that overlap them are evaluated, with a read filter only the
+    ones it passes.
+    """
+    variant_to_read_depth = VariantCounter()
+    position_to_read_depth = CoverageAccumulator(reference_lengths)
+    for sam_record_chunk in iter_sam_record_chunks(sam_file, start, stop):
+        sam_record_chunk = filter_sam_records(sam_record_chunk, regions, read_filter)
+        evaluate_sam_record_chunk(
+            sam_record_chunk, variant_to_read_depth, position_to_read_depth
+        )
+    return variant_to_read_depth, position_to_read_depth
+
+
+def evaluate_sam_file_range_in_worker(
+    sam_file: str,
+    start: int,
+    stop: int,
+    reference_lengths: Dict[str, int],
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[ShardResult, PipelineMetrics]:
+    """
+    Evaluate a byte range in a worker process, the metrics of the worker are sent back
+    with the results so the parent can report them.
+    """
+    metrics = reset_pipeline_metrics(get_pipeline_metrics().progress_interval)
+    result = evaluate_sam_file_range(
+        sam_file, start, stop, reference_lengths, regions, read_filter
+    )
+    return result, metrics
+
+
+def merge_shard_results(result: ShardResult, other_result: ShardResult) -> ShardResult:
+    """
+    Add the counts of one shard into another, the order shards are merged in does not
+    change the totals.
+    """
+    variant_to_read_depth, position_to_read_depth = result
+    other_variant_to_read_depth, other_position_to_read_depth = other_result
+    variant_to_read_depth.merge(other_variant_to_read_depth)
+    position_to_read_depth.merge(other_position_to_read_depth)
+    return variant_to_read_depth, position_to_read_depth
+
+
+def evaluate_sam_file_parallel(
+    sam_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> ShardResult:
+    """
+    Split the alignments of a sam file into one newline aligned byte range per worker,
+    evaluate the ranges in a process pool and merge the results.
+    """
+    header_lines, alignment_start = read_sam_header(sam_file)
+    reference_lengths = parse_reference_lengths(header_lines)
+    shards: List[Tuple[int, int]] = split_sam_file(sam_file, alignment_start, workers)
+    if len(shards) <= 1:
+        start, stop = shards[0] if shards else (alignment_start, alignment_start)
+        return evaluate_sam_file_range(
+            sam_file, start, stop, reference_lengths, regions, read_filter
+        )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shard_results_and_metrics = executor.map(
+            evaluate_sam_file_range_in_worker,
+            [sam_file] * len(shards),
+            [start for start, _ in shards],
+            [stop for _, stop in shards],
+            [reference_lengths] * len(shards),
+            [regions] * len(shards),
+            [read_filter] * len(shards),
+        )
+        shard_results = []
+        for shard_result, shard_metrics in shard_results_and_metrics:
+            get_pipeline_metrics().merge(shard_metrics)
+            shard_results.append(shard_result)
+        return reduce(merge_shard_results, shard_results)
+
+
+def evaluate_sam_records_within_lookbehind(
+    sam_records: List[Any],
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: SharedCoverageAccumulator,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+):
+    """
+    Evaluate a chunk of alignments, none of which may reach further than the lookbehind
+    from its position as the owned ranges of the other workers would miss it.
+    """
+    sam_records = filter_sam_records(sam_records, regions, read_filter)
+    chunk_intervals = evaluate_sam_record_chunk(
+        sam_records, variant_to_read_depth, position_to_read_depth
+    )
+    for sam_record, intervals in zip(sam_records, chunk_intervals):
+        pos = int(sam_record["POS"])
+        if intervals and (
+            min(intervals)[0] < pos - DEFAULT_LOOKBEHIND
+            or max(intervals)[1] > pos + DEFAULT_LOOKBEHIND
+        ):
+            raise ValueError(
+                f"An alignment at {sam_record['RNAME']}:{pos} reaches further "
+                f"than {DEFAULT_LOOKBEHIND} bases from its position"
+            )
+
+
+def evaluate_owned_sam_range(
+    sam_file: str,
+    start: int,
+    stop: int,
+    owned_start: Optional[GenomicPosition],
+    owned_stop: Optional[GenomicPosition],
+    reference_lengths: Dict[str, int],
+    shared_memory_names: Dict[str, str],
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> OwnedRangeResult:
+    """
+    Evaluate the alignments in the byte range [start, stop) of a coordinate sorted sam
+    file in a worker process, adding the depths of the positions from owned_start up to
+    owned_stop straight into the shared arrays. The byte range reaches the lookbehind
+    past the owned positions on both sides so every alignment covering them is read.
+
+    Only the variants at owned positions are reported, along with the depth runs that
+    fell outside the shared arrays. The reads and read filter rejections are counted
+    for the alignments whose position is owned, so the workers count each one once.
+    """
+    metrics = reset_pipeline_metrics(get_pipeline_metrics().progress_interval)
+    variant_to_read_depth = VariantCounter()
+    position_to_read_depth = SharedCoverageAccumulator(
+        reference_lengths, shared_memory_names
+    )
+    chrom_indexes = {chrom: index for index, chrom in enumerate(reference_lengths)}
+    last_key = (-1, 0)
+    try:
+        position_to_read_depth.own(owned_start, owned_stop)
+        for sam_record_chunk in iter_sam_record_chunks(sam_file, start, stop):
+            owned_sam_records, other_sam_records = [], []
+            for sam_record in sam_record_chunk:
+                chrom, pos = sam_record["RNAME"], int(sam_record["POS"])
+                if chrom not in chrom_indexes:
+                    raise ValueError(f"Alignments on {chrom} which has no @SQ line")
+                key = (chrom_indexes[chrom], pos)
+                if key < last_key:
+                    raise ValueError(
+                        f"Alignments are not sorted by coordinate, {chrom}:{pos} "
+                        "follows an alignment further on"
+                    )
+                last_key = key
+                if position_to_read_depth.owns(chrom, pos):
+                    owned_sam_records.append(sam_record)
+                else:
+                    other_sam_records.append(sam_record)
+            evaluate_sam_records_within_lookbehind(
+                owned_sam_records,
+                variant_to_read_depth,
+                position_to_read_depth,
+                regions,
+                read_filter,
+            )
+            # A neighbouring worker owns their positions and counts them
+            with metrics.uncounted():
+                evaluate_sam_records_within_lookbehind(
+                    other_sam_records,
+                    variant_to_read_depth,
+                    position_to_read_depth,
+                    regions,
+                    read_filter,
+                )
+        private_depth_runs = list(
+            position_to_read_depth.get_private_coverage().iter_depth_runs()
+        )
+        return (
+            variant_to_read_depth.subset(position_to_read_depth.owns),
+            private_depth_runs,
+            metrics,
+        )
+    finally:
+        position_to_read_depth.close()
+
+
+def get_owned_sam_ranges(
+    sam_file: str,
+    alignment_start: int,
+    reference_lengths: Dict[str, int],
+    workers: int,
+) -> List[Tuple[int, int, Optional[GenomicPosition], Optional[GenomicPosition]]]:
+    """
+    Split a coordinate sorted sam file into one (start, stop, owned start, owned stop)
+    per worker. The owned positions are cut where the equal sized byte ranges start, and
+    each byte range is widened by the lookbehind in positions on both sides.
+    """
+    shards = split_sam_file(sam_file, alignment_start, workers)
+    chrom_indexes = {chrom: index for index, chrom in enumerate(reference_lengths)}
+    chroms = list(reference_lengths)
+    file_size = os.path.getsize(sam_file)
+    if len(shards) <= 1:
+        return [(alignment_start, file_size, None, None)]
+    with open(sam_file, "rb") as in_file:
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as sam_map:
+            cut_keys = [
+                read_sam_record_key(sam_map, shard_start, chrom_indexes)
+                for shard_start, _ in shards[1:]
+            ]
+            range_starts = [alignment_start] + [
+                find_sam_record_offset(
+                    sam_map,
+                    alignment_start,
+                    file_size,
+                    chrom_indexes,
+                    (chrom_index, pos - DEFAULT_LOOKBEHIND),
+                )
+                for chrom_index, pos in cut_keys
+            ]
+            range_stops = [
+                find_sam_record_offset(
+                    sam_map,
+                    alignment_start,
+                    file_size,
+                    chrom_indexes,
+                    (chrom_index, pos + DEFAULT_LOOKBEHIND + 1),
+                )
+                for chrom_index, pos in cut_keys
+            ] + [file_size]
+    cuts: List[Optional[GenomicPosition]] = [
+        GenomicPosition(chroms[chrom_index], pos) for chrom_index, pos in cut_keys
+    ]
+    return list(zip(range_starts, range_stops, [None] + cuts, cuts + [None]))
+
+
+def evaluate_sam_file_shared(
+    sam_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[VariantCounter, SharedCoverageAccumulator]:
+    """
+    Evaluate a coordinate sorted sam file with the read depths of all workers held in
+    one set of shared memory arrays, sized by the @SQ reference lengths. Each worker
+    owns a disjoint range of positions and adds to the arrays in place, so no coverage
+    is merged and the memory does not grow with the number of workers. The variants of
+    a worker are sparse and sit at its own positions, they are joined in worker order.
+
+    The coverage is reported in the shared arrays themselves rather than copied out of
+    them, the caller frees them with close(unlink=True) once it has read them.
+    """
+    header_lines, alignment_start = read_sam_header(sam_file)
+    reference_lengths = parse_reference_lengths(header_lines)
+    if not reference_lengths:
+        raise ValueError("Shared memory coverage needs the @SQ lengths in the header")
+    owned_ranges = get_owned_sam_ranges(
+        sam_file, alignment_start, reference_lengths, workers
+    )
+    position_to_read_depth = SharedCoverageAccumulator(reference_lengths)
+    try:
+        with ProcessPoolExecutor(max_workers=len(owned_ranges)) as executor:
+            owned_range_results = executor.map(
+                evaluate_owned_sam_range,
+                [sam_file] * len(owned_ranges),
+                *zip(*owned_ranges),
+                [reference_lengths] * len(owned_ranges),
+                [position_to_read_depth.shared_memory_names] * len(owned_ranges),
+                [regions] * len(owned_ranges),
+                [read_filter] * len(owned_ranges),
+            )
+            variant_to_read_depth = VariantCounter()
+            for owned_variants, private_depth_runs, owned_metrics in (
+                owned_range_results
+            ):
+                get_pipeline_metrics().merge(owned_metrics)
+                variant_to_read_depth.merge(owned_variants)
+                position_to_read_depth.add_depth_runs(private_depth_runs)
+    except BaseException:
+        position_to_read_depth.close(unlink=True)
+        raise
+    return variant_to_read_depth, position_to_read_depth
@@ -0,0 +1,294 @@
+import heapq
+import json
+import struct
+import sys
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .coverage import CoverageAccumulator
+from .models import Variant
+from .output_files import OutputFile
+from .variant_counter import VariantCounter
+
+PARTIAL_MAGIC = b"VCPART1\n"
+# The footer offset closes the file, the footer lists the sections of every chromosome
+PARTIAL_FOOTER_OFFSET = struct.Struct("<Q")
+# Depth runs are stored as int32 (start, stop, depth), variants as int64 (pos, ref id,
+# alt id, read depth), both in little endian arrays of this many rows per read
+DEPTH_RUN_WIDTH = 3
+VARIANT_WIDTH = 4
+PARTIAL_BLOCK_ROWS = 1 << 16
+# A variant row as write_variant_out_file formats it
+VARIANT_ROW_FORMAT = "%s-%d-%s-%s\t%d\t%d\n"
+
+
+def write_little_endian(out_file: BinaryIO, values: array):
+    if sys.byteorder == "big":
+        values.byteswap()
+    values.tofile(out_file)
+
+
+def read_little_endian(in_file: BinaryIO, typecode: str, count: int) -> array:
+    values = array(typecode)
+    values.fromfile(in_file, count)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def write_partial_file(
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: CoverageAccumulator,
+    partial_out_file: str,
+    applied_inputs: Sequence[str] = (),
+    parameters: Optional[Dict[str, Any]] = None,
+):
+    """
+    Write the results of one run, such as one lane of a flowcell, as a partial that
+    merge_partial_files can combine with others. Each chromosome gets its depth runs and
+    its variants sorted by position in flat arrays, a footer lists where they are along
+    with the chromosome order, the alleles, the hashes of the inputs applied and the
+    parameters they were evaluated with.
+    """
+    chrom_variants: Dict[str, List[Tuple[int, str, str, int]]] = {}
+    for chrom, pos, ref, alt, variant_read_depth in variant_to_read_depth.iter_counts():
+        chrom_variants.setdefault(chrom, []).append((pos, ref, alt, variant_read_depth))
+    chrom_depth_runs: Dict[str, List[Tuple[int, int, int]]] = {
+        chrom: [] for chrom in position_to_read_depth.reference_lengths
+    }
+    for chrom, start, stop, depth in position_to_read_depth.iter_depth_runs():
+        chrom_depth_runs.setdefault(chrom, []).append((start, stop, depth))
+    for chrom in chrom_variants:
+        chrom_depth_runs.setdefault(chrom, [])
+    alleles: Dict[str, int] = {}
+    chrom_sections = []
+    with open(partial_out_file, "wb") as out_file:
+        out_file.write(PARTIAL_MAGIC)
+        for chrom, depth_runs in chrom_depth_runs.items():
+            depth_runs_offset = out_file.tell()
+            write_little_endian(
+                out_file, array("i", [value for run in depth_runs for value in run])
+            )
+            variants_offset = out_file.tell()
+            variants = sorted(chrom_variants.get(chrom, []))
+            write_little_endian(
+                out_file,
+                array(
+                    "q",
+                    [
+                        value
+                        for pos, ref, alt, variant_read_depth in variants
+                        for value in (
+                            pos,
+                            alleles.setdefault(ref, len(alleles)),
+                            alleles.setdefault(alt, len(alleles)),
+                            variant_read_depth,
+                        )
+                    ],
+                ),
+            )
+            chrom_sections.append(
+                {
+                    "chrom": chrom,
+                    "length": position_to_read_depth.reference_lengths.get(chrom),
+                    "depth_runs_offset": depth_runs_offset,
+                    "depth_runs": len(depth_runs),
+                    "variants_offset": variants_offset,
+                    "variants": len(variants),
+                }
+            )
+        footer_offset = out_file.tell()
+        out_file.write(
+            json.dumps(
+                {
+                    "chroms": chrom_sections,
+                    "alleles": list(alleles),
+                    "inputs": list(applied_inputs),
+                    "parameters": parameters,
+                }
+            ).encode()
+        )
+        out_file.write(PARTIAL_FOOTER_OFFSET.pack(footer_offset))
+
+
+class PartialFile:
+    """
+    Reader over a partial written by write_partial_file, the rows of a chromosome are
+    read a block at a time so merging holds only a block per partial in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        if self._file.read(len(PARTIAL_MAGIC)) != PARTIAL_MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not a partial result file")
+        footer_end = self._file.seek(-PARTIAL_FOOTER_OFFSET.size, 2)
+        (footer_offset,) = PARTIAL_FOOTER_OFFSET.unpack(
+            self._file.read(PARTIAL_FOOTER_OFFSET.size)
+        )
+        self._file.seek(footer_offset)
+        footer = json.loads(self._file.read(footer_end - footer_offset))
+        self.alleles: List[str] = footer["alleles"]
+        self.applied_inputs: List[str] = footer.get("inputs", [])
+        self.parameters: Optional[Dict[str, Any]] = footer.get("parameters")
+        self._sections: Dict[str, dict] = {
+            section["chrom"]: section for section in footer["chroms"]
+        }
+        self.reference_lengths: Dict[str, Optional[int]] = {
+            section["chrom"]: section["length"] for section in footer["chroms"]
+        }
+
+    def __enter__(self) -> "PartialFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _iter_rows(
+        self, offset: int, row_count: int, typecode: str, width: int
+    ) -> Iterator[Tuple[int, ...]]:
+        while row_count > 0:
+            block_rows = min(row_count, PARTIAL_BLOCK_ROWS)
+            self._file.seek(offset)
+            values = read_little_endian(self._file, typecode, block_rows * width)
+            offset = self._file.tell()
+            row_count -= block_rows
+            yield from zip(*[iter(values)] * width)
+
+    def iter_depth_runs(self, chrom: str) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yield the (start, stop, depth) runs of a chromosome in order.
+        """
+        section = self._sections.get(chrom)
+        if section is None:
+            return
+        yield from self._iter_rows(  # type: ignore
+            section["depth_runs_offset"], section["depth_runs"], "i", DEPTH_RUN_WIDTH
+        )
+
+    def iter_variants(self, chrom: str) -> Iterator[Tuple[int, str, str, int]]:
+        """
+        Yield the (pos, ref, alt, read depth) variants of a chromosome in order.
+        """
+        section = self._sections.get(chrom)
+        if section is None:
+            return
+        alleles = self.alleles
+        for pos, ref_id, alt_id, variant_read_depth in self._iter_rows(
+            section["variants_offset"], section["variants"], "q", VARIANT_WIDTH
+        ):
+            yield pos, alleles[ref_id], alleles[alt_id], variant_read_depth
+
+    def read_totals(self) -> Tuple[VariantCounter, CoverageAccumulator]:
+        """
+        Load the whole partial back into a variant counter and a coverage accumulator.
+        """
+        variant_to_read_depth = VariantCounter()
+        position_to_read_depth = CoverageAccumulator(
+            {
+                chrom: length
+                for chrom, length in self.reference_lengths.items()
+                if length is not None
+            }
+        )
+        for chrom in self.reference_lengths:
+            for start, stop, depth in self.iter_depth_runs(chrom):
+                position_to_read_depth.add_interval(chrom, start, stop, depth)
+            for pos, ref, alt, variant_read_depth in self.iter_variants(chrom):
+                variant_to_read_depth.add(
+                    Variant(chrom, pos, ref, alt), variant_read_depth
+                )
+        return variant_to_read_depth, position_to_read_depth
+
+
+def merge_depth_run_streams(
+    depth_run_streams: Iterable[Iterable[Tuple[int, int, int]]]
+) -> Iterator[Tuple[int, int, int]]:
+    """
+    Sum sorted streams of (start, stop, depth) runs into one stream of runs, adjacent
+    runs of equal depth are joined. Every run becomes a step up at its start and a step
+    down at its stop, the steps of all streams are merged and swept in order.
+    """
+    step_streams = [
+        (
+            step
+            for start, stop, depth in depth_runs
+            for step in ((start, depth), (stop, -depth))
+        )
+        for depth_runs in depth_run_streams
+    ]
+    run_start = depth = 0
+    for pos, pos_steps in groupby(heapq.merge(*step_streams), key=itemgetter(0)):
+        next_depth = depth + sum(step for _, step in pos_steps)
+        # Runs of different streams that meet at the same depth stay one run
+        if next_depth == depth:
+            continue
+        if depth:
+            yield run_start, pos, depth
+        run_start, depth = pos, next_depth
+
+
+def merge_variant_streams(
+    variant_streams: Iterable[Iterable[Tuple[int, str, str, int]]]
+) -> Iterator[Tuple[int, str, str, int]]:
+    """
+    Sum sorted streams of (pos, ref, alt, read depth) variants into one sorted stream.
+    """
+    for (pos, ref, alt), variants in groupby(
+        heapq.merge(*variant_streams), key=itemgetter(0, 1, 2)
+    ):
+        yield pos, ref, alt, sum(variant[3] for variant in variants)
+
+
+def iter_depth_runs_writing_variants(
+    partial_files: List[PartialFile], variant_out_file: str, compress: bool = False
+) -> Iterator[Tuple[str, int, int, int]]:
+    """
+    Merge the partials chromosome by chromosome, in the order they list them, writing
+    the variant rows with the merged read depth at their position while passing the
+    merged depth runs on to the coverage writer.
+    """
+    chroms = list(
+        dict.fromkeys(
+            chrom
+            for partial_file in partial_files
+            for chrom in partial_file.reference_lengths
+        )
+    )
+    with OutputFile(variant_out_file, compress) as variant_file:
+        variant_file.write("variant\tvar_read_depth\tfull_read_depth\n")
+        for chrom in chroms:
+            variants = merge_variant_streams(
+                [partial_file.iter_variants(chrom) for partial_file in partial_files]
+            )
+            variant = next(variants, None)
+            for start, stop, depth in merge_depth_run_streams(
+                [partial_file.iter_depth_runs(chrom) for partial_file in partial_files]
+            ):
+                while variant is not None and variant[0] < stop:
+                    read_depth = depth if variant[0] >= start else 0
+                    variant_file.write(
+                        VARIANT_ROW_FORMAT % (chrom, *variant, read_depth)
+                    )
+                    variant = next(variants, None)
+                yield chrom, start, stop, depth
+            # Variants past the last covered position
+            while variant is not None:
+                variant_file.write(VARIANT_ROW_FORMAT % (chrom, *variant, 0))
+                variant = next(variants, None)
@@ -0,0 +1,230 @@
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from queue import Empty, Full, Queue
+from typing import Any, List, Optional, Tuple
+
+from .alignment import evaluate_sam_record_chunk, filter_sam_records
+from .coverage import CoverageAccumulator
+from .instrumentation import (
+    PipelineMetrics,
+    get_pipeline_metrics,
+    reset_pipeline_metrics,
+)
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .sam_reader import (
+    SamBytesRecord,
+    iter_chunks,
+    parse_reference_lengths,
+    read_sam_header,
+)
+from .variant_counter import VariantCounter
+
+# Bytes of alignment lines the reader stage hands on at a time
+PIPELINE_BLOCK_SIZE = 1 << 20
+# Items a queue holds per worker before the stage feeding it blocks
+QUEUE_DEPTH_PER_WORKER = 2
+# Seconds a stage waits on a queue before it checks whether the pipeline was stopped
+QUEUE_POLL_SECONDS = 0.1
+
+BlockResult = Tuple[VariantCounter, List[Tuple[str, int, int, int]], PipelineMetrics]
+
+
+class PipelineStopped(Exception):
+    """
+    Raised in a stage waiting on a queue once the pipeline was stopped, after a failure
+    in another stage.
+    """
+
+
+class StageQueue:
+    """
+    A bounded queue between two pipeline stages that records how full it runs and how
+    long its producer and consumer wait on it. Each side is used by one thread.
+
+    Waits are cut into polls of QUEUE_POLL_SECONDS, once the stop event is set a
+    waiting side raises PipelineStopped rather than block on a stage that is gone.
+    """
+
+    def __init__(
+        self,
+        queue_name: str,
+        capacity: int,
+        metrics: PipelineMetrics,
+        stop_event: threading.Event,
+    ):
+        self._queue: "Queue[Any]" = Queue(capacity)
+        self.queue_metrics = metrics.get_queue_metrics(queue_name, capacity)
+        self.stop_event = stop_event
+
+    def put(self, item: Any):
+        put_start = time.perf_counter()
+        while True:
+            if self.stop_event.is_set():
+                raise PipelineStopped
+            try:
+                self._queue.put(item, timeout=QUEUE_POLL_SECONDS)
+                break
+            except Full:
+                continue
+        self.queue_metrics.add_put(
+            self._queue.qsize(), time.perf_counter() - put_start
+        )
+
+    def get(self) -> Any:
+        get_start = time.perf_counter()
+        while True:
+            if self.stop_event.is_set():
+                raise PipelineStopped
+            try:
+                item = self._queue.get(timeout=QUEUE_POLL_SECONDS)
+                break
+            except Empty:
+                continue
+        self.queue_metrics.get_wait_seconds += time.perf_counter() - get_start
+        return item
+
+
+def read_sam_blocks(sam_file: str, start: int, stop: int, block_queue: StageQueue):
+    """
+    The reader stage, run in a thread. Reads the byte range [start, stop) in large
+    blocks and passes them on cut after their last newline, None marks the end and an
+    exception is passed on in place of the blocks.
+    """
+    try:
+        with open(sam_file, "rb") as in_file:
+            in_file.seek(start)
+            remaining = stop - start
+            remainder = b""
+            while remaining > 0:
+                block = in_file.read(min(PIPELINE_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                lines, newline, remainder = (remainder + block).rpartition(b"\n")
+                if newline:
+                    block_queue.put(lines + newline)
+            if remainder:
+                block_queue.put(remainder)
+        block_queue.put(None)
+    except PipelineStopped:
+        return
+    except BaseException as error:
+        block_queue.put(error)
+
+
+def evaluate_sam_block(
+    sam_block: bytes,
+    regions: Optional[RegionSet],
+    read_filter: Optional[ReadFilter] = None,
+) -> BlockResult:
+    """
+    The parse and call stage, run in a worker process on one block of alignment lines.
+    The coverage goes back as depth runs, which are far smaller than its pages.
+    """
+    metrics = reset_pipeline_metrics()
+    variant_to_read_depth = VariantCounter()
+    position_to_read_depth = CoverageAccumulator()
+    sam_records = map(SamBytesRecord, filter(None, sam_block.split(b"\n")))
+    for sam_record_chunk in iter_chunks(sam_records):
+        sam_record_chunk = filter_sam_records(sam_record_chunk, regions, read_filter)
+        evaluate_sam_record_chunk(
+            sam_record_chunk, variant_to_read_depth, position_to_read_depth
+        )
+    return (
+        variant_to_read_depth,
+        list(position_to_read_depth.iter_depth_runs()),
+        metrics,
+    )
+
+
+def dispatch_sam_blocks(
+    block_queue: StageQueue,
+    result_queue: StageQueue,
+    executor: ProcessPoolExecutor,
+    regions: Optional[RegionSet],
+    read_filter: Optional[ReadFilter] = None,
+):
+    """
+    Hand every block to the worker pool in a thread, the futures are queued in block
+    order. The bounded result queue caps the blocks in flight.
+    """
+    try:
+        while True:
+            sam_block = block_queue.get()
+            if sam_block is None or isinstance(sam_block, BaseException):
+                result_queue.put(sam_block)
+                return
+            result_queue.put(
+                executor.submit(evaluate_sam_block, sam_block, regions, read_filter)
+            )
+    except PipelineStopped:
+        return
+    except BaseException as error:
+        result_queue.put(error)
+
+
+def evaluate_sam_file_pipelined(
+    sam_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[VariantCounter, CoverageAccumulator]:
+    """
+    Evaluate a sam file in stages joined by bounded queues. A reader thread reads large
+    blocks, a pool of worker processes parses and calls them and this thread merges the
+    per block counts in block order. The queue metrics in the summary tell whether a run
+    waited on reading, the reader is then blocked rarely and the dispatcher starved
+    often, or on the workers.
+
+    When any stage fails the others are stopped, the blocks not yet called are
+    cancelled and the error is raised here.
+    """
+    header_lines, alignment_start = read_sam_header(sam_file)
+    metrics = get_pipeline_metrics()
+    queue_capacity = QUEUE_DEPTH_PER_WORKER * workers
+    stop_event = threading.Event()
+    block_queue = StageQueue("read blocks", queue_capacity, metrics, stop_event)
+    result_queue = StageQueue("block results", queue_capacity, metrics, stop_event)
+    variant_to_read_depth = VariantCounter()
+    position_to_read_depth = CoverageAccumulator(parse_reference_lengths(header_lines))
+    with open(sam_file, "rb") as in_file:
+        file_size = in_file.seek(0, 2)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    stage_threads = [
+        threading.Thread(
+            target=read_sam_blocks,
+            args=(sam_file, alignment_start, file_size, block_queue),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=dispatch_sam_blocks,
+            args=(block_queue, result_queue, executor, regions, read_filter),
+            daemon=True,
+        ),
+    ]
+    try:
+        for stage_thread in stage_threads:
+            stage_thread.start()
+        while True:
+            block_future: Optional[Future] = result_queue.get()
+            if block_future is None:
+                break
+            if isinstance(block_future, BaseException):
+                raise block_future
+            with metrics.stage("worker wait"):
+                block_variants, block_depth_runs, block_metrics = block_future.result()
+            with metrics.stage("aggregation"):
+                variant_to_read_depth.merge(block_variants)
+                position_to_read_depth.add_depth_runs(block_depth_runs)
+            metrics.merge(block_metrics)
+            metrics.log_progress()
+    finally:
+        # The stages have finished after a complete run, after a failure they stop
+        stop_event.set()
+        for stage_thread in stage_threads:
+            if stage_thread.is_alive():
+                stage_thread.join()
+        executor.shutdown(cancel_futures=True)
+    return variant_to_read_depth, position_to_read_depth
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from enum import IntFlag
+from typing import Any, Dict, List
+
+
+class SamFlag(IntFlag):
+    """
+    The bits of the sam FLAG column, named as samtools flags names them.
+    """
+
+    PAIRED = 0x1
+    PROPER_PAIR = 0x2
+    UNMAP = 0x4
+    MUNMAP = 0x8
+    REVERSE = 0x10
+    MREVERSE = 0x20
+    READ1 = 0x40
+    READ2 = 0x80
+    SECONDARY = 0x100
+    QCFAIL = 0x200
+    DUP = 0x400
+    SUPPLEMENTARY = 0x800
+
+
+def parse_flag_mask(mask_string: str) -> int:
+    """
+    Parse a FLAG mask given as a decimal, hex or octal number or as a comma separated
+    list of flag names, such as '0x904' or 'UNMAP,SECONDARY,SUPPLEMENTARY'.
+    """
+    if mask_string[:1].isdigit():
+        return int(mask_string, 0)
+    mask = 0
+    for flag_name in mask_string.split(","):
+        if flag_name.upper() not in SamFlag.__members__:
+            raise ValueError(f"Unknown sam flag {flag_name}")
+        mask |= SamFlag[flag_name.upper()]
+    return int(mask)
+
+
+@dataclass(frozen=True)
+class ReadFilter:
+    """
+    Which alignments are evaluated, judged on the FLAG and MAPQ columns alone. An
+    alignment must have every bit of required_flags set, none of excluded_flags and a
+    mapping quality of at least min_mapq.
+    """
+
+    required_flags: int = 0
+    excluded_flags: int = 0
+    min_mapq: int = 0
+
+    def filter_sam_records(
+        self, sam_records: List[Any], rejected_reads: Dict[str, int]
+    ) -> List[Any]:
+        """
+        Report the alignments that pass, the rejected ones are counted by the filter
+        that rejected them into rejected_reads. Only the integer FLAG and MAPQ fields
+        are looked at, the sequence, qualities, cigar and tags are never parsed.
+        """
+        # Plain ints, the bit operations of flag enum members are much slower
+        required_flags = int(self.required_flags)
+        excluded_flags = int(self.excluded_flags)
+        min_mapq = self.min_mapq
+        passing_records = []
+        for sam_record in sam_records:
+            if isinstance(sam_record, dict):
+                flag, mapq = int(sam_record["FLAG"]), int(sam_record["MAPQ"])
+            else:
+                flag, mapq = sam_record.flag, sam_record.mapq
+            if flag & required_flags != required_flags:
+                rejected_reads["required flags"] = (
+                    rejected_reads.get("required flags", 0) + 1
+                )
+            elif flag & excluded_flags:
+                # Counted under the lowest excluded flag the alignment has
+                excluded_flag = flag & excluded_flags & -(flag & excluded_flags)
+                filter_name = f"flag {SamFlag(excluded_flag).name}"
+                rejected_reads[filter_name] = rejected_reads.get(filter_name, 0) + 1
+            elif mapq < min_mapq:
+                rejected_reads["mapq"] = rejected_reads.get("mapq", 0) + 1
+            else:
+                passing_records.append(sam_record)
+        return passing_records
@@ -0,0 +1,76 @@
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+from .models import GenomicRegion
+
+# Used as the end of a region that covers the rest of a chromosome
+CHROM_END = 2**31 - 1
+
+
+def parse_region_string(region_string: str) -> GenomicRegion:
+    """
+    Parse a samtools style region, 'chr19', 'chr19:71000' or 'chr19:71,000-80,000'.
+    """
+    chrom, _, span = region_string.rpartition(":")
+    if not chrom or not span.replace(",", "").replace("-", "").isdigit():
+        return GenomicRegion(region_string, 1, CHROM_END)
+    start_string, _, end_string = span.replace(",", "").partition("-")
+    start = int(start_string)
+    end = int(end_string) if end_string else CHROM_END
+    if start < 1 or end < start:
+        raise ValueError(f"Invalid region {region_string}")
+    return GenomicRegion(chrom, start, end)
+
+
+def read_bed_regions(bed_file: str) -> List[GenomicRegion]:
+    """
+    Read the regions of a BED file, BED intervals are zero based and half open.
+    """
+    regions: List[GenomicRegion] = []
+    with open(bed_file, "r") as in_file:
+        for line in in_file:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            chrom, start, end = line.split("\t")[:3]
+            regions.append(GenomicRegion(chrom, int(start) + 1, int(end)))
+    return regions
+
+
+class RegionSet:
+    """
+    A set of regions merged into sorted, non overlapping intervals per chromosome.
+    """
+
+    def __init__(self, regions: Iterable[GenomicRegion]):
+        self.intervals: Dict[str, List[Tuple[int, int]]] = {}
+        for region in sorted(regions):
+            chrom_intervals = self.intervals.setdefault(region.chrom, [])
+            if chrom_intervals and region.start <= chrom_intervals[-1][1] + 1:
+                chrom_intervals[-1] = (
+                    chrom_intervals[-1][0],
+                    max(chrom_intervals[-1][1], region.end),
+                )
+            else:
+                chrom_intervals.append((region.start, region.end))
+        self._starts = {
+            chrom: [start for start, _ in chrom_intervals]
+            for chrom, chrom_intervals in self.intervals.items()
+        }
+
+    def __iter__(self):
+        for chrom, chrom_intervals in self.intervals.items():
+            for start, end in chrom_intervals:
+                yield GenomicRegion(chrom, start, end)
+
+    def overlaps(self, chrom: str, start: int, end: int) -> bool:
+        """
+        Whether the inclusive interval [start, end] overlaps any region.
+        """
+        starts = self._starts.get(chrom)
+        if not starts:
+            return False
+        index = bisect_right(starts, end) - 1
+        return index >= 0 and self.intervals[chrom][index][1] >= start
+
+    def contains(self, chrom: str, pos: int) -> bool:
+        return self.overlaps(chrom, pos, pos)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from typing import Callable, Optional, Tuple
+
+from .alignment import get_filter_parameters
+from .coverage import CoverageAccumulator
+from .instrumentation import get_pipeline_metrics, logger
+from .partials import PartialFile, write_partial_file
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .variant_counter import VariantCounter
+
+# Bytes of an input read at a time while hashing it
+INPUT_HASH_BLOCK_SIZE = 1 << 20
+
+Results = Tuple[VariantCounter, CoverageAccumulator]
+
+
+def hash_input_file(sam_file: str) -> str:
+    """
+    The sha256 of the content of an input, so a copied or renamed input is recognised
+    as the same one.
+    """
+    input_hash = hashlib.sha256()
+    with get_pipeline_metrics().stage("input hashing"):
+        with open(sam_file, "rb") as in_file:
+            for block in iter(lambda: in_file.read(INPUT_HASH_BLOCK_SIZE), b""):
+                input_hash.update(block)
+    return f"sha256:{input_hash.hexdigest()}"
+
+
+def update_result_store(
+    result_store_file: str,
+    sam_file: str,
+    evaluate: Callable[[], Results],
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> Results:
+    """
+    Add the results of an input to the running totals of a result store, a partial file
+    that also lists the hashes of the inputs applied to it. A store that does not exist
+    yet starts out empty. The input is only evaluated when its hash is not listed, so
+    applying an input twice leaves the store as it is. The store is written to a
+    temporary file and renamed over the old one.
+
+    The store keeps the regions and read filter its totals were evaluated with, an
+    input evaluated with others is refused. Stores written before they were kept are
+    taken to have neither.
+
+    Reports the updated totals.
+    """
+    # As the footer reads back, its json has lists where the parameters have tuples
+    parameters = json.loads(json.dumps(get_filter_parameters(regions, read_filter)))
+    input_hash = hash_input_file(sam_file)
+    if os.path.exists(result_store_file):
+        with PartialFile(result_store_file) as result_store:
+            stored_parameters = result_store.parameters
+            if stored_parameters is None:
+                stored_parameters = get_filter_parameters()
+            if stored_parameters != parameters:
+                raise ValueError(
+                    f"{result_store_file} holds totals of other regions or another "
+                    "read filter than this run has"
+                )
+            applied_inputs = result_store.applied_inputs
+            variant_to_read_depth, position_to_read_depth = result_store.read_totals()
+    else:
+        applied_inputs = []
+        variant_to_read_depth, position_to_read_depth = (
+            VariantCounter(),
+            CoverageAccumulator(),
+        )
+    if input_hash in applied_inputs:
+        logger.info("%s is already applied to %s", sam_file, result_store_file)
+        return variant_to_read_depth, position_to_read_depth
+    new_variant_to_read_depth, new_position_to_read_depth = evaluate()
+    with get_pipeline_metrics().stage("aggregation"):
+        variant_to_read_depth.merge(new_variant_to_read_depth)
+        position_to_read_depth.merge(new_position_to_read_depth)
+    with get_pipeline_metrics().stage("output writing"):
+        temporary_file = f"{result_store_file}.tmp"
+        write_partial_file(
+            variant_to_read_depth,
+            position_to_read_depth,
+            temporary_file,
+            [*applied_inputs, input_hash],
+            parameters,
+        )
+        os.replace(temporary_file, result_store_file)
+    logger.info(
+        "Applied %s to %s, which now holds %d inputs",
+        sam_file,
+        result_store_file,
+        len(applied_inputs) + 1,
+    )
+    return variant_to_read_depth, position_to_read_depth
@@ -0,0 +1,385 @@
+import mmap
+import os
+from itertools import islice
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .alignment import parse_cigar_string
+from .instrumentation import get_pipeline_metrics
+
+# Number of alignments that are processed together by the coverage kernel
+SAM_RECORD_CHUNK_SIZE = 1024
+# The mandatory columns, optional tags follow them in any number and order
+SAM_COLUMNS = [
+    "QNAME",
+    "FLAG",
+    "RNAME",
+    "POS",
+    "MAPQ",
+    "CIGAR",
+    "RNEXT",
+    "PNEXT",
+    "TLEN",
+    "SEQ",
+    "QUAL",
+]
+SAM_COLUMN_INDEX = {column: index for index, column in enumerate(SAM_COLUMNS)}
+SAM_TAGS_INDEX = len(SAM_COLUMNS)
+# Bytes of the memory mapped file split into lines at a time
+SAM_READ_BLOCK_SIZE = 1 << 22
+
+
+class SamRecord:
+    """
+    One sam alignment line, split once on tabs. The optional tags are left as a single
+    string and searched by their two letter key when asked for.
+
+    Supports the sam column names and tag keys as keys so the per alignment calling
+    functions can use it in place of a dict.
+    """
+
+    __slots__ = ("_fields",)
+
+    def __init__(self, line: str):
+        self._fields = line.rstrip("\n").split("\t", SAM_TAGS_INDEX)
+
+    @property
+    def read_name(self) -> str:
+        return self._fields[0]
+
+    @property
+    def flag(self) -> int:
+        return int(self._fields[1])
+
+    @property
+    def chrom(self) -> str:
+        return self._fields[2]
+
+    @property
+    def pos(self) -> int:
+        return int(self._fields[3])
+
+    @property
+    def mapq(self) -> int:
+        return int(self._fields[4])
+
+    @property
+    def cigar_ops(self) -> List[Tuple[int, str]]:
+        return parse_cigar_string(self._fields[5])
+
+    @property
+    def seq(self) -> str:
+        return self._fields[9]
+
+    @property
+    def qual(self) -> bytes:
+        return self._fields[10].encode("latin-1")
+
+    def get_tag_field(self, tag: str) -> Optional[str]:
+        """
+        The whole 'TG:T:value' field of a tag, None when the alignment does not have it.
+        """
+        if len(self._fields) <= SAM_TAGS_INDEX:
+            return None
+        tags = self._fields[SAM_TAGS_INDEX]
+        if tags.startswith(f"{tag}:"):
+            tag_start = 0
+        else:
+            tag_start = tags.find(f"\t{tag}:") + 1
+            if not tag_start:
+                return None
+        tag_end = tags.find("\t", tag_start)
+        return tags[tag_start : tag_end if tag_end >= 0 else len(tags)]
+
+    def get_tag(self, tag: str) -> Optional[Union[str, int, float]]:
+        tag_field = self.get_tag_field(tag)
+        if tag_field is None:
+            return None
+        _, value_type, value = tag_field.split(":", 2)
+        if value_type == "i":
+            return int(value)
+        if value_type == "f":
+            return float(value)
+        return value
+
+    @property
+    def md(self) -> str:
+        md = self.get_tag("MD")
+        return md if isinstance(md, str) else ""
+
+    def __getitem__(self, sam_column: str) -> str:
+        column_index = SAM_COLUMN_INDEX.get(sam_column)
+        if column_index is not None:
+            return self._fields[column_index]
+        return self.get_tag_field(sam_column) or ""
+
+
+class SamBytesRecord(SamRecord):
+    """
+    One sam alignment line as the bytes it is stored as, split once on tabs. Fields are
+    only decoded to str when asked for, numbers are parsed from the bytes and the
+    qualities are used as they are.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, line: bytes):  # type: ignore
+        self._fields = line.split(b"\t", SAM_TAGS_INDEX)  # type: ignore
+
+    @property
+    def read_name(self) -> str:
+        return self._fields[0].decode()  # type: ignore
+
+    @property
+    def chrom(self) -> str:
+        return self._fields[2].decode()  # type: ignore
+
+    @property
+    def cigar_ops(self) -> List[Tuple[int, str]]:
+        return parse_cigar_string(self._fields[5].decode())  # type: ignore
+
+    @property
+    def seq(self) -> str:
+        return self._fields[9].decode()  # type: ignore
+
+    @property
+    def qual(self) -> bytes:
+        return self._fields[10]  # type: ignore
+
+    def get_tag_field(self, tag: str) -> Optional[str]:
+        if len(self._fields) <= SAM_TAGS_INDEX:
+            return None
+        tags: bytes = self._fields[SAM_TAGS_INDEX]  # type: ignore
+        tag_key = tag.encode() + b":"
+        if tags.startswith(tag_key):
+            tag_start = 0
+        else:
+            tag_start = tags.find(b"\t" + tag_key) + 1
+            if not tag_start:
+                return None
+        tag_end = tags.find(b"\t", tag_start)
+        return tags[tag_start : tag_end if tag_end >= 0 else len(tags)].decode()
+
+    def __getitem__(self, sam_column: str) -> str:
+        column_index = SAM_COLUMN_INDEX.get(sam_column)
+        if column_index is not None:
+            return self._fields[column_index].decode()  # type: ignore
+        return self.get_tag_field(sam_column) or ""
+
+
+def is_sam_header_line(line: bytes) -> bool:
+    """
+    Header lines start with "@", tsv exports of alignments add a column title line.
+    """
+    return line.startswith(b"@") or line.startswith(b"QNAME\t")
+
+
+def read_sam_header(sam_file: str) -> Tuple[List[str], int]:
+    """
+    Read the header lines of a sam file, report them along with the byte offset of the
+    first alignment record.
+    """
+    header_lines: List[str] = []
+    with open(sam_file, "rb") as in_file:
+        offset = 0
+        for line in in_file:
+            if not is_sam_header_line(line):
+                break
+            header_lines.append(line.decode())
+            offset += len(line)
+    return header_lines, offset
+
+
+def parse_reference_lengths(header_lines: List[str]) -> Dict[str, int]:
+    """
+    Pull the reference sequence names and lengths out of the @SQ header lines.
+    """
+    reference_lengths: Dict[str, int] = {}
+    for header_line in header_lines:
+        if not header_line.startswith("@SQ"):
+            continue
+        header_fields = dict(
+            field.split(":", 1) for field in header_line.rstrip("\n").split("\t")[1:]
+        )
+        reference_lengths[header_fields["SN"]] = int(header_fields["LN"])
+    return reference_lengths
+
+
+def split_sam_file(
+    sam_file: str, start: int, shard_count: int
+) -> List[Tuple[int, int]]:
+    """
+    Split the alignment records of a sam file into at most shard_count byte ranges of
+    roughly equal size. Every range starts at the beginning of a line and the ranges
+    cover [start, end of file) without gaps.
+    """
+    file_size = os.path.getsize(sam_file)
+    if file_size == 0:
+        return []
+    boundaries = [start]
+    with open(sam_file, "rb") as in_file:
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as sam_map:
+            for shard in range(1, shard_count):
+                approximate_boundary = (
+                    start + (file_size - start) * shard // shard_count
+                )
+                if approximate_boundary <= boundaries[-1]:
+                    continue
+                # Move forward to the start of the next line
+                boundary = sam_map.find(b"\n", approximate_boundary - 1) + 1
+                if boundaries[-1] < boundary < file_size:
+                    boundaries.append(boundary)
+    boundaries.append(file_size)
+    return [
+        (shard_start, shard_stop)
+        for shard_start, shard_stop in zip(boundaries, boundaries[1:])
+        if shard_start < shard_stop
+    ]
+
+
+def read_sam_record_key(
+    sam_map: mmap.mmap, offset: int, chrom_indexes: Dict[str, int]
+) -> Tuple[int, int]:
+    """
+    The (chrom index, pos) sort key of the alignment line starting at offset, chrom
+    indexes follow the @SQ header order.
+    """
+    line_end = sam_map.find(b"\n", offset)
+    fields = sam_map[offset : line_end if line_end >= 0 else len(sam_map)].split(
+        b"\t", 4
+    )
+    chrom = fields[2].decode()
+    if chrom not in chrom_indexes:
+        raise ValueError(f"Alignments on {chrom} which has no @SQ header line")
+    return chrom_indexes[chrom], int(fields[3])
+
+
+def find_sam_record_offset(
+    sam_map: mmap.mmap,
+    start: int,
+    stop: int,
+    chrom_indexes: Dict[str, int],
+    key: Tuple[int, int],
+) -> int:
+    """
+    Bisect the lines in the byte range [start, stop) of a coordinate sorted sam file for
+    the first one whose (chrom index, pos) is at least key, stop if there is none. The
+    range must start on a line boundary.
+    """
+    found = stop
+    while start < stop:
+        middle = (start + stop) // 2
+        line_start = start
+        if middle > start:
+            # Move forward to the start of the next line, stop if it starts none
+            line_end = sam_map.find(b"\n", middle - 1, stop)
+            line_start = stop if line_end < 0 else line_end + 1
+        if line_start >= stop:
+            stop = middle
+        elif read_sam_record_key(sam_map, line_start, chrom_indexes) >= key:
+            found = stop = line_start
+        else:
+            line_end = sam_map.find(b"\n", line_start, stop)
+            start = stop if line_end < 0 else line_end + 1
+    return found
+
+
+def iter_sam_lines(sam_file: str, start: int, stop: int) -> Iterator[str]:
+    """
+    Stream the lines found in the byte range [start, stop) of a sam file, the range must
+    start on a line boundary.
+    """
+    with open(sam_file, "rb") as in_file:
+        in_file.seek(start)
+        remaining = stop - start
+        for line in in_file:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line.decode()
+
+
+def iter_sam_line_blocks(
+    sam_file: str, start: int, stop: int
+) -> Iterator[Tuple[List[bytes], int]]:
+    """
+    Stream the lines found in the byte range [start, stop) of a sam file a block at a
+    time, as the lines without their newlines and the offset the next block starts at.
+    The file is memory mapped and the lines are not decoded, the range must start on a
+    line boundary.
+    """
+    if stop <= start:
+        return
+    with open(sam_file, "rb") as in_file:
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as sam_map:
+            block_start = start
+            while block_start < stop:
+                # Extend the block to the end of the line it stops in
+                line_end = sam_map.find(
+                    b"\n", min(block_start + SAM_READ_BLOCK_SIZE, stop) - 1
+                )
+                block_end = len(sam_map) if line_end < 0 else line_end + 1
+                sam_lines = sam_map[block_start:block_end].split(b"\n")
+                yield list(filter(None, sam_lines)), block_end
+                block_start = block_end
+
+
+def iter_sam_line_bytes(sam_file: str, start: int, stop: int) -> Iterator[bytes]:
+    """
+    Stream the lines found in the byte range [start, stop) of a sam file without their
+    newlines and without decoding them, the range must start on a line boundary.
+    """
+    for sam_lines, _ in iter_sam_line_blocks(sam_file, start, stop):
+        yield from sam_lines
+
+
+def iter_sam_records(sam_file: str, start: int, stop: int) -> Iterator[SamBytesRecord]:
+    return map(SamBytesRecord, iter_sam_line_bytes(sam_file, start, stop))
+
+
+def iter_sam_stream_records(stream: BinaryIO) -> Iterator[SamBytesRecord]:
+    """
+    Stream the alignment records of sam text read from a binary stream such as stdin,
+    a block at a time. The header lines at the start are skipped.
+    """
+    in_header = True
+    remainder = b""
+    while True:
+        block = stream.read(SAM_READ_BLOCK_SIZE)
+        if not block:
+            break
+        sam_lines = (remainder + block).split(b"\n")
+        remainder = sam_lines.pop()
+        if in_header:
+            header_line_count = 0
+            while header_line_count < len(sam_lines) and is_sam_header_line(
+                sam_lines[header_line_count]
+            ):
+                header_line_count += 1
+            in_header = header_line_count == len(sam_lines)
+            sam_lines = sam_lines[header_line_count:]
+        yield from map(SamBytesRecord, filter(None, sam_lines))
+    if remainder and not (in_header and is_sam_header_line(remainder)):
+        yield SamBytesRecord(remainder)
+
+
+def iter_sam_record_chunks(
+    sam_file: str, start: int, stop: int
+) -> Iterator[List[SamBytesRecord]]:
+    """
+    Stream the alignment records of a byte range in chunks for the coverage kernel.
+    """
+    return iter_chunks(iter_sam_records(sam_file, start, stop))
+
+
+def iter_chunks(sam_records: Iterable[Any]) -> Iterator[List[Any]]:
+    """
+    Group alignment records into chunks for the coverage kernel.
+    """
+    sam_records = iter(sam_records)
+    while True:
+        # Records are read and decoded lazily, pulling the chunk does the parsing
+        with get_pipeline_metrics().stage("record parsing"):
+            sam_record_chunk = list(islice(sam_records, SAM_RECORD_CHUNK_SIZE))
+        if not sam_record_chunk:
+            break
+        yield sam_record_chunk
@@ -0,0 +1,246 @@
+import os
+import sys
+from itertools import groupby
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .alignment import DEFAULT_LOOKBEHIND, evaluate_sam_record_chunk, filter_sam_records
+from .bam import (
+    is_bam_file,
+    iter_bam_records,
+    iter_bam_records_in_regions,
+    read_bam_header,
+)
+from .bgzf import BgzfReader, BgzfStreamReader
+from .coverage import CoverageAccumulator
+from .models import PositionResult, Variant
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .sam_reader import (
+    iter_chunks,
+    iter_sam_records,
+    iter_sam_stream_records,
+    read_sam_header,
+)
+from .variant_counter import VariantCounter
+
+# Positions are flushed in steps of this many bases rather than after every chunk
+FLUSH_STEP = 4096
+# Every gzip member starts with these two bytes, and so does every BAM stream
+GZIP_MAGIC = b"\x1f\x8b"
+# Reads the alignments from stdin in place of a file
+STDIN_PATH = "-"
+
+
+def peek_stream(stream: BinaryIO, size: int) -> bytes:
+    """
+    The first bytes of a stream without consuming them, the stream has to be buffered
+    like stdin or seekable.
+    """
+    if hasattr(stream, "peek"):
+        return stream.peek(size)[:size]  # type: ignore
+    start = stream.tell()
+    head = stream.read(size)
+    stream.seek(start)
+    return head
+
+
+def iter_stream_records(stream: BinaryIO) -> Iterator[Any]:
+    """
+    Stream the alignment records of sam or BAM data read from a binary stream, such as
+    the stdin an aligner pipes into. BAM is recognised by the gzip magic it starts with.
+    """
+    if peek_stream(stream, len(GZIP_MAGIC)) == GZIP_MAGIC:
+        with BgzfStreamReader(stream) as bam_reader:
+            _, references = read_bam_header(bam_reader)
+            yield from iter_bam_records(bam_reader, references)
+        return
+    yield from iter_sam_stream_records(stream)
+
+
+def iter_alignment_records(
+    sam_file: str, regions: Optional[RegionSet] = None
+) -> Iterator[Any]:
+    """
+    Stream the alignment records of a sam or BAM file in file order. With regions an
+    indexed BAM file only has the alignments its index lists for them decoded. The
+    path '-' reads stdin.
+    """
+    if sam_file == STDIN_PATH:
+        yield from iter_stream_records(sys.stdin.buffer)
+        return
+    if is_bam_file(sam_file):
+        with BgzfReader(sam_file) as bam_reader:
+            _, references = read_bam_header(bam_reader)
+            if regions is None:
+                yield from iter_bam_records(bam_reader, references)
+            else:
+                yield from iter_bam_records_in_regions(
+                    sam_file, bam_reader, references, regions
+                )
+        return
+    _, alignment_start = read_sam_header(sam_file)
+    yield from iter_sam_records(
+        sam_file, alignment_start, os.path.getsize(sam_file)
+    )
+
+
+class StreamingPileup:
+    """
+    Pile up coordinate sorted alignments while holding only a window of positions behind
+    the current alignment start. Positions that no later alignment can reach are
+    reported as soon as the alignments move past them and are then forgotten.
+    """
+
+    def __init__(
+        self,
+        lookbehind: int = DEFAULT_LOOKBEHIND,
+        regions: Optional[RegionSet] = None,
+        read_filter: Optional[ReadFilter] = None,
+    ):
+        self.lookbehind = lookbehind
+        self.regions = regions
+        self.read_filter = read_filter
+        self._coverage = CoverageAccumulator()
+        self._pending_variants = VariantCounter()
+        self._chrom: Optional[str] = None
+        self._last_pos = 0
+        self._flushed_until: Optional[int] = None
+        self._finished_chroms: Set[str] = set()
+
+    def add_records(self, sam_records: List[Any]) -> Iterator[PositionResult]:
+        """
+        Pile up a chunk of alignments, report the positions that are complete after it.
+        """
+        sam_records = filter_sam_records(sam_records, self.regions, self.read_filter)
+        for chrom, chrom_records in groupby(
+            sam_records, key=lambda sam_record: sam_record["RNAME"]
+        ):
+            chrom_record_list = list(chrom_records)
+            if chrom != self._chrom:
+                yield from self.finish_chrom()
+                if chrom in self._finished_chroms:
+                    raise ValueError(
+                        f"Alignments are not sorted by coordinate, {chrom} appears "
+                        "again after other chromosomes"
+                    )
+                self._chrom = chrom
+            self._add_chrom_records(chrom_record_list)
+            flush_stop = self._last_pos - self.lookbehind
+            if self._flushed_until is None or (
+                flush_stop - self._flushed_until >= FLUSH_STEP
+            ):
+                yield from self._flush(flush_stop)
+
+    def _add_chrom_records(self, sam_records: List[Any]):
+        for sam_record in sam_records:
+            pos = int(sam_record["POS"])
+            if pos < self._last_pos:
+                raise ValueError(
+                    f"Alignments are not sorted by coordinate, {self._chrom}:{pos} "
+                    f"follows {self._chrom}:{self._last_pos}"
+                )
+            self._last_pos = pos
+        chunk_intervals = evaluate_sam_record_chunk(
+            sam_records, self._pending_variants, self._coverage
+        )
+        if self._flushed_until is None:
+            return
+        for intervals in chunk_intervals:
+            reach = min((start for start, _ in intervals), default=self._flushed_until)
+            if reach < self._flushed_until:
+                raise ValueError(
+                    f"An alignment reaches back to {self._chrom}:{reach} "
+                    f"which was already written, increase the lookbehind above "
+                    f"{self.lookbehind}"
+                )
+
+    def _flush(self, stop: Optional[int]) -> Iterator[PositionResult]:
+        """
+        Report and forget the positions of the current chromosome below stop, or all of
+        them without a stop.
+        """
+        chrom = self._chrom
+        if chrom is None:
+            return
+        position_to_variant_read_depths: Dict[int, List[Tuple[Variant, int]]] = {}
+        for variant, variant_read_depth in self._pending_variants.pop_variants(
+            chrom, stop
+        ):
+            position_to_variant_read_depths.setdefault(variant.pos, []).append(
+                (variant, variant_read_depth)
+            )
+        for pos, read_depth in self._coverage.pop_depths(chrom, None, stop):
+            variant_read_depths = tuple(position_to_variant_read_depths.get(pos, ()))
+            if self.regions is None or self.regions.contains(chrom, pos):
+                yield PositionResult(chrom, pos, read_depth, variant_read_depths)
+        self._flushed_until = stop
+
+    def finish_chrom(self) -> Iterator[PositionResult]:
+        """
+        Report every remaining position of the current chromosome.
+        """
+        if self._chrom is None:
+            return
+        yield from self._flush(None)
+        self._finished_chroms.add(self._chrom)
+        self._chrom = None
+        self._last_pos = 0
+        self._flushed_until = None
+
+    def pileup(self, sam_records: Iterable[Any]) -> Iterator[PositionResult]:
+        """
+        Pile up every alignment of a coordinate sorted stream, positions are reported in
+        order as they are completed.
+        """
+        for sam_record_chunk in iter_chunks(sam_records):
+            yield from self.add_records(sam_record_chunk)
+        yield from self.finish_chrom()
+
+
+def evaluate_sam_file_streaming(
+    sam_file: str,
+    regions: Optional[RegionSet] = None,
+    lookbehind: int = DEFAULT_LOOKBEHIND,
+    read_filter: Optional[ReadFilter] = None,
+) -> Iterator[PositionResult]:
+    """
+    Evaluate a coordinate sorted sam or BAM file position by position, memory is bound
+    by the alignments overlapping the window rather than by the genome size.
+    """
+    streaming_pileup = StreamingPileup(lookbehind, regions, read_filter)
+    yield from streaming_pileup.pileup(iter_alignment_records(sam_file, regions))
+
+
+def iter_position_result_batches(
+    alignments: Union[Iterable[Any], BinaryIO],
+    regions: Optional[RegionSet] = None,
+    lookbehind: int = DEFAULT_LOOKBEHIND,
+    read_filter: Optional[ReadFilter] = None,
+) -> Iterator[List[PositionResult]]:
+    """
+    Pile up coordinate sorted alignments in process and yield the positions that became
+    final after each chunk of them as one batch, in order. The alignments are any
+    iterable of sam records, BAM records or sam column dicts, or a binary stream of sam
+    or BAM data such as sys.stdin.buffer.
+    """
+    if hasattr(alignments, "read"):
+        alignments = iter_stream_records(alignments)  # type: ignore
+    streaming_pileup = StreamingPileup(lookbehind, regions, read_filter)
+    for sam_record_chunk in iter_chunks(alignments):  # type: ignore
+        position_results = list(streaming_pileup.add_records(sam_record_chunk))
+        if position_results:
+            yield position_results
+    position_results = list(streaming_pileup.finish_chrom())
+    if position_results:
+        yield position_results
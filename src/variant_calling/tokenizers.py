@@ -0,0 +1,57 @@
+import re
+from functools import lru_cache
+from typing import Dict, Tuple
+
+# The character classes carry the commas the original patterns had, an MD or cigar
+# string never holds one so they do not change what matches
+MD_TOKEN_PATTERN = re.compile(r"([0-9]+)([\^A,C,T,G]+)")
+MD_FINAL_COUNT_PATTERN = re.compile(r"[0-9]*$")
+CIGAR_TOKEN_PATTERN = re.compile(r"([0-9]+)([M,I,D,N,S,H,P,=,X])")
+# Short read data shares a handful of cigars and MD strings between most alignments,
+# the caches only need to hold the common ones
+TOKENIZER_CACHE_SIZE = 4096
+
+Tokens = Tuple[Tuple[int, str], ...]
+
+
+def tokenize_md(md_string: str) -> Tokens:
+    """
+    Split an 'MD:Z:' field into (matching base count, reference bases) tokens, the bases
+    after the last mismatch end the list as (count, "N").
+    """
+    md_tokens = [
+        (int(base_count), ref_base)
+        for base_count, ref_base in MD_TOKEN_PATTERN.findall(md_string, 5)
+    ]
+    final_base_count = MD_FINAL_COUNT_PATTERN.search(md_string).group()  # type: ignore
+    md_tokens.append((int(final_base_count), "N"))
+    return tuple(md_tokens)
+
+
+def tokenize_cigar(cigar_string: str) -> Tokens:
+    """
+    Split a cigar string into (base count, operation) tokens.
+    """
+    return tuple(
+        (int(base_count), cigar_op)
+        for base_count, cigar_op in CIGAR_TOKEN_PATTERN.findall(cigar_string)
+    )
+
+
+cached_tokenize_md = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(tokenize_md)
+cached_tokenize_cigar = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(tokenize_cigar)
+
+
+def get_tokenizer_cache_info() -> Dict[str, Tuple[int, int]]:
+    """
+    The (hits, misses) of each tokenizer cache.
+    """
+    return {
+        "md": cached_tokenize_md.cache_info()[:2],
+        "cigar": cached_tokenize_cigar.cache_info()[:2],
+    }
+
+
+def clear_tokenizer_caches():
+    cached_tokenize_md.cache_clear()
+    cached_tokenize_cigar.cache_clear()
@@ -1,277 +1,626 @@
-import csv
-import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Set, Tuple
-
-
-# Frozen so we can use it as a dict key
-@dataclass(order=True, frozen=True)
-class Variant:
-    chrom: str
-    pos: int
-    ref: str
-    alt: str
-
-    def to_str(self):
-        return f"{self.chrom}-{self.pos}-{self.ref}-{self.alt}"
-
-
-@dataclass(order=True, frozen=True)
-class GenomicPosition:
-    chrom: str
-    pos: int
-
-    def to_str(self):
-        return f"{self.chrom}-{self.pos}"
-
-
-def get_reverse_complement(dna):
-    complement = {"A": "T", "C": "G", "G": "C", "T": "A"}
-    return "".join([complement[base] for base in dna[::-1]])
-
-
-def parse_md_string(md_string: str) -> List[Tuple[int, str]]:
-    parsed_md_list = []
-    for matched_region in re.finditer(r"([0-9]+)([\^A,C,T,G]+)", md_string[5:]):
-        base_count = int(matched_region.group(1))
-        ref_base = matched_region.group(2)
-        parsed_md_list.append((base_count, ref_base))
-    final_base_count = ""
-    char = md_string[-1]
-    count = -1
-    string_numbers = [str(x) for x in range(0, 10)]
-    while char in string_numbers:
-        final_base_count += char
-        count -= 1
-        char = md_string[count]
-    parsed_md_list.append((int(final_base_count), "N"))
-    return parsed_md_list
-
-
-def parse_sam_flag(flag: int) -> bool:
-    if flag < 16:
-        return False
-    else:
-        # Parse the binary flag, the 5th bit indicates reverse complement
-        return bool(int(bin(flag)[-5]))
-
-
-def identify_and_validate_reference_bases(
-    parsed_md_list: List[Tuple[int, str]], seq: str, qual: str, reverse_complement: bool
-) -> List[Tuple[int, str, str]]:
-    read_variant_list = []  # Parsed variant information from the reads perspective
-    for md_element in parsed_md_list:
-        base_count, ref_base = md_element
-        if ref_base == "N":
-            continue
-        alt_base = seq[base_count]
-        base_quality = ord(qual[base_count]) - 33
-        if base_quality <= 20:
-            continue
-        if reverse_complement:
-            alt_base = get_reverse_complement(alt_base)
-        read_variant_list.append((base_count, ref_base, alt_base))
-    return read_variant_list
-
-
-def variant_call(
-    chrom: str,
-    alignment_start_pos: int,
-    reverse_complement: bool,
-    read_variant_list: List[Tuple[int, str, str]],
-) -> Set[Variant]:
-    variant_set: Set[Variant] = set()
-    total_bases_seen = 0
-    for read_variant in read_variant_list:
-        base_count, ref_base, alt_base = read_variant
-        total_bases_seen += base_count
-        if ref_base == "N":
-            continue
-        if reverse_complement:
-            variant_position = alignment_start_pos - total_bases_seen
-            variant = Variant(chrom, variant_position, ref_base, alt_base)
-        else:
-            variant_position = alignment_start_pos + total_bases_seen
-            variant = Variant(chrom, variant_position, ref_base, alt_base)
-        variant_set.add(variant)
-    return variant_set
-
-
-def variant_calling_for_one_sam_record(
-    sam_record: Dict[str, Any]
-) -> Optional[Set[Variant]]:
+import json
+import os
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# The per alignment calling functions are re-exported, this module is the public api
+from .alignment import (  # noqa: F401
+    count_sam_record_chunk_bases,
+    filter_sam_records,
+    filter_sam_records_to_regions,
+    get_coverage_data_for_one_sam_record,
+    get_coverage_intervals,
+    get_coverage_intervals_for_one_sam_record,
+    get_covered_variants,
+    get_filter_parameters,
+    parse_cigar_string,
+    parse_md_string,
+    parse_sam_flag,
+    variant_calling_for_one_sam_record,
+)
+from .bam import evaluate_bam_file, is_bam_file
+from .cache import DEFAULT_CACHE_MAX_BYTES, ResultCache
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL, evaluate_sam_file_checkpointed
+from .coverage import (
+    BASE_COUNT_ORDER,
+    BaseCountAccumulator,
+    CoverageAccumulator,
+    SharedCoverageAccumulator,
+    merge_depth_runs,
+)
+from .index import TABIX_BED_COLUMNS
+from .instrumentation import get_pipeline_metrics, reset_pipeline_metrics
+from .models import (  # noqa: F401
+    GenomicPosition,
+    GenomicRegion,
+    PositionResult,
+    Variant,
+)
+from .output_files import OutputFile
+from .parallel import evaluate_sam_file_parallel, evaluate_sam_file_shared
+from .partials import PartialFile, iter_depth_runs_writing_variants, write_partial_file
+from .pipeline import evaluate_sam_file_pipelined
+from .read_filters import ReadFilter
+from .regions import RegionSet
+from .result_store import update_result_store
+from .sam_reader import iter_chunks
+from .streaming import (  # noqa: F401
+    STDIN_PATH,
+    evaluate_sam_file_streaming,
+    iter_alignment_records,
+    iter_position_result_batches,
+)
+from .variant_counter import VariantCounter
+
+
+def restrict_to_regions(
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: CoverageAccumulator,
+    regions: RegionSet,
+) -> Tuple[VariantCounter, CoverageAccumulator]:
     """
-    Identifies all variants in a single BWA alignment record. Returns a list of variant objects.
+    Drop the variants and positions outside of the regions, alignments that overlap a
+    region can still reach past it.
     """
-    # If there are no variants in the alignment MD then return asap
-    no_variant = True
-    for base in ["A", "T", "C", "G"]:
-        if base in sam_record["MD"]:
-            no_variant = False
-    if no_variant:
-        return None
-
-    # Gather the necessary variables from the alignment
-    chrom: str = sam_record["RNAME"]
-    alignment_start_pos: int = int(sam_record["POS"])
-    reverse_complement: bool = parse_sam_flag(int(sam_record["FLAG"]))
-    seq: str = sam_record["SEQ"]
-    qual: str = sam_record["QUAL"]
-
-    # Call variants in this alignment
-    parsed_md_list: List[Tuple[int, str]] = parse_md_string(sam_record["MD"])
-    read_variant_list: List[
-        Tuple[int, str, str]
-    ] = identify_and_validate_reference_bases(
-        parsed_md_list, seq, qual, reverse_complement
-    )
-    variant_set = variant_call(
-        chrom, alignment_start_pos, reverse_complement, read_variant_list
+    return (
+        variant_to_read_depth.subset(regions.contains),
+        position_to_read_depth.subset(
+            {
+                chrom: [(start, end + 1) for start, end in chrom_intervals]
+                for chrom, chrom_intervals in regions.intervals.items()
+            }
+        ),
     )
-    return variant_set
 
 
-def parse_cigar_string(cigar_string: str) -> List[Tuple[int, str]]:
-    parsed_cigar_list: List[Tuple[int, str]] = []
-    for matched_region in re.finditer("([0-9]+)([M,I,D,N,S,H,P,=,X])", cigar_string):
-        base_count = int(matched_region.group(1))
-        cigar_op = matched_region.group(2)
-        parsed_cigar_list.append((base_count, cigar_op))
-    return parsed_cigar_list
+@contextmanager
+def evaluated_sam_file(
+    sam_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    pipelined: bool = False,
+    shared_memory: bool = False,
+    checkpoint_file: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    read_filter: Optional[ReadFilter] = None,
+) -> Iterator[Tuple[VariantCounter, CoverageAccumulator]]:
+    """
+    Evaluate as evaluate_sam_file does, for as long as the context is open. Shared
+    memory coverage is reported in the shared arrays rather than copied out of them,
+    they are freed when the context closes.
+    """
+    if pipelined and shared_memory:
+        raise ValueError("Pipelined and shared memory evaluation can not be combined")
+    with ExitStack() as shared_memory_stack:
+        if checkpoint_file is not None:
+            if (
+                pipelined
+                or shared_memory
+                or (workers > 1 and not is_bam_file(sam_file))
+            ):
+                raise ValueError(
+                    "Checkpoints are taken of one process reading sam input"
+                )
+            results = evaluate_sam_file_checkpointed(
+                sam_file,
+                checkpoint_file,
+                resume,
+                regions,
+                threads=workers if workers > 1 else 0,
+                checkpoint_interval=checkpoint_interval,
+                read_filter=read_filter,
+            )
+        elif is_bam_file(sam_file):
+            results = evaluate_bam_file(
+                sam_file,
+                threads=workers if workers > 1 else 0,
+                regions=regions,
+                read_filter=read_filter,
+            )
+        elif pipelined:
+            results = evaluate_sam_file_pipelined(
+                sam_file, workers, regions, read_filter
+            )
+        elif shared_memory:
+            variant_to_read_depth, shared_position_to_read_depth = (
+                evaluate_sam_file_shared(sam_file, workers, regions, read_filter)
+            )
+            shared_memory_stack.callback(
+                shared_position_to_read_depth.close, unlink=True
+            )
+            results = variant_to_read_depth, shared_position_to_read_depth
+        else:
+            results = evaluate_sam_file_parallel(
+                sam_file, workers, regions, read_filter
+            )
+        if regions is not None:
+            results = restrict_to_regions(*results, regions)
+            # The subset is private, the shared arrays are not needed past it
+            shared_memory_stack.close()
+        yield results
 
 
-def get_coverage_data_for_one_sam_record(
-    sam_record: Dict[str, Any]
-) -> Set[GenomicPosition]:
+def evaluate_sam_file(
+    sam_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    pipelined: bool = False,
+    shared_memory: bool = False,
+    checkpoint_file: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    read_filter: Optional[ReadFilter] = None,
+) -> Tuple[VariantCounter, CoverageAccumulator]:
     """
-    Determine the valid reference bases that are covered by this alignment where a valid base
-    has a quality greater than or equal to 20 phred.
+    Evaluate a list of sam records, report all valid variants and their read depth, as
+    well as the read depth of every valid position.
 
-    BWA alignments are done from the reads perspective, every base is considered and reported.
-    """
-    # Gather the necessary variables from the alignment
-    alignment_start_pos: int = int(sam_record["POS"])
-    reverse_complement: bool = parse_sam_flag(int(sam_record["FLAG"]))
-    qual: str = sam_record["QUAL"]
-    chrom: str = sam_record["RNAME"]
-
-    # Process the string cigar into a machine readable list of tuples
-    parsed_cigar_list: List[Tuple[int, str]] = parse_cigar_string(sam_record["CIGAR"])
-    position_set: Set[GenomicPosition] = set()  # The reference positions which are covered
-    current_position_in_ref = (
-        alignment_start_pos  # The current position in the reference genome
-    )
-    current_position_in_read = 0  # The current position in the read
-
-    # Go over the elements of the cigar string, update the current read position
-    # as well as the current reference position each iteration so they are always accurate
-    for parsed_cigar in parsed_cigar_list:
-        base_count, cigar_op = parsed_cigar
-        if cigar_op == "M":  # Matched sequence
-            start = current_position_in_read
-            stop = current_position_in_read + base_count
-            for char in qual[start:stop]:
-                if ord(char) >= 20:
-                    position_set.add(GenomicPosition(chrom, current_position_in_ref))
-                if reverse_complement:
-                    current_position_in_ref -= 1
-                else:
-                    current_position_in_ref += 1
-        elif cigar_op == "I":  # Insertions
-            current_position_in_read += base_count
-        elif (
-            cigar_op == "D" or cigar_op == "S" or cigar_op == "H"
-        ):  # Skipped or deleted sequence
-            current_position_in_read += base_count
-            if reverse_complement:
-                current_position_in_ref -= base_count
-            else:
-                current_position_in_ref += base_count
-    return position_set
+    With more than one worker the alignments are split into byte ranges that are
+    evaluated in separate processes and merged. BAM input is recognised by its magic
+    string, its blocks are then decompressed by one thread per worker.
 
+    Pipelined sam input is read by a thread, parsed and called in blocks by the worker
+    processes and merged as the blocks come back, see evaluate_sam_file_pipelined.
 
-def evaluate_sam_file(
-    sam_file: str
-) -> Tuple[Dict[Variant, int], Dict[GenomicPosition, int]]:
+    With shared memory, coordinate sorted sam input is split into disjoint ranges of
+    positions whose workers add their depths to one set of shared arrays, see
+    evaluate_sam_file_shared. The coverage is copied out of them into private pages,
+    evaluated_sam_file reads it in place.
+
+    With a checkpoint file the input is read in one pass that writes checkpoints of the
+    running totals to it, and resume picks up from the last one, see
+    evaluate_sam_file_checkpointed. BAM blocks are still decompressed by the workers.
+
+    With regions only the alignments overlapping them are evaluated and only positions
+    inside them are reported. Indexed BAM input seeks straight to those alignments.
+
+    With a read filter the alignments it rejects on their FLAG and MAPQ are dropped
+    before anything else of them is parsed, the rejections are counted per filter.
     """
-    Evaluate a list of sam records, report two dicts, one that lists all valid variants and their read depth, another
-    that lists all valid positions and their read depth.
+    with evaluated_sam_file(
+        sam_file,
+        workers,
+        regions,
+        pipelined,
+        shared_memory,
+        checkpoint_file,
+        resume,
+        checkpoint_interval,
+        read_filter,
+    ) as (variant_to_read_depth, position_to_read_depth):
+        if isinstance(position_to_read_depth, SharedCoverageAccumulator):
+            position_to_read_depth = position_to_read_depth.copy()
+        return variant_to_read_depth, position_to_read_depth
+
+
+def evaluate_base_counts(
+    sam_file: str,
+    regions: Optional[RegionSet] = None,
+    read_filter: Optional[ReadFilter] = None,
+) -> BaseCountAccumulator:
     """
-    variant_to_read_depth: Dict[Variant, int] = {}
-    position_to_read_depth: Dict[GenomicPosition, int] = {}
-    sam_header = [
-        "QNAME",
-        "FLAG",
-        "RNAME",
-        "POS",
-        "MAPQ",
-        "CIGAR",
-        "RNEXT",
-        "PNEXT",
-        "TLEN",
-        "SEQ",
-        "QUAL",
-        "NM",
-        "MD",
-        "AS",
-        "XS",
-        "XA",
-    ]
-    with open(sam_file, "r") as in_file:
-        while in_file.readline().startswith("@"):
-            continue # Skip headers
-        for sam_record in csv.DictReader(in_file, delimiter="\t", fieldnames=sam_header):
-            position_set = get_coverage_data_for_one_sam_record(sam_record)
-            for position in position_set:
-                if position_to_read_depth.get(position):
-                    position_to_read_depth[position] += 1
-                else:
-                    position_to_read_depth[position] = 1
-            variant_set = variant_calling_for_one_sam_record(sam_record)
-            if variant_set:
-                for variant in variant_set:
-                    v_gen_pos = GenomicPosition(variant.chrom, variant.pos)
-                    if v_gen_pos in position_set:  # The base has passing quality
-                        if variant_to_read_depth.get(variant):
-                            variant_to_read_depth[variant] += 1
-                        else:
-                            variant_to_read_depth[variant] = 1
-    return variant_to_read_depth, position_to_read_depth
+    Count the quality passing read bases over A, C, G, T and N at every covered position
+    of a sam or BAM file. The counts are gathered in a pass and a process of their own.
+    """
+    base_counts = BaseCountAccumulator()
+    with get_pipeline_metrics().stage("base counting"):
+        for sam_record_chunk in iter_chunks(iter_alignment_records(sam_file, regions)):
+            if read_filter is not None:
+                # The rejected reads are counted by the calling pass
+                sam_record_chunk = read_filter.filter_sam_records(sam_record_chunk, {})
+            if regions is not None:
+                sam_record_chunk = filter_sam_records_to_regions(
+                    sam_record_chunk, regions
+                )
+            count_sam_record_chunk_bases(sam_record_chunk, base_counts)
+    return base_counts
 
 
 def write_variant_out_file(
-    variant_to_read_depth: Dict[Variant, int],
-    position_to_read_depth: Dict[GenomicPosition, int],
+    variant_to_read_depth: VariantCounter,
+    position_to_read_depth: CoverageAccumulator,
     variant_out_file: str,
+    compress: bool = False,
 ):
-    with open(variant_out_file, "w") as out_file:
+    with OutputFile(variant_out_file, compress) as out_file:
         out_file.write("variant\tvar_read_depth\tfull_read_depth\n")
-        for variant, variant_read_depth in variant_to_read_depth.items():
-            read_depth = position_to_read_depth.get(
-                GenomicPosition(variant.chrom, variant.pos), 0
+        # Formatted like Variant.to_str without building one per variant
+        for chrom, pos, ref, alt, variant_read_depth in (
+            variant_to_read_depth.iter_counts()
+        ):
+            read_depth = position_to_read_depth.depth(chrom, pos)
+            out_file.write(
+                f"{chrom}-{pos}-{ref}-{alt}\t{variant_read_depth}\t{read_depth}\n"
             )
-            out_file.write(f"{variant.to_str()}\t{variant_read_depth}\t{read_depth}\n")
 
 
 def write_position_depth_out_file(
-    position_to_read_depth: Dict[GenomicPosition, int], position_out_file: str
+    position_to_read_depth: CoverageAccumulator,
+    position_out_file: str,
+    coverage_format: str = "positions",
+    compress: bool = False,
+):
+    if coverage_format == "bedgraph":
+        write_bedgraph_rows(
+            position_to_read_depth.iter_depth_runs(), position_out_file, compress
+        )
+    else:
+        write_position_rows(
+            position_to_read_depth.iter_depths(), position_out_file, compress
+        )
+
+
+def write_position_rows(
+    position_depths: Iterable[Tuple[str, int, int]],
+    position_out_file: str,
+    compress: bool = False,
 ):
-    with open(position_out_file, "w") as out_file:
+    with OutputFile(position_out_file, compress) as out_file:
         out_file.write("position\tread_depth\n")
-        for position, read_depth in position_to_read_depth.items():
-            out_file.write(f"{position.to_str()}\t{read_depth}\n")
+        # Formatted like GenomicPosition.to_str without building one per base
+        out_file.writelines(
+            f"{chrom}-{pos}\t{read_depth}\n"
+            for chrom, pos, read_depth in position_depths
+        )
+
+
+def write_bedgraph_rows(
+    depth_runs: Iterable[Tuple[str, int, int, int]],
+    bedgraph_out_file: str,
+    compress: bool = False,
+):
+    """
+    Write runs of equal read depth as bedGraph, 'chrom start end depth' with zero based,
+    half open coordinates. Uncovered positions have no line. A compressed bedGraph is
+    tabix indexed.
+
+    Reverse reads walk the reference backwards and can cover positions before 1, which
+    bedGraph has no coordinates for. Runs are clipped to start at position 1 and those
+    entirely before it are left out.
+    """
+    with OutputFile(bedgraph_out_file, compress, TABIX_BED_COLUMNS) as out_file:
+        for chrom, start, stop, read_depth in depth_runs:
+            start = max(start, 1)
+            if start < stop:
+                out_file.write(f"{chrom}\t{start - 1}\t{stop - 1}\t{read_depth}\n")
+
+
+def write_base_count_out_file(
+    base_counts: BaseCountAccumulator,
+    base_count_out_file: str,
+    regions: Optional[RegionSet] = None,
+    compress: bool = False,
+):
+    """
+    Write the base counts of every covered position, 'chrom-pos' followed by a column
+    per base in BASE_COUNT_ORDER.
+    """
+    row_format = "%s-%d" + "\t%d" * len(BASE_COUNT_ORDER) + "\n"
+    with OutputFile(base_count_out_file, compress) as out_file:
+        out_file.write("\t".join(["position", *BASE_COUNT_ORDER]) + "\n")
+        out_file.writelines(
+            row_format % (chrom, pos, *counts)
+            for chrom, pos, counts in base_counts.iter_base_counts()
+            if regions is None or regions.contains(chrom, pos)
+        )
+
+
+def iter_position_depths_writing_variants(
+    position_results: Iterable[PositionResult],
+    variant_out_file: str,
+    compress: bool = False,
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Write the variant rows of every completed position while passing its read depth on
+    to the coverage writer.
+    """
+    with OutputFile(variant_out_file, compress) as variant_file:
+        variant_file.write("variant\tvar_read_depth\tfull_read_depth\n")
+        for position_result in position_results:
+            read_depth = position_result.read_depth
+            for variant, variant_read_depth in position_result.variant_read_depths:
+                variant_file.write(
+                    f"{variant.to_str()}\t{variant_read_depth}\t{read_depth}\n"
+                )
+            yield position_result.chrom, position_result.pos, read_depth
+
+
+def write_streaming_out_files(
+    position_results: Iterable[PositionResult],
+    variant_out_file: str,
+    position_out_file: str,
+    coverage_format: str = "positions",
+    compress: bool = False,
+):
+    """
+    Write the variant and position rows as the positions are completed, the rows come
+    out sorted by position within each chromosome.
+    """
+    position_depths = iter_position_depths_writing_variants(
+        position_results, variant_out_file, compress
+    )
+    if coverage_format == "bedgraph":
+        write_bedgraph_rows(
+            merge_depth_runs(position_depths), position_out_file, compress
+        )
+    else:
+        write_position_rows(position_depths, position_out_file, compress)
+
+
+def merge_partial_files(
+    partial_files: List[str],
+    variant_out_file: str,
+    position_out_file: str,
+    coverage_format: str = "positions",
+    compress: bool = False,
+):
+    """
+    Merge the partials of separate runs, such as one per lane, into the variant and
+    coverage files of their combined alignments. The partials are streamed through a
+    k-way merge a chromosome at a time, rows come out sorted by position within each
+    chromosome.
+
+    The partials have to be of the same regions and read filter, otherwise a
+    ValueError is raised. Partials that do not record them were evaluated without
+    either.
+    """
+    metrics = reset_pipeline_metrics()
+    with ExitStack() as partial_stack, metrics.stage("output writing"):
+        partials = [
+            partial_stack.enter_context(PartialFile(partial_file))
+            for partial_file in partial_files
+        ]
+        # As the footer reads back, its json has lists where the parameters have tuples
+        default_parameters = json.loads(json.dumps(get_filter_parameters()))
+        for partial_file, partial in zip(partial_files[1:], partials[1:]):
+            if (partial.parameters or default_parameters) != (
+                partials[0].parameters or default_parameters
+            ):
+                raise ValueError(
+                    f"{partial_file} holds totals of other regions or another read "
+                    f"filter than {partial_files[0]}"
+                )
+        depth_runs = iter_depth_runs_writing_variants(
+            partials,
+            variant_out_file,
+            compress,
+        )
+        if coverage_format == "bedgraph":
+            write_bedgraph_rows(depth_runs, position_out_file, compress)
+        else:
+            write_position_rows(
+                (
+                    (chrom, pos, depth)
+                    for chrom, start, stop, depth in depth_runs
+                    for pos in range(start, stop)
+                ),
+                position_out_file,
+                compress,
+            )
+    metrics.log_summary()
+
+
+def get_out_files(
+    variant_out_file: str,
+    position_out_file: str,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    base_count_out_file: Optional[str] = None,
+    partial_out_file: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    The files a run writes keyed by their role, a compressed bedGraph file comes with
+    its tabix index.
+    """
+    out_files = {"variants": variant_out_file, "coverage": position_out_file}
+    if compress and coverage_format == "bedgraph":
+        out_files["coverage.tbi"] = f"{position_out_file}.tbi"
+    if base_count_out_file:
+        out_files["base_counts"] = base_count_out_file
+    if partial_out_file is not None:
+        out_files["partial"] = partial_out_file
+    return out_files
+
+
+def write_evaluated_out_files(
+    sam_file: str,
+    variant_out_file: str,
+    position_out_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    pipelined: bool = False,
+    shared_memory: bool = False,
+    checkpoint_file: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    partial_out_file: Optional[str] = None,
+    result_store: Optional[str] = None,
+    read_filter: Optional[ReadFilter] = None,
+):
+    """
+    Evaluate the whole input, or add it to a result store, and write the totals, see
+    call_variants_on_sam_file.
+    """
+
+    # Shared memory coverage is written straight from the shared arrays, they are
+    # only freed once the outputs are written
+    evaluation_stack = ExitStack()
+
+    def evaluate() -> Tuple[VariantCounter, CoverageAccumulator]:
+        return evaluation_stack.enter_context(
+            evaluated_sam_file(
+                sam_file,
+                workers,
+                regions,
+                pipelined,
+                shared_memory,
+                checkpoint_file,
+                resume,
+                checkpoint_interval,
+                read_filter,
+            )
+        )
+
+    with evaluation_stack:
+        if result_store is not None:
+            variant_to_read_depth, position_to_read_depth = update_result_store(
+                result_store, sam_file, evaluate, regions, read_filter
+            )
+        else:
+            variant_to_read_depth, position_to_read_depth = evaluate()
+        with get_pipeline_metrics().stage("output writing"):
+            write_variant_out_file(
+                variant_to_read_depth,
+                position_to_read_depth,
+                variant_out_file,
+                compress,
+            )
+            write_position_depth_out_file(
+                position_to_read_depth, position_out_file, coverage_format, compress
+            )
+            if partial_out_file is not None:
+                write_partial_file(
+                    variant_to_read_depth,
+                    position_to_read_depth,
+                    partial_out_file,
+                    parameters=get_filter_parameters(regions, read_filter),
+                )
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
 def call_variants_on_sam_file(
-    sam_file: str, variant_out_file: str, position_out_file: str
+    sam_file: str,
+    variant_out_file: str,
+    position_out_file: str,
+    workers: int = 1,
+    regions: Optional[RegionSet] = None,
+    streaming: bool = False,
+    coverage_format: str = "positions",
+    compress: bool = False,
+    base_count_out_file: Optional[str] = None,
+    pipelined: bool = False,
+    shared_memory: bool = False,
+    checkpoint_file: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    partial_out_file: Optional[str] = None,
+    result_store: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    read_filter: Optional[ReadFilter] = None,
 ):
     """
     Stream through the sam alignment file to gather variant and coverage information.
     Write that information to file.
+
+    Coordinate sorted input can be evaluated in streaming mode, positions are then
+    written as soon as the alignments have moved past them and memory does not grow
+    with the genome size. Streaming runs in a single process.
+
+    The coverage is written one line per position, or with the "bedgraph" format as
+    runs of equal read depth.
+
+    With compress the outputs are BGZF compressed by background threads while the
+    calling goes on, a bedGraph coverage file also gets a tabix index.
+
+    The sam file '-' reads the alignments from stdin, which can only be read in one
+    streaming pass.
+
+    Given a base count file the A/C/G/T/N counts of the quality passing bases at every
+    covered position are written to it as well, their sum is the read depth.
+
+    A partial out file gets the results in the binary form merge_partial_files combines
+    with the partials of other runs.
+
+    With a result store the results are added to the totals kept in it from earlier
+    inputs, such as the first sequencing run of a sample before a top-up, and the
+    outputs hold the updated totals. An input already applied to the store is
+    recognised by its content hash and not counted again, see update_result_store.
+
+    A checkpoint file is written every checkpoint_interval seconds or less often, so a
+    run that is killed can be resumed from it. It is removed once the outputs are
+    written.
+
+    A read filter drops alignments by their FLAG and MAPQ before they are evaluated,
+    see ReadFilter. The reads rejected by each filter are logged with the summary.
+
+    Given a cache directory the outputs are looked up by a fingerprint of the input and
+    of the parameters that shape them, a hit copies the cached outputs instead of
+    calling again and a miss adds the new outputs, see ResultCache. Runs on stdin or
+    on a result store are not cached.
+
+    Progress and the time spent in each stage are logged to the "variant_calling"
+    logger.
     """
-    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(sam_file)
-    write_variant_out_file(
-        variant_to_read_depth, position_to_read_depth, variant_out_file
+    if sam_file == STDIN_PATH and (not streaming or base_count_out_file):
+        raise ValueError("Alignments from stdin can only be read in streaming mode")
+    if streaming and checkpoint_file is not None:
+        raise ValueError("Checkpoints can not be taken of streaming runs")
+    if streaming and (partial_out_file is not None or result_store is not None):
+        raise ValueError("Streaming runs do not keep the totals a partial file needs")
+    metrics = reset_pipeline_metrics()
+    out_files = get_out_files(
+        variant_out_file,
+        position_out_file,
+        coverage_format,
+        compress,
+        base_count_out_file,
+        partial_out_file,
     )
-    write_position_depth_out_file(position_to_read_depth, position_out_file)
+    result_cache = None
+    if cache_dir is not None and sam_file != STDIN_PATH and result_store is None:
+        result_cache = ResultCache(cache_dir, cache_max_bytes)
+        fingerprint = result_cache.fingerprint(
+            sam_file,
+            {
+                **get_filter_parameters(regions, read_filter),
+                "streaming": streaming,
+                "coverage_format": coverage_format,
+                "compress": compress,
+                "out_files": sorted(out_files),
+            },
+        )
+        if result_cache.fetch(fingerprint, out_files):
+            metrics.log_summary()
+            return
+    if base_count_out_file:
+        base_counts = evaluate_base_counts(sam_file, regions, read_filter)
+        with metrics.stage("output writing"):
+            write_base_count_out_file(
+                base_counts, base_count_out_file, regions, compress
+            )
+    if streaming:
+        # Rows are written as they are completed, the writing is part of every stage
+        write_streaming_out_files(
+            evaluate_sam_file_streaming(sam_file, regions, read_filter=read_filter),
+            variant_out_file,
+            position_out_file,
+            coverage_format,
+            compress,
+        )
+    else:
+        write_evaluated_out_files(
+            sam_file,
+            variant_out_file,
+            position_out_file,
+            workers,
+            regions,
+            coverage_format,
+            compress,
+            pipelined,
+            shared_memory,
+            checkpoint_file,
+            resume,
+            checkpoint_interval,
+            partial_out_file,
+            result_store,
+            read_filter,
+        )
+    if result_cache is not None:
+        result_cache.store(fingerprint, out_files)
+    metrics.log_summary()
     return
@@ -0,0 +1,166 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from .models import Variant
+
+# A variant key packs the position, a chromosome id and the ids of the ref and alt
+# alleles into one int, pos << POS_SHIFT | chrom id << CHROM_SHIFT | ref id << ALT_BITS
+# | alt id. The position is the top field so the odd negative position still packs.
+CHROM_BITS = 20
+ALLELE_BITS = 20
+CHROM_SHIFT = 2 * ALLELE_BITS
+POS_SHIFT = CHROM_SHIFT + CHROM_BITS
+CHROM_MASK = (1 << CHROM_BITS) - 1
+ALLELE_MASK = (1 << ALLELE_BITS) - 1
+# Interned first so single base alleles always get the ids 0 to 3, a 2 bit code
+BASE_ALLELES = ("A", "C", "G", "T")
+
+
+class InternTable:
+    """
+    Hands out a small id per distinct string in the order they are first seen, up to
+    max_size of them.
+    """
+
+    def __init__(self, max_size: int, values: Iterable[str] = ()):
+        self.max_size = max_size
+        self.values: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value: str) -> int:
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            if value_id >= self.max_size:
+                raise ValueError(f"More than {self.max_size} distinct values to intern")
+            self.ids[value] = value_id
+            self.values.append(value)
+        return value_id
+
+
+class VariantCounter(Mapping[Variant, int]):
+    """
+    Read depth for every called variant, keyed by packed ints rather than by Variant
+    objects so counting a variant hashes one int instead of four dataclass fields.
+
+    Behaves as a read only mapping of Variant to read depth in the order the variants
+    were first counted, Variants are only built when the counts are read back.
+    """
+
+    def __init__(self, variant_read_depths: Optional[Mapping[Variant, int]] = None):
+        self._chroms = InternTable(1 << CHROM_BITS)
+        self._alleles = InternTable(1 << ALLELE_BITS, BASE_ALLELES)
+        self._counts: Dict[int, int] = {}
+        if variant_read_depths:
+            for variant, read_depth in variant_read_depths.items():
+                self.add(variant, read_depth)
+
+    def encode(self, chrom: str, pos: int, ref: str, alt: str) -> int:
+        return (
+            pos << POS_SHIFT
+            | self._chroms.intern(chrom) << CHROM_SHIFT
+            | self._alleles.intern(ref) << ALLELE_BITS
+            | self._alleles.intern(alt)
+        )
+
+    def decode(self, key: int) -> Tuple[str, int, str, str]:
+        alleles = self._alleles.values
+        return (
+            self._chroms.values[key >> CHROM_SHIFT & CHROM_MASK],
+            key >> POS_SHIFT,
+            alleles[key >> ALLELE_BITS & ALLELE_MASK],
+            alleles[key & ALLELE_MASK],
+        )
+
+    def add(self, variant: Variant, read_depth: int = 1):
+        key = self.encode(variant.chrom, variant.pos, variant.ref, variant.alt)
+        self._counts[key] = self._counts.get(key, 0) + read_depth
+
+    def add_alleles(self, chrom: str, alleles: Iterable[Tuple[int, str, str]]):
+        """
+        Count one read for every (pos, ref, alt) allele of an alignment on chrom.
+        """
+        chrom_bits = self._chroms.intern(chrom) << CHROM_SHIFT
+        intern_allele = self._alleles.intern
+        counts = self._counts
+        for pos, ref, alt in alleles:
+            key = (
+                pos << POS_SHIFT
+                | chrom_bits
+                | intern_allele(ref) << ALLELE_BITS
+                | intern_allele(alt)
+            )
+            counts[key] = counts.get(key, 0) + 1
+
+    def merge(self, other: "VariantCounter"):
+        """
+        Add the counts of another counter, its ids are translated through its own
+        intern tables as it may have been filled in another process.
+        """
+        for key, read_depth in other._counts.items():
+            key = self.encode(*other.decode(key))
+            self._counts[key] = self._counts.get(key, 0) + read_depth
+
+    def subset(self, keep: Callable[[str, int], bool]) -> "VariantCounter":
+        """
+        A counter with only the variants whose (chrom, pos) is kept.
+        """
+        subset = VariantCounter()
+        for key, read_depth in self._counts.items():
+            chrom, pos, ref, alt = self.decode(key)
+            if keep(chrom, pos):
+                subset._counts[subset.encode(chrom, pos, ref, alt)] = read_depth
+        return subset
+
+    def iter_counts(self) -> Iterator[Tuple[str, int, str, str, int]]:
+        """
+        Yield (chrom, pos, ref, alt, read depth) in the order the variants were first
+        counted, without building Variant objects.
+        """
+        decode = self.decode
+        for key, read_depth in self._counts.items():
+            yield (*decode(key), read_depth)
+
+    def pop_variants(
+        self, chrom: str, stop: Optional[int] = None
+    ) -> List[Tuple[Variant, int]]:
+        """
+        Remove and report the sorted (variant, read depth) pairs of chrom below stop, or
+        all of the chromosome without a stop.
+        """
+        chrom_id = self._chroms.ids.get(chrom)
+        if chrom_id is None:
+            return []
+        popped_keys = [
+            key
+            for key in self._counts
+            if key >> CHROM_SHIFT & CHROM_MASK == chrom_id
+            and (stop is None or key >> POS_SHIFT < stop)
+        ]
+        return sorted(
+            (Variant(*self.decode(key)), self._counts.pop(key)) for key in popped_keys
+        )
+
+    def __getitem__(self, variant: Variant) -> int:
+        chrom_id = self._chroms.ids.get(variant.chrom)
+        ref_id = self._alleles.ids.get(variant.ref)
+        alt_id = self._alleles.ids.get(variant.alt)
+        if chrom_id is None or ref_id is None or alt_id is None:
+            raise KeyError(variant)
+        key = (
+            variant.pos << POS_SHIFT
+            | chrom_id << CHROM_SHIFT
+            | ref_id << ALLELE_BITS
+            | alt_id
+        )
+        if key not in self._counts:
+            raise KeyError(variant)
+        return self._counts[key]
+
+    def __iter__(self) -> Iterator[Variant]:
+        for key in self._counts:
+            yield Variant(*self.decode(key))
+
+    def __len__(self) -> int:
+        return len(self._counts)
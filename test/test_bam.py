@@ -0,0 +1,131 @@
+import os
+import struct
+from typing import Dict, List, Tuple
+
+from src.variant_calling.bam import (
+    BAM_CIGAR_OPS,
+    BAM_MAGIC,
+    BAM_SEQ_BASES,
+    BgzfReader,
+    iter_bam_records,
+    read_bam_header,
+)
+from src.variant_calling.bgzf import BgzfWriter
+from src.variant_calling.variant_calling import evaluate_sam_file, parse_cigar_string
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+test_references = [
+    ("chr1", 249250621),
+    ("chr9", 141213431),
+    ("chr12", 133851895),
+    ("chr15", 102531392),
+    ("chr19", 59128983),
+]
+
+
+def encode_bam_tag(sam_tag: str) -> bytes:
+    key, value_type, value = sam_tag.split(":", 2)
+    if value_type == "i":
+        return key.encode() + b"i" + struct.pack("<i", int(value))
+    return key.encode() + b"Z" + value.encode() + b"\x00"
+
+
+def encode_bam_record(sam_line: str, reference_ids: Dict[str, int]) -> bytes:
+    """
+    Encode one tab separated sam line the way an aligner writes it to BAM.
+    """
+    fields = sam_line.rstrip("\n").split("\t")
+    read_name = fields[0].encode() + b"\x00"
+    cigar = parse_cigar_string(fields[5])
+    seq = fields[9]
+    packed_seq = bytes(
+        (BAM_SEQ_BASES.index(seq[index]) << 4)
+        | (BAM_SEQ_BASES.index(seq[index + 1]) if index + 1 < len(seq) else 0)
+        for index in range(0, len(seq), 2)
+    )
+    core = struct.pack(
+        "<iiBBHHHiiii",
+        reference_ids[fields[2]],
+        int(fields[3]) - 1,
+        len(read_name),
+        int(fields[4]),
+        0,
+        len(cigar),
+        int(fields[1]),
+        len(seq),
+        -1,
+        -1,
+        0,
+    )
+    record = (
+        core
+        + read_name
+        + struct.pack(
+            f"<{len(cigar)}I",
+            *[(count << 4) | BAM_CIGAR_OPS.index(op) for count, op in cigar],
+        )
+        + packed_seq
+        + bytes(ord(char) - 33 for char in fields[10])
+        + b"".join(encode_bam_tag(sam_tag) for sam_tag in fields[11:])
+    )
+    return struct.pack("<i", len(record)) + record
+
+
+def write_bam_file(
+    bam_file: str, sam_file: str, references: List[Tuple[str, int]] = test_references
+):
+    """
+    Convert the alignments of a sam file into a BAM file.
+    """
+    reference_ids = {name: index for index, (name, _) in enumerate(references)}
+    with BgzfWriter(bam_file) as bam_writer:
+        header_text = "".join(
+            f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in references
+        ).encode()
+        bam_writer.write(BAM_MAGIC + struct.pack("<i", len(header_text)) + header_text)
+        bam_writer.write(struct.pack("<i", len(references)))
+        for name, length in references:
+            encoded_name = name.encode() + b"\x00"
+            bam_writer.write(
+                struct.pack("<i", len(encoded_name))
+                + encoded_name
+                + struct.pack("<i", length)
+            )
+        bam_writer.flush()
+        with open(sam_file) as in_file:
+            for sam_line in in_file:
+                if sam_line.startswith(("@", "QNAME\t")):
+                    continue
+                bam_writer.write(encode_bam_record(sam_line, reference_ids))
+
+
+def test_bam_record_decoding(tmp_path):
+    """
+    The decoded fields of a BAM record match the sam line it was written from
+    """
+    bam_file = str(tmp_path / "test.bam")
+    write_bam_file(bam_file, sam_tsv_file)
+    with BgzfReader(bam_file) as bam_reader:
+        header_text, references = read_bam_header(bam_reader)
+        bam_record = next(iter_bam_records(bam_reader, references))
+    assert references == test_references
+    assert header_text.startswith("@SQ\tSN:chr1\tLN:249250621\n")
+    assert bam_record.read_name == "SRR1518133.21"
+    assert (bam_record.chrom, bam_record.pos, bam_record.flag) == ("chr12", 78110, 0)
+    assert bam_record.mapq == 6
+    assert bam_record.cigar_ops == [(76, "M")]
+    assert bam_record.seq.startswith("TGCAATTCCAGGAGTG")
+    assert bam_record.qual.startswith(b"DDDDDDDDD")
+    assert bam_record.md == "67C8"
+    assert bam_record.get_tag("AS") == 71
+    assert bam_record.get_tag("ZZ") is None
+
+
+def test_evaluate_bam_file(tmp_path):
+    """
+    A BAM file gives the same results as the sam file it was converted from
+    """
+    bam_file = str(tmp_path / "test.bam")
+    write_bam_file(bam_file, sam_tsv_file)
+    assert evaluate_sam_file(bam_file) == evaluate_sam_file(sam_tsv_file)
+    assert evaluate_sam_file(bam_file, workers=2) == evaluate_sam_file(sam_tsv_file)
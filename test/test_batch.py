@@ -0,0 +1,58 @@
+import os
+
+from src.variant_calling.batch import call_variants_on_batch, read_manifest
+from src.variant_calling.variant_calling import call_variants_on_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_call_variants_on_batch(tmp_path):
+    """
+    Each sample gets the outputs of a single run, the matrix holds them side by side
+    """
+    manifest_file = tmp_path / "manifest.tsv"
+    manifest_file.write_text(f"# two copies\nfirst\t{sam_tsv_file}\n\n{sam_tsv_file}\n")
+    samples = read_manifest(str(manifest_file))
+    assert [sample.name for sample in samples] == ["first", "test_sam_file"]
+    out_dir = tmp_path / "out"
+    matrix_file = tmp_path / "matrix.tsv"
+    call_variants_on_batch(samples, str(out_dir), str(matrix_file), workers=2)
+
+    call_variants_on_sam_file(
+        sam_tsv_file, str(tmp_path / "variants.tsv"), str(tmp_path / "coverage.tsv")
+    )
+    for sample_name in ["first", "test_sam_file"]:
+        for out_file in ["variants.tsv", "coverage.tsv"]:
+            assert (out_dir / f"{sample_name}.{out_file}").read_text() == (
+                tmp_path / out_file
+            ).read_text()
+    assert matrix_file.read_text().splitlines() == [
+        "variant\tfirst\ttest_sam_file",
+        "chr12-78177-C-T\t1\t1",
+        "chr15-102500838-A-C\t1\t1",
+        "chr19-71826-T-G\t1\t1",
+    ]
+
+
+def test_variant_matrix_tells_uncovered_from_reference_calls(tmp_path):
+    """
+    A sample without a variant gets 0 where it covers the position and NA where not
+    """
+    with open(sam_tsv_file) as in_file:
+        header, *sam_lines = in_file.readlines()
+    # The first alignment without its mismatch, it covers the variant it had
+    part_sam_file = tmp_path / "part.tsv"
+    part_sam_file.write_text(header + sam_lines[0].replace("MD:Z:67C8", "MD:Z:76"))
+    manifest_file = tmp_path / "manifest.tsv"
+    manifest_file.write_text(f"all\t{sam_tsv_file}\npart\t{part_sam_file}\n")
+    matrix_file = tmp_path / "matrix.tsv"
+    call_variants_on_batch(
+        read_manifest(str(manifest_file)), matrix_out_file=str(matrix_file)
+    )
+    assert matrix_file.read_text().splitlines() == [
+        "variant\tall\tpart",
+        "chr12-78177-C-T\t1\t0",
+        "chr15-102500838-A-C\t1\tNA",
+        "chr19-71826-T-G\t1\tNA",
+    ]
+    assert sorted(os.listdir(tmp_path)) == ["manifest.tsv", "matrix.tsv", "part.tsv"]
@@ -0,0 +1,32 @@
+import gzip
+
+from src.variant_calling.bgzf import (
+    BGZF_MAX_DATA_SIZE,
+    BgzfReader,
+    BgzfWriter,
+    is_bgzf_file,
+    iter_bgzf_block_offsets,
+)
+
+
+def test_bgzf_round_trip(tmp_path):
+    """
+    Data spanning several blocks reads back the same with and without threads, and a
+    virtual offset taken while writing can be seeked to while reading
+    """
+    bgzf_file = str(tmp_path / "test.gz")
+    data = b"".join(b"line %d\n" % line_number for line_number in range(20000))
+    with BgzfWriter(bgzf_file) as bgzf_writer:
+        bgzf_writer.write(data[:100000])
+        virtual_offset = bgzf_writer.tell()
+        bgzf_writer.write(data[100000:])
+    assert len(data) > 2 * BGZF_MAX_DATA_SIZE
+    assert is_bgzf_file(bgzf_file)
+    assert gzip.decompress(open(bgzf_file, "rb").read()) == data
+    assert len(list(iter_bgzf_block_offsets(bgzf_file))) >= 3
+    for threads in [0, 2]:
+        with BgzfReader(bgzf_file, threads) as bgzf_reader:
+            assert bgzf_reader.read(len(data) + 1) == data
+            bgzf_reader.seek(virtual_offset)
+            assert bgzf_reader.tell() == virtual_offset
+            assert bgzf_reader.read(20) == data[100000:100020]
@@ -0,0 +1,122 @@
+import os
+import shutil
+from typing import Any, Dict
+
+from src.variant_calling import variant_calling
+from src.variant_calling.cache import (
+    ResultCache,
+    fingerprint_input_file,
+    get_result_fingerprint,
+)
+from src.variant_calling.instrumentation import get_pipeline_metrics
+from src.variant_calling.variant_calling import call_variants_on_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_fingerprint_input_file(tmp_path, monkeypatch):
+    """
+    Inputs are fingerprinted by their content, so a copied or restored input keeps its
+    fingerprint. A remembered hash is used until the size or modification time moves
+    """
+    input_file = str(tmp_path / "input.sam")
+    with open(input_file, "w") as out_file:
+        out_file.write("headMIDDLEtail")
+    fingerprint = fingerprint_input_file(input_file)
+    copied_file = str(tmp_path / "copied.sam")
+    shutil.copyfile(input_file, copied_file)
+    assert fingerprint_input_file(copied_file) == fingerprint
+    os.replace(copied_file, input_file)
+    assert fingerprint_input_file(input_file) == fingerprint
+    input_hashes: Dict[str, Any] = {}
+    assert fingerprint_input_file(input_file, input_hashes) == fingerprint
+    input_stat = os.stat(input_file)
+    input_times = (input_stat.st_atime_ns, input_stat.st_mtime_ns)
+    with open(input_file, "w") as out_file:
+        out_file.write("headmiddletail")
+    os.utime(input_file, ns=input_times)
+    assert fingerprint_input_file(input_file, input_hashes) == fingerprint
+    os.utime(input_file, ns=(input_times[0], input_times[1] + 1))
+    assert fingerprint_input_file(input_file, input_hashes) != fingerprint
+    assert get_result_fingerprint(input_file, {"compress": True}) != (
+        get_result_fingerprint(input_file, {"compress": False})
+    )
+
+
+def test_cache_remembers_input_hashes(tmp_path, monkeypatch):
+    """
+    A cache hashes an input once, later runs reuse the hash while its stamp is unchanged
+    """
+    input_file = str(tmp_path / "input.sam")
+    with open(input_file, "w") as out_file:
+        out_file.write("headMIDDLEtail")
+    hashed_files = []
+    monkeypatch.setattr(
+        "src.variant_calling.cache.hash_input_file",
+        lambda sam_file: hashed_files.append(sam_file) or "sha256:input",
+    )
+    fingerprint = get_result_fingerprint(input_file, {})
+    hashed_files.clear()
+    for _ in range(2):
+        result_cache = ResultCache(str(tmp_path / "cache"))
+        assert result_cache.fingerprint(input_file, {}) == fingerprint
+    assert hashed_files == [input_file]
+
+
+def test_cached_outputs(tmp_path, monkeypatch):
+    """
+    A second run with the same parameters copies the cached outputs without calling,
+    a run with other parameters is called
+    """
+    cache_dir = str(tmp_path / "cache")
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "variants.tsv"),
+        str(tmp_path / "coverage.tsv"),
+        cache_dir=cache_dir,
+    )
+    assert get_pipeline_metrics().cache_misses == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("called on a cache hit")
+
+    monkeypatch.setattr(variant_calling, "write_evaluated_out_files", fail)
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "cached_variants.tsv"),
+        str(tmp_path / "cached_coverage.tsv"),
+        cache_dir=cache_dir,
+    )
+    assert get_pipeline_metrics().cache_hits == 1
+    for out_file in ["variants.tsv", "coverage.tsv"]:
+        with open(tmp_path / out_file) as called_file, open(
+            tmp_path / f"cached_{out_file}"
+        ) as cached_file:
+            assert cached_file.read() == called_file.read()
+    monkeypatch.undo()
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "variants.tsv"),
+        str(tmp_path / "coverage.bedgraph"),
+        coverage_format="bedgraph",
+        cache_dir=cache_dir,
+    )
+    assert get_pipeline_metrics().cache_misses == 1
+    assert sum(entry.is_dir() for entry in os.scandir(cache_dir)) == 2
+
+
+def test_cache_eviction(tmp_path):
+    """
+    Entries that went unused the longest are evicted past the size limit
+    """
+    out_file = str(tmp_path / "out.tsv")
+    with open(out_file, "w") as text_file:
+        text_file.write("x" * 10)
+    result_cache = ResultCache(str(tmp_path / "cache"), max_bytes=25)
+    for entry_time, fingerprint in enumerate(["a", "b"]):
+        result_cache.store(fingerprint, {"variants": out_file})
+        os.utime(tmp_path / "cache" / fingerprint, (entry_time, entry_time))
+    assert result_cache.fetch("a", {"variants": str(tmp_path / "a.tsv")})
+    result_cache.store("c", {"variants": out_file})
+    assert sorted(os.listdir(tmp_path / "cache")) == ["a", "c"]
+    assert not result_cache.fetch("b", {"variants": str(tmp_path / "b.tsv")})
@@ -0,0 +1,163 @@
+import os
+
+import pytest
+
+from src.variant_calling import checkpoint
+from src.variant_calling.alignment import get_filter_parameters
+from src.variant_calling.checkpoint import (
+    Checkpoint,
+    evaluate_sam_file_checkpointed,
+    get_input_stamp,
+    read_checkpoint,
+    write_checkpoint,
+)
+from src.variant_calling.coverage import CoverageAccumulator
+from src.variant_calling.instrumentation import reset_pipeline_metrics
+from src.variant_calling.models import GenomicRegion, Variant
+from src.variant_calling.read_filters import ReadFilter, SamFlag
+from src.variant_calling.regions import RegionSet
+from src.variant_calling.variant_calling import evaluate_sam_file
+from src.variant_calling.variant_counter import VariantCounter
+
+from .test_bam import write_bam_file
+from .test_index import write_sorted_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_checkpoint_round_trip(tmp_path):
+    """
+    A checkpoint reads back as written, but not for an input that changed since
+    """
+    checkpoint_file = str(tmp_path / "run.checkpoint")
+    sam_file = str(tmp_path / "input.sam")
+    with open(sam_file, "w") as out_file:
+        out_file.write("read\t0\tchr1\t10\n")
+    position_to_read_depth = CoverageAccumulator()
+    position_to_read_depth.add_interval("chr1", 10, 20)
+    write_checkpoint(
+        Checkpoint(
+            sam_file,
+            *get_input_stamp(sam_file),
+            get_filter_parameters(),
+            42,
+            VariantCounter({Variant("chr1", 12, "A", "T"): 3}),
+            position_to_read_depth,
+        ),
+        checkpoint_file,
+    )
+    assert not os.path.exists(f"{checkpoint_file}.tmp")
+    resumed = read_checkpoint(checkpoint_file, sam_file)
+    assert resumed is not None
+    assert resumed.offset == 42
+    assert resumed.variant_to_read_depth == {Variant("chr1", 12, "A", "T"): 3}
+    assert resumed.position_to_read_depth == position_to_read_depth
+    assert read_checkpoint(str(tmp_path / "missing.checkpoint"), sam_file) is None
+    with open(sam_file, "a") as out_file:
+        out_file.write("read\t0\tchr1\t11\n")
+    with pytest.raises(ValueError, match="not from the current"):
+        read_checkpoint(checkpoint_file, sam_file)
+
+
+@pytest.mark.parametrize("input_format", ["sam", "bam"])
+def test_resume_after_interruption(tmp_path, monkeypatch, input_format):
+    """
+    A run killed part way resumes from its last checkpoint to the totals and the read
+    counts of an uninterrupted run, sam checkpoints fall between blocks and BAM ones
+    between chunks
+    """
+    monkeypatch.setattr("src.variant_calling.sam_reader.SAM_READ_BLOCK_SIZE", 200)
+    monkeypatch.setattr("src.variant_calling.sam_reader.SAM_RECORD_CHUNK_SIZE", 2)
+    sam_file = sam_tsv_file
+    if input_format == "bam":
+        sorted_sam_file = str(tmp_path / "sorted.sam")
+        sam_file = str(tmp_path / "sorted.bam")
+        write_sorted_sam_file(sorted_sam_file)
+        write_bam_file(sam_file, sorted_sam_file)
+    checkpoint_file = str(tmp_path / "run.checkpoint")
+    read_filter = ReadFilter(excluded_flags=SamFlag.REVERSE)
+    metrics = reset_pipeline_metrics()
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(
+        sam_file, read_filter=read_filter
+    )
+    read_counts = metrics.reads, metrics.bases, dict(metrics.rejected_reads)
+    assert metrics.rejected_reads
+    evaluate_record_chunk = checkpoint.evaluate_sam_record_chunk
+    evaluated_chunks = []
+
+    def evaluate_until_killed(sam_records, *accumulators):
+        if len(evaluated_chunks) == 3:
+            raise KeyboardInterrupt
+        evaluated_chunks.append(sam_records)
+        return evaluate_record_chunk(sam_records, *accumulators)
+
+    monkeypatch.setattr(checkpoint, "evaluate_sam_record_chunk", evaluate_until_killed)
+    with pytest.raises(KeyboardInterrupt):
+        evaluate_sam_file_checkpointed(
+            sam_file, checkpoint_file, checkpoint_interval=0, read_filter=read_filter
+        )
+    interrupted = read_checkpoint(checkpoint_file, sam_file, read_filter=read_filter)
+    assert interrupted is not None
+    assert 0 < len(interrupted.position_to_read_depth) < len(position_to_read_depth)
+    assert 0 < interrupted.reads < read_counts[0]
+    monkeypatch.setattr(checkpoint, "evaluate_sam_record_chunk", evaluate_record_chunk)
+    metrics = reset_pipeline_metrics()
+    assert evaluate_sam_file_checkpointed(
+        sam_file, checkpoint_file, resume=True, read_filter=read_filter
+    ) == (variant_to_read_depth, position_to_read_depth)
+    assert (metrics.reads, metrics.bases, metrics.rejected_reads) == read_counts
+
+
+def test_resume_with_other_parameters(tmp_path, monkeypatch):
+    """
+    A checkpoint only resumes a run with the regions and read filter it was taken with,
+    its totals would otherwise mix alignments of both
+    """
+    monkeypatch.setattr("src.variant_calling.sam_reader.SAM_READ_BLOCK_SIZE", 200)
+    checkpoint_file = str(tmp_path / "run.checkpoint")
+    regions = RegionSet([GenomicRegion("chr19", 1, 100000)])
+    read_filter = ReadFilter(min_mapq=30)
+    evaluate_record_chunk = checkpoint.evaluate_sam_record_chunk
+
+    def evaluate_until_killed(sam_records, *accumulators):
+        if os.path.exists(checkpoint_file):
+            raise KeyboardInterrupt
+        return evaluate_record_chunk(sam_records, *accumulators)
+
+    monkeypatch.setattr(checkpoint, "evaluate_sam_record_chunk", evaluate_until_killed)
+    with pytest.raises(KeyboardInterrupt):
+        evaluate_sam_file_checkpointed(
+            sam_tsv_file,
+            checkpoint_file,
+            regions=regions,
+            checkpoint_interval=0,
+            read_filter=read_filter,
+        )
+    monkeypatch.setattr(checkpoint, "evaluate_sam_record_chunk", evaluate_record_chunk)
+    for other_regions, other_read_filter in [
+        (None, read_filter),
+        (RegionSet([GenomicRegion("chr19", 1, 200000)]), read_filter),
+        (regions, None),
+        (regions, ReadFilter(min_mapq=20)),
+    ]:
+        with pytest.raises(ValueError, match="other regions or another read filter"):
+            evaluate_sam_file_checkpointed(
+                sam_tsv_file,
+                checkpoint_file,
+                resume=True,
+                regions=other_regions,
+                read_filter=other_read_filter,
+            )
+    assert read_checkpoint(checkpoint_file, sam_tsv_file, regions, read_filter)
+    assert evaluate_sam_file_checkpointed(
+        sam_tsv_file,
+        checkpoint_file,
+        resume=True,
+        regions=regions,
+        read_filter=read_filter,
+    ) == evaluate_sam_file_checkpointed(
+        sam_tsv_file,
+        str(tmp_path / "fresh.checkpoint"),
+        regions=regions,
+        read_filter=read_filter,
+    )
@@ -0,0 +1,170 @@
+import random
+
+from src.variant_calling.coverage import (
+    PAGE_SIZE,
+    BaseCountAccumulator,
+    CoverageAccumulator,
+    SharedCoverageAccumulator,
+    merge_depth_runs,
+)
+from src.variant_calling.variant_calling import GenomicPosition
+
+
+def test_coverage_accumulator_add_interval():
+    """
+    Overlapping intervals stack, uncovered positions are not part of the mapping
+    """
+    coverage = CoverageAccumulator()
+    coverage.add_interval("chr1", 10, 13)
+    coverage.add_interval("chr1", 12, 14)
+    assert coverage == {
+        GenomicPosition(chrom="chr1", pos=10): 1,
+        GenomicPosition(chrom="chr1", pos=11): 1,
+        GenomicPosition(chrom="chr1", pos=12): 2,
+        GenomicPosition(chrom="chr1", pos=13): 1,
+    }
+    assert coverage.depth("chr1", 14) == 0
+    assert coverage.get(GenomicPosition(chrom="chr2", pos=10), 0) == 0
+
+
+def test_coverage_accumulator_add_intervals():
+    """
+    Intervals added at once, overlapping and out of order and across a page boundary,
+    leave the same depths as added one by one, as does merging the accumulators
+    """
+    random.seed(5)
+    intervals = [
+        (start, start + random.randint(0, 300))
+        for start in random.choices(range(PAGE_SIZE - 1000, PAGE_SIZE + 1000), k=200)
+    ] + [(10, 20), (20, 30), (5000, 5001)]
+    coverage = CoverageAccumulator()
+    coverage.add_intervals("chr1", intervals, 2)
+    expected_coverage = CoverageAccumulator()
+    for start, stop in intervals:
+        expected_coverage.add_interval("chr1", start, stop, 2)
+    assert list(coverage.iter_depth_runs()) == list(
+        expected_coverage.iter_depth_runs()
+    )
+    coverage.merge(expected_coverage)
+    expected_coverage.merge(expected_coverage.subset({"chr1": [(0, 2 * PAGE_SIZE)]}))
+    assert list(coverage.iter_depth_runs()) == list(
+        expected_coverage.iter_depth_runs()
+    )
+
+
+def test_coverage_accumulator_page_boundary():
+    """
+    An interval that spans two pages is split between them
+    """
+    coverage = CoverageAccumulator()
+    coverage.add_interval("chr1", PAGE_SIZE - 2, PAGE_SIZE + 2)
+    assert list(coverage.iter_depths()) == [
+        ("chr1", PAGE_SIZE - 2, 1),
+        ("chr1", PAGE_SIZE - 1, 1),
+        ("chr1", PAGE_SIZE, 1),
+        ("chr1", PAGE_SIZE + 1, 1),
+    ]
+    assert coverage.nbytes() == 2 * 4 * PAGE_SIZE
+
+
+def test_coverage_accumulator_chrom_order():
+    """
+    Chromosomes are reported in @SQ header order, then in the order they are seen
+    """
+    coverage = CoverageAccumulator({"chr2": 1000, "chr1": 2000})
+    coverage.add_interval("chr3", 5, 6)
+    coverage.add_interval("chr1", 5, 6)
+    coverage.add_interval("chr2", 5, 6)
+    assert [chrom for chrom, _, _ in coverage.iter_depths()] == ["chr2", "chr1", "chr3"]
+
+
+def test_coverage_accumulator_pop_depths():
+    """
+    Popped positions are reported in order and are gone afterwards, pages below the stop
+    are freed
+    """
+    coverage = CoverageAccumulator()
+    coverage.add_interval("chr1", 10, 13)
+    coverage.add_interval("chr1", PAGE_SIZE + 5, PAGE_SIZE + 7)
+    assert list(coverage.pop_depths("chr1", None, 12)) == [(10, 1), (11, 1)]
+    assert coverage.depth("chr1", 11) == 0
+    assert coverage.depth("chr1", 12) == 1
+    assert list(coverage.pop_depths("chr1", None, PAGE_SIZE + 6)) == [
+        (12, 1),
+        (PAGE_SIZE + 5, 1),
+    ]
+    assert coverage.nbytes() < 2 * PAGE_SIZE * 4
+    assert list(coverage.pop_depths("chr1")) == [(PAGE_SIZE + 6, 1)]
+    assert len(coverage) == 0
+
+
+def test_coverage_accumulator_iter_depth_runs():
+    """
+    Adjacent positions with the same depth form one run, also across pages
+    """
+    coverage = CoverageAccumulator()
+    coverage.add_interval("chr1", 10, 20)
+    coverage.add_interval("chr1", 15, 20)
+    coverage.add_interval("chr1", PAGE_SIZE - 5, PAGE_SIZE + 5)
+    coverage.add_interval("chr2", 1, 2)
+    depth_runs = list(coverage.iter_depth_runs())
+    assert depth_runs == [
+        ("chr1", 10, 15, 1),
+        ("chr1", 15, 20, 2),
+        ("chr1", PAGE_SIZE - 5, PAGE_SIZE + 5, 1),
+        ("chr2", 1, 2, 1),
+    ]
+    assert list(merge_depth_runs(coverage.iter_depths())) == depth_runs
+
+
+def test_base_count_accumulator():
+    """
+    Bases are counted per position across pages, unknown bases count as N
+    """
+    base_counts = BaseCountAccumulator()
+    base_counts.add_bases("chr1", PAGE_SIZE - 2, b"ACGTR")
+    base_counts.add_bases("chr1", PAGE_SIZE - 1, b"AACg")
+    other_base_counts = BaseCountAccumulator()
+    other_base_counts.add_bases("chr2", 3, b"T")
+    base_counts.merge(other_base_counts)
+    assert list(base_counts.iter_base_counts()) == [
+        ("chr1", PAGE_SIZE - 2, (1, 0, 0, 0, 0)),
+        ("chr1", PAGE_SIZE - 1, (1, 1, 0, 0, 0)),
+        ("chr1", PAGE_SIZE, (1, 0, 1, 0, 0)),
+        ("chr1", PAGE_SIZE + 1, (0, 1, 0, 1, 0)),
+        ("chr1", PAGE_SIZE + 2, (0, 0, 1, 0, 1)),
+        ("chr2", 3, (0, 0, 0, 1, 0)),
+    ]
+    assert base_counts.depth("chr1", PAGE_SIZE) == 2
+    assert base_counts.base_counts("chr3", 1) == (0, 0, 0, 0, 0)
+
+
+def test_shared_coverage_accumulator():
+    """
+    An attached accumulator adds only its owned positions to the shared arrays, depths
+    before a reference start stay private
+    """
+    coverage = SharedCoverageAccumulator({"chr1": PAGE_SIZE + 10, "chr2": 10})
+    try:
+        worker_coverage = SharedCoverageAccumulator(
+            coverage.reference_lengths, coverage.shared_memory_names
+        )
+        worker_coverage.own(GenomicPosition("chr1", PAGE_SIZE - 2), None)
+        worker_coverage.add_interval("chr1", PAGE_SIZE - 4, PAGE_SIZE + 1)
+        worker_coverage.add_intervals("chr1", [(PAGE_SIZE - 3, PAGE_SIZE - 1)] * 2)
+        worker_coverage.add_interval("chr2", 3, 5)
+        worker_coverage.own(None, GenomicPosition("chr1", 0))
+        worker_coverage.add_interval("chr1", -2, 1)
+        assert worker_coverage.owns("chr1", -1)
+        assert not worker_coverage.owns("chr2", 4)
+        assert list(worker_coverage.get_private_coverage().iter_depth_runs()) == [
+            ("chr1", -2, 0, 1)
+        ]
+        worker_coverage.close()
+        assert list(coverage.iter_depth_runs()) == [
+            ("chr1", PAGE_SIZE - 2, PAGE_SIZE - 1, 3),
+            ("chr1", PAGE_SIZE - 1, PAGE_SIZE + 1, 1),
+            ("chr2", 3, 5, 1),
+        ]
+    finally:
+        coverage.close(unlink=True)
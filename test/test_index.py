@@ -0,0 +1,98 @@
+import os
+
+from src.variant_calling.bam import build_bam_index
+from src.variant_calling.index import read_alignment_index, reg2bin, reg2bins
+from src.variant_calling.models import Variant
+from src.variant_calling.regions import RegionSet, parse_region_string
+from src.variant_calling.variant_calling import evaluate_sam_file, restrict_to_regions
+
+from .test_bam import test_references, write_bam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def write_sorted_sam_file(sorted_sam_file: str):
+    reference_order = [name for name, _ in test_references]
+    with open(sam_tsv_file) as in_file:
+        sam_lines = in_file.readlines()[1:]
+    sam_lines.sort(
+        key=lambda line: (
+            reference_order.index(line.split("\t")[2]),
+            int(line.split("\t")[3]),
+        )
+    )
+    with open(sorted_sam_file, "w") as out_file:
+        out_file.writelines(sam_lines)
+
+
+def test_reg2bin():
+    """
+    Leaf bins hold 16kb, an interval crossing a leaf boundary moves up a level
+    """
+    assert reg2bin(0, 1) == 4681
+    assert reg2bin(16384, 16385) == 4682
+    assert reg2bin(16383, 16385) == 585
+    assert reg2bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+
+
+def test_region_restricted_bam(tmp_path):
+    """
+    An indexed BAM only decodes the chunks for the region, the results match a full scan
+    of the sam file restricted to the same region
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    bam_file = str(tmp_path / "sorted.bam")
+    write_sorted_sam_file(sorted_sam_file)
+    write_bam_file(bam_file, sorted_sam_file)
+    index_file = build_bam_index(bam_file)
+    assert index_file == f"{bam_file}.bai"
+    alignment_index = read_alignment_index(index_file)
+    assert len(alignment_index.references) == len(test_references)
+    assert alignment_index.query(0, 1000000, 1000100) == []
+
+    regions = RegionSet([parse_region_string("chr12:78100-78200")])
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(
+        bam_file, regions=regions
+    )
+    assert (variant_to_read_depth, position_to_read_depth) == evaluate_sam_file(
+        sam_tsv_file, regions=regions
+    )
+    assert len(variant_to_read_depth) == 1
+    assert len(position_to_read_depth) == 76
+    assert {position.chrom for position in position_to_read_depth} == {"chr12"}
+
+
+def test_regions_reach_reverse_and_clipped_reads(tmp_path):
+    """
+    Region mode equals a full scan restricted to the region, for a reverse read that
+    walks back into it from the next index bin and for a clipped read that walks on
+    past its forward span, in sam input and in indexed BAM input
+    """
+    seq = "A" * 60 + "C" + "A" * 39
+    sam_file = str(tmp_path / "sorted.sam")
+    with open(sam_file, "w") as out_file:
+        out_file.write(
+            f"reverse\t16\tchr1\t16420\t60\t100M\t*\t0\t0\t{seq}\t{'I' * 100}"
+            "\tNM:i:1\tMD:Z:60A39\n"
+            f"clipped\t0\tchr1\t40000\t60\t20S80M\t*\t0\t0\t{seq}\t{'I' * 100}"
+            "\tNM:i:0\tMD:Z:80\n"
+        )
+    bam_file = str(tmp_path / "sorted.bam")
+    write_bam_file(bam_file, sam_file)
+    build_bam_index(bam_file)
+    for region_string, covered_positions in [
+        ("chr1:16330-16380", 51),
+        ("chr1:40090-40110", 10),
+    ]:
+        regions = RegionSet([parse_region_string(region_string)])
+        for input_file in [sam_file, bam_file]:
+            variant_to_read_depth, position_to_read_depth = evaluate_sam_file(
+                input_file, regions=regions
+            )
+            assert len(position_to_read_depth) == covered_positions
+            assert (variant_to_read_depth, position_to_read_depth) == (
+                restrict_to_regions(*evaluate_sam_file(input_file), regions)
+            )
+    assert evaluate_sam_file(
+        bam_file, regions=RegionSet([parse_region_string("chr1:16330-16380")])
+    )[0] == {Variant("chr1", 16360, "A", "G"): 1}
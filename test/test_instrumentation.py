@@ -0,0 +1,47 @@
+import logging
+import os
+
+from src.variant_calling.instrumentation import (
+    PIPELINE_STAGES,
+    get_pipeline_metrics,
+    profiled,
+    reset_pipeline_metrics,
+)
+from src.variant_calling.variant_calling import (
+    call_variants_on_sam_file,
+    evaluate_sam_file,
+)
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_pipeline_metrics(caplog):
+    """
+    Every stage is timed, reads are counted and progress is logged once the interval has
+    passed
+    """
+    reset_pipeline_metrics(progress_interval=0.0)
+    with caplog.at_level(logging.INFO, logger="variant_calling"):
+        evaluate_sam_file(sam_tsv_file)
+    metrics = get_pipeline_metrics()
+    assert metrics.reads == 7
+    assert metrics.bases > 0
+    assert set(metrics.stage_seconds) == set(PIPELINE_STAGES) - {"output writing"}
+    assert "reads/sec" in caplog.text and "at chr" in caplog.text
+
+
+def test_profiled_run(tmp_path, caplog):
+    """
+    A profiled run dumps pstats and logs the stage summary
+    """
+    profile_file = str(tmp_path / "run.prof")
+    with caplog.at_level(logging.INFO, logger="variant_calling"):
+        with profiled(profile_file):
+            call_variants_on_sam_file(
+                sam_tsv_file,
+                str(tmp_path / "variants.tsv"),
+                str(tmp_path / "coverage.tsv"),
+            )
+    assert os.path.getsize(profile_file) > 0
+    assert "output writing" in caplog.text
+    assert "call_variants_on_sam_file" in caplog.text
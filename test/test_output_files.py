@@ -0,0 +1,91 @@
+import gzip
+
+from src.variant_calling.index import (
+    TABIX_BED_COLUMNS,
+    iter_tabix_lines,
+    read_tabix_index,
+    reg2bin,
+)
+from src.variant_calling.output_files import OutputFile
+from src.variant_calling.variant_calling import call_variants_on_sam_file
+
+
+def test_compressed_output_file_with_tabix_index(tmp_path):
+    """
+    A compressed output is plain gzip to other readers, its tabix index fetches only the
+    lines overlapping a region
+    """
+    bedgraph_file = str(tmp_path / "coverage.bedgraph.gz")
+    bedgraph_lines = [
+        f"{chrom}\t{start}\t{start + 10}\t{start % 7 + 1}\n"
+        for chrom in ["chr1", "chr2"]
+        for start in range(0, 200000, 20)
+    ]
+    with OutputFile(bedgraph_file, True, TABIX_BED_COLUMNS) as out_file:
+        out_file.writelines(bedgraph_lines)
+    with gzip.open(bedgraph_file, "rt") as in_file:
+        assert in_file.readlines() == bedgraph_lines
+    assert list(iter_tabix_lines(bedgraph_file, "chr2", 100005, 100025)) == [
+        "chr2\t100000\t100010\t6\n",
+        "chr2\t100020\t100030\t5\n",
+    ]
+    assert list(iter_tabix_lines(bedgraph_file, "chr3", 0, 100)) == []
+
+
+def test_tabix_index_of_runs_before_the_chromosome_start(tmp_path):
+    """
+    A run starting at position -1 is indexed as if it started at zero
+    """
+    bedgraph_file = str(tmp_path / "coverage.bedgraph.gz")
+    bedgraph_lines = ["chr1\t-1\t0\t1\n", "chr1\t0\t10\t2\n", "chr1\t20\t30\t1\n"]
+    with OutputFile(bedgraph_file, True, TABIX_BED_COLUMNS) as out_file:
+        out_file.writelines(bedgraph_lines)
+    _, _, tabix_index = read_tabix_index(f"{bedgraph_file}.tbi")
+    (reference_index,) = tabix_index.references
+    assert list(reference_index.bins) == [reg2bin(0, 1)]
+    assert len(reference_index.linear_index) == 1
+    assert list(iter_tabix_lines(bedgraph_file, "chr1", 0, 5)) == bedgraph_lines[1:2]
+    assert list(iter_tabix_lines(bedgraph_file, "chr1", 0, 30)) == bedgraph_lines[1:]
+
+
+def test_bedgraph_output_before_the_chromosome_start(tmp_path):
+    """
+    Coverage a reverse read walks back to before position 1 is clipped from the bedGraph
+    output, which then only has rows from zero on that its tabix index fetches
+    """
+    sam_file = str(tmp_path / "start.sam")
+    with open(sam_file, "w") as out_file:
+        out_file.write(
+            f"forward\t0\tchr1\t3\t60\t10M\t*\t0\t0\t{'A' * 10}\t{'I' * 10}"
+            "\tNM:i:0\tMD:Z:10\n"
+            f"reverse\t16\tchr1\t5\t60\t10M\t*\t0\t0\t{'A' * 10}\t{'I' * 10}"
+            "\tNM:i:0\tMD:Z:10\n"
+        )
+    for streaming in [False, True]:
+        bedgraph_file = str(tmp_path / f"coverage_{streaming}.bedgraph.gz")
+        call_variants_on_sam_file(
+            sam_file,
+            str(tmp_path / f"variants_{streaming}.tsv.gz"),
+            bedgraph_file,
+            streaming=streaming,
+            coverage_format="bedgraph",
+            compress=True,
+        )
+        with gzip.open(bedgraph_file, "rt") as in_file:
+            bedgraph_lines = in_file.readlines()
+        assert bedgraph_lines == [
+            "chr1\t0\t2\t1\n",
+            "chr1\t2\t5\t2\n",
+            "chr1\t5\t12\t1\n",
+        ]
+        assert list(iter_tabix_lines(bedgraph_file, "chr1", 0, 3)) == bedgraph_lines[:2]
+
+
+def test_plain_output_file(tmp_path):
+    """
+    Without compression the text is written as is
+    """
+    out_path = tmp_path / "variants.tsv"
+    with OutputFile(str(out_path)) as out_file:
+        out_file.write("variant\tvar_read_depth\tfull_read_depth\n")
+    assert out_path.read_text() == "variant\tvar_read_depth\tfull_read_depth\n"
@@ -0,0 +1,144 @@
+import os
+
+import pytest
+
+from src.variant_calling.coverage import CoverageAccumulator
+from src.variant_calling.instrumentation import reset_pipeline_metrics
+from src.variant_calling.parallel import (
+    evaluate_sam_file_parallel,
+    evaluate_sam_file_shared,
+    get_owned_sam_ranges,
+)
+from src.variant_calling.read_filters import ReadFilter
+from src.variant_calling.sam_reader import (
+    parse_reference_lengths,
+    read_sam_header,
+    split_sam_file,
+)
+from src.variant_calling.variant_calling import evaluate_sam_file
+
+from .test_index import write_sorted_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+# Short enough to keep the shared arrays small, chr15 has an alignment far along
+shared_test_references = [
+    ("chr1", 100000),
+    ("chr9", 100000),
+    ("chr12", 100000),
+    ("chr15", 102531392),
+    ("chr19", 100000),
+]
+
+
+def test_split_sam_file():
+    """
+    Shards start on line boundaries and cover every alignment exactly once
+    """
+    _, alignment_start = read_sam_header(sam_tsv_file)
+    shards = split_sam_file(sam_tsv_file, alignment_start, 3)
+    assert len(shards) == 3
+    assert shards[0][0] == alignment_start
+    assert shards[-1][1] == os.path.getsize(sam_tsv_file)
+    with open(sam_tsv_file, "rb") as in_file:
+        sam_bytes = in_file.read()
+    for (_, stop), (next_start, _) in zip(shards, shards[1:]):
+        assert stop == next_start
+        assert sam_bytes[next_start - 1 : next_start] == b"\n"
+
+
+def test_evaluate_sam_file_parallel():
+    """
+    Evaluating the shards in a process pool gives the same totals as a single process
+    """
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file_parallel(
+        sam_tsv_file, workers=1
+    )
+    (
+        parallel_variant_to_read_depth,
+        parallel_position_to_read_depth,
+    ) = evaluate_sam_file_parallel(sam_tsv_file, workers=3)
+    assert parallel_variant_to_read_depth == variant_to_read_depth
+    assert parallel_position_to_read_depth == position_to_read_depth
+
+
+def write_sorted_sam_file_with_header(sorted_sam_file: str):
+    write_sorted_sam_file(sorted_sam_file)
+    with open(sorted_sam_file) as in_file:
+        sam_lines = in_file.readlines()
+    with open(sorted_sam_file, "w") as out_file:
+        for name, length in shared_test_references:
+            out_file.write(f"@SQ\tSN:{name}\tLN:{length}\n")
+        out_file.writelines(sam_lines)
+
+
+def test_evaluate_sam_file_shared(tmp_path):
+    """
+    Workers owning disjoint positions of one set of shared arrays give the totals of a
+    single process, the byte ranges they read overlap by the lookbehind
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    write_sorted_sam_file_with_header(sorted_sam_file)
+    header_lines, alignment_start = read_sam_header(sorted_sam_file)
+    owned_ranges = get_owned_sam_ranges(
+        sorted_sam_file, alignment_start, parse_reference_lengths(header_lines), 3
+    )
+    assert len(owned_ranges) == 3
+    assert [owned_stop for _, _, _, owned_stop in owned_ranges[:-1]] == [
+        owned_start for _, _, owned_start, _ in owned_ranges[1:]
+    ]
+    assert any(
+        stop > next_start
+        for (_, stop, _, _), (next_start, _, _, _) in zip(
+            owned_ranges, owned_ranges[1:]
+        )
+    )
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file_parallel(
+        sam_tsv_file
+    )
+    for workers in [1, 3]:
+        shared_results = evaluate_sam_file_shared(sorted_sam_file, workers)
+        try:
+            assert shared_results == (variant_to_read_depth, position_to_read_depth)
+            assert len(shared_results[1]) == len(position_to_read_depth)
+        finally:
+            shared_results[1].close(unlink=True)
+
+
+def test_evaluate_sam_file_shared_counts_reads_once(tmp_path):
+    """
+    The alignments in the overlap of two byte ranges are read by both workers but
+    counted by the one owning their position, the read and rejection counts match a
+    single process
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    write_sorted_sam_file_with_header(sorted_sam_file)
+    read_filter = ReadFilter(min_mapq=1)
+    counts = []
+    for shared_memory in [False, True]:
+        metrics = reset_pipeline_metrics()
+        variant_to_read_depth, position_to_read_depth = evaluate_sam_file(
+            sorted_sam_file, 3, shared_memory=shared_memory, read_filter=read_filter
+        )
+        # The public api copies the coverage out of the shared arrays it frees
+        assert type(position_to_read_depth) is CoverageAccumulator
+        counts.append((metrics.reads, metrics.bases, metrics.rejected_reads))
+    assert counts[0] == counts[1]
+    assert counts[0][0] == 1
+    assert counts[0][2] == {"mapq": 6}
+
+
+def test_evaluate_sam_file_shared_needs_sorted_sam(tmp_path):
+    """
+    The positions a worker owns are only complete in coordinate sorted input, with @SQ
+    lengths to size the arrays
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    write_sorted_sam_file_with_header(sorted_sam_file)
+    with open(sorted_sam_file) as in_file:
+        sam_lines = in_file.readlines()
+    with open(sorted_sam_file, "w") as out_file:
+        out_file.writelines(sam_lines[:-2] + sam_lines[-1:] + sam_lines[-2:-1])
+    with pytest.raises(ValueError, match="not sorted"):
+        evaluate_sam_file_shared(sorted_sam_file)
+    with pytest.raises(ValueError, match="@SQ"):
+        evaluate_sam_file_shared(sam_tsv_file)
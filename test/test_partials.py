@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from src.variant_calling.partials import (
+    PartialFile,
+    merge_depth_run_streams,
+    merge_variant_streams,
+    write_partial_file,
+)
+from src.variant_calling.regions import RegionSet, parse_region_string
+from src.variant_calling.variant_calling import (
+    call_variants_on_sam_file,
+    evaluate_sam_file,
+    merge_partial_files,
+)
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_merge_depth_run_streams():
+    """
+    Overlapping runs add up, runs that meet at the same depth are joined
+    """
+    assert list(
+        merge_depth_run_streams([[(1, 5, 1), (8, 10, 2)], [(3, 8, 1), (9, 12, 1)], []])
+    ) == [(1, 3, 1), (3, 5, 2), (5, 8, 1), (8, 9, 2), (9, 10, 3), (10, 12, 1)]
+    assert list(merge_depth_run_streams([[(1, 3, 2)], [(3, 5, 2)]])) == [(1, 5, 2)]
+    variant_streams = [[(4, "A", "G", 1), (9, "C", "T", 2)], [(4, "A", "G", 3)]]
+    assert list(merge_variant_streams(variant_streams)) == [
+        (4, "A", "G", 4),
+        (9, "C", "T", 2),
+    ]
+
+
+def test_partial_file_round_trip(tmp_path, monkeypatch):
+    """
+    A partial reads back the sorted runs and variants of every chromosome, a block of
+    rows at a time
+    """
+    monkeypatch.setattr("src.variant_calling.partials.PARTIAL_BLOCK_ROWS", 2)
+    partial_file = str(tmp_path / "sample.partial")
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(sam_tsv_file)
+    write_partial_file(variant_to_read_depth, position_to_read_depth, partial_file)
+    with PartialFile(partial_file) as partial:
+        assert list(partial.reference_lengths) == [
+            "chr12",
+            "chr1",
+            "chr9",
+            "chr19",
+            "chr15",
+        ]
+        assert [
+            ("chr19", *depth_run) for depth_run in partial.iter_depth_runs("chr19")
+        ] == [
+            depth_run
+            for depth_run in position_to_read_depth.iter_depth_runs()
+            if depth_run[0] == "chr19"
+        ]
+        assert list(partial.iter_variants("chr19")) == sorted(
+            (pos, ref, alt, read_depth)
+            for chrom, pos, ref, alt, read_depth in variant_to_read_depth.iter_counts()
+            if chrom == "chr19"
+        )
+        assert list(partial.iter_depth_runs("chr2")) == []
+
+
+def test_merge_partial_files(tmp_path):
+    """
+    The partials of two lanes merge into the outputs of one run on all alignments
+    """
+    with open(sam_tsv_file) as in_file:
+        header, *sam_lines = in_file.readlines()
+    for lane, lane_lines in enumerate([sam_lines[:4], sam_lines[4:]]):
+        with open(tmp_path / f"lane{lane}.tsv", "w") as out_file:
+            out_file.writelines([header, *lane_lines])
+        call_variants_on_sam_file(
+            str(tmp_path / f"lane{lane}.tsv"),
+            str(tmp_path / f"lane{lane}.variants.tsv"),
+            str(tmp_path / f"lane{lane}.coverage.tsv"),
+            partial_out_file=str(tmp_path / f"lane{lane}.partial"),
+        )
+    merge_partial_files(
+        [str(tmp_path / "lane0.partial"), str(tmp_path / "lane1.partial")],
+        str(tmp_path / "merged.variants.tsv"),
+        str(tmp_path / "merged.coverage.tsv"),
+    )
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "variants.tsv"),
+        str(tmp_path / "coverage.tsv"),
+    )
+    for out_file in ["variants.tsv", "coverage.tsv"]:
+        with open(tmp_path / f"merged.{out_file}") as merged_file:
+            merged_lines = merged_file.readlines()
+        with open(tmp_path / out_file) as single_run_file:
+            single_run_lines = single_run_file.readlines()
+        assert merged_lines[0] == single_run_lines[0]
+        assert sorted(merged_lines) == sorted(single_run_lines)
+
+
+def test_merge_partial_files_of_other_regions(tmp_path):
+    """
+    Partials evaluated over other regions are not merged
+    """
+    chr12 = RegionSet([parse_region_string("chr12")])
+    for name, regions in [("all", None), ("chr12", chr12)]:
+        call_variants_on_sam_file(
+            sam_tsv_file,
+            str(tmp_path / f"{name}.variants.tsv"),
+            str(tmp_path / f"{name}.coverage.tsv"),
+            regions=regions,
+            partial_out_file=str(tmp_path / f"{name}.partial"),
+        )
+    with pytest.raises(ValueError):
+        merge_partial_files(
+            [str(tmp_path / "all.partial"), str(tmp_path / "chr12.partial")],
+            str(tmp_path / "merged.variants.tsv"),
+            str(tmp_path / "merged.coverage.tsv"),
+        )
@@ -0,0 +1,48 @@
+import os
+import threading
+
+import pytest
+
+from src.variant_calling.instrumentation import reset_pipeline_metrics
+from src.variant_calling.pipeline import evaluate_sam_file_pipelined
+from src.variant_calling.variant_calling import evaluate_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_evaluate_sam_file_pipelined(monkeypatch):
+    """
+    Blocks of a few lines called on a pool add up to the totals of a single process,
+    both queues between the stages are measured
+    """
+    monkeypatch.setattr("src.variant_calling.pipeline.PIPELINE_BLOCK_SIZE", 500)
+    metrics = reset_pipeline_metrics()
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file_pipelined(
+        sam_tsv_file, workers=2
+    )
+    assert metrics.reads == 7
+    assert set(metrics.queues) == {"read blocks", "block results"}
+    assert metrics.queues["read blocks"].puts > 3
+    assert metrics.queues["read blocks"].capacity == 4
+    assert (variant_to_read_depth, position_to_read_depth) == evaluate_sam_file(
+        sam_tsv_file
+    )
+    assert list(variant_to_read_depth) == list(evaluate_sam_file(sam_tsv_file)[0])
+
+
+def evaluate_failing_sam_block(sam_block, regions, read_filter=None):
+    raise ValueError("Failed to call a block")
+
+
+def test_pipeline_stops_on_a_failed_block(monkeypatch):
+    """
+    A worker failure is raised promptly and leaves no stage thread blocked on a queue
+    """
+    monkeypatch.setattr("src.variant_calling.pipeline.PIPELINE_BLOCK_SIZE", 100)
+    monkeypatch.setattr(
+        "src.variant_calling.pipeline.evaluate_sam_block", evaluate_failing_sam_block
+    )
+    stage_threads = threading.active_count()
+    with pytest.raises(ValueError, match="Failed to call a block"):
+        evaluate_sam_file_pipelined(sam_tsv_file, workers=1)
+    assert threading.active_count() == stage_threads
@@ -0,0 +1,77 @@
+import os
+from typing import Dict
+
+import pytest
+
+from src.variant_calling.instrumentation import reset_pipeline_metrics
+from src.variant_calling.read_filters import ReadFilter, SamFlag, parse_flag_mask
+from src.variant_calling.sam_reader import SamRecord
+from src.variant_calling.variant_calling import evaluate_sam_file, parse_sam_flag
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_parse_sam_flag():
+    """
+    By default the reverse complement bit, any mask of bits when given one
+    """
+    assert not parse_sam_flag(0)
+    assert parse_sam_flag(16)
+    assert parse_sam_flag(0x53)
+    assert not parse_sam_flag(0x400)
+    assert parse_sam_flag(0x904, SamFlag.UNMAP | SamFlag.SECONDARY)
+    assert not parse_sam_flag(0x104, SamFlag.UNMAP | SamFlag.SUPPLEMENTARY)
+
+
+def test_parse_flag_mask():
+    assert parse_flag_mask("1796") == 0x704
+    assert parse_flag_mask("0x904") == 0x904
+    assert parse_flag_mask("unmap,SECONDARY,SUPPLEMENTARY") == 0x904
+    with pytest.raises(ValueError, match="Unknown sam flag"):
+        parse_flag_mask("UNMAPPED")
+
+
+def test_read_filter_counts_rejections():
+    """
+    Each rejected alignment is counted once, under the first filter that rejects it
+    """
+    sam_records = [
+        SamRecord(f"read{index}\t{flag}\tchr1\t100\t{mapq}\t*")
+        for index, (flag, mapq) in enumerate(
+            [(0x3, 60), (0x1, 60), (0x403, 60), (0x503, 0), (0x13, 0), (0x13, 30)]
+        )
+    ]
+    rejected_reads: Dict[str, int] = {}
+    read_filter = ReadFilter(
+        required_flags=SamFlag.PAIRED | SamFlag.PROPER_PAIR,
+        excluded_flags=SamFlag.SECONDARY | SamFlag.DUP,
+        min_mapq=20,
+    )
+    assert read_filter.filter_sam_records(sam_records, rejected_reads) == [
+        sam_records[0],
+        sam_records[5],
+    ]
+    assert rejected_reads == {
+        "required flags": 1,
+        "flag SECONDARY": 1,
+        "flag DUP": 1,
+        "mapq": 1,
+    }
+
+
+def test_evaluate_sam_file_with_read_filter(tmp_path):
+    """
+    Filtered alignments are left out as if they were not in the input
+    """
+    metrics = reset_pipeline_metrics()
+    with open(sam_tsv_file) as in_file:
+        header, *sam_lines = in_file.readlines()
+    mapped_sam_file = str(tmp_path / "mapq.tsv")
+    with open(mapped_sam_file, "w") as out_file:
+        out_file.writelines(
+            [header, *[line for line in sam_lines if line.split("\t")[4] != "0"]]
+        )
+    assert evaluate_sam_file(
+        sam_tsv_file, read_filter=ReadFilter(min_mapq=1)
+    ) == evaluate_sam_file(mapped_sam_file)
+    assert metrics.rejected_reads == {"mapq": 6}
@@ -0,0 +1,45 @@
+from src.variant_calling.regions import (
+    CHROM_END,
+    RegionSet,
+    parse_region_string,
+    read_bed_regions,
+)
+from src.variant_calling.variant_calling import GenomicRegion
+
+
+def test_parse_region_string():
+    assert parse_region_string("chr19:71,000-80,000") == GenomicRegion(
+        "chr19", 71000, 80000
+    )
+    assert parse_region_string("chr19:71000") == GenomicRegion(
+        "chr19", 71000, CHROM_END
+    )
+    assert parse_region_string("chr19") == GenomicRegion("chr19", 1, CHROM_END)
+
+
+def test_read_bed_regions(tmp_path):
+    """
+    BED intervals are zero based and half open
+    """
+    bed_file = tmp_path / "panel.bed"
+    bed_file.write_text("track name=panel\nchr1\t99\t200\tgene_a\n")
+    assert read_bed_regions(str(bed_file)) == [GenomicRegion("chr1", 100, 200)]
+
+
+def test_region_set():
+    """
+    Overlapping and adjacent regions are merged
+    """
+    regions = RegionSet(
+        [
+            GenomicRegion("chr1", 100, 200),
+            GenomicRegion("chr1", 150, 300),
+            GenomicRegion("chr1", 301, 310),
+            GenomicRegion("chr1", 500, 600),
+        ]
+    )
+    assert regions.intervals == {"chr1": [(100, 310), (500, 600)]}
+    assert regions.overlaps("chr1", 50, 100)
+    assert regions.overlaps("chr1", 550, 1000)
+    assert not regions.overlaps("chr1", 311, 499)
+    assert not regions.contains("chr2", 150)
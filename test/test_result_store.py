@@ -0,0 +1,98 @@
+import os
+import shutil
+
+import pytest
+
+from src.variant_calling.models import GenomicRegion
+from src.variant_calling.partials import PartialFile
+from src.variant_calling.read_filters import ReadFilter
+from src.variant_calling.regions import RegionSet
+from src.variant_calling.result_store import hash_input_file
+from src.variant_calling.variant_calling import (
+    call_variants_on_sam_file,
+    evaluate_sam_file,
+)
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_result_store_top_up(tmp_path):
+    """
+    A top-up adds its reads to the stored totals, an input applied again under another
+    name is recognised by its content and not counted twice
+    """
+    with open(sam_tsv_file) as in_file:
+        header, *sam_lines = in_file.readlines()
+    run_files = []
+    for run, run_lines in enumerate([sam_lines[:3], sam_lines[3:]]):
+        run_files.append(str(tmp_path / f"run{run}.tsv"))
+        with open(run_files[-1], "w") as out_file:
+            out_file.writelines([header, *run_lines])
+    shutil.copy(run_files[0], tmp_path / "run0_copy.tsv")
+    result_store = str(tmp_path / "sample.store")
+    for run_file in [*run_files, str(tmp_path / "run0_copy.tsv")]:
+        call_variants_on_sam_file(
+            run_file,
+            str(tmp_path / "variants.tsv"),
+            str(tmp_path / "coverage.tsv"),
+            result_store=result_store,
+        )
+    with PartialFile(result_store) as store:
+        assert store.applied_inputs == [
+            hash_input_file(run_file) for run_file in run_files
+        ]
+        assert store.read_totals() == evaluate_sam_file(sam_tsv_file)
+    call_variants_on_sam_file(
+        sam_tsv_file, str(tmp_path / "all_variants.tsv"), str(tmp_path / "all.tsv")
+    )
+    with open(tmp_path / "coverage.tsv") as store_file, open(
+        tmp_path / "all.tsv"
+    ) as single_run_file:
+        assert sorted(store_file) == sorted(single_run_file)
+
+
+def test_result_store_refuses_other_parameters(tmp_path):
+    """
+    A store only takes inputs evaluated with the regions and read filter of its totals,
+    an input already applied is refused as well rather than reported under them
+    """
+    regions = RegionSet([GenomicRegion("chr19", 1, 100000)])
+    read_filter = ReadFilter(min_mapq=30)
+    result_store = str(tmp_path / "sample.store")
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "variants.tsv"),
+        str(tmp_path / "coverage.tsv"),
+        regions=regions,
+        result_store=result_store,
+        read_filter=read_filter,
+    )
+    with PartialFile(result_store) as store:
+        assert store.parameters == {
+            "regions": {"chr19": [[1, 100000]]},
+            "read_filter": {"required_flags": 0, "excluded_flags": 0, "min_mapq": 30},
+        }
+    for other_regions, other_read_filter in [
+        (None, read_filter),
+        (RegionSet([GenomicRegion("chr19", 1, 200000)]), read_filter),
+        (regions, None),
+    ]:
+        with pytest.raises(ValueError, match="other regions or another read filter"):
+            call_variants_on_sam_file(
+                sam_tsv_file,
+                str(tmp_path / "variants.tsv"),
+                str(tmp_path / "coverage.tsv"),
+                regions=other_regions,
+                result_store=result_store,
+                read_filter=other_read_filter,
+            )
+    call_variants_on_sam_file(
+        sam_tsv_file,
+        str(tmp_path / "variants.tsv"),
+        str(tmp_path / "coverage.tsv"),
+        regions=regions,
+        result_store=result_store,
+        read_filter=read_filter,
+    )
+    with PartialFile(result_store) as store:
+        assert store.applied_inputs == [hash_input_file(sam_tsv_file)]
@@ -0,0 +1,81 @@
+from src.variant_calling.sam_reader import (
+    SamBytesRecord,
+    SamRecord,
+    iter_sam_line_bytes,
+    split_sam_file,
+)
+from src.variant_calling.variant_calling import (
+    Variant,
+    variant_calling_for_one_sam_record,
+)
+
+sam_line = (
+    "test_read\t0\tchr15\t102500878\t0\t76M\t*\t0\t0\t"
+    "TGCTGGACTTTGGACTGATGATGCTCTTTTTAAAAAGAAAAACTTTTTAAAAAAGCCTCTTTTCTTTCTTTTTACCA\t"
+    "DFEFFFHHHHGIHGIJJJJJIJJJJJJJJJJJIJJJIGJJIIIJJJIJIJJJIIIGHGIIIHHDGHHHFFFFDCB@\t"
+)
+
+
+def test_sam_record_fields():
+    sam_record = SamRecord(sam_line + "NM:i:1\tMD:Z:36T36\tAS:i:71\n")
+    assert sam_record.read_name == "test_read"
+    assert (sam_record.chrom, sam_record.pos, sam_record.flag) == (
+        "chr15",
+        102500878,
+        0,
+    )
+    assert sam_record.cigar_ops == [(76, "M")]
+    assert sam_record.qual.startswith(b"DFEFFF")
+    assert sam_record.get_tag("NM") == 1
+    assert sam_record.md == "36T36"
+    assert sam_record["MD"] == "MD:Z:36T36"
+
+
+def test_sam_record_tag_order():
+    """
+    Tags are found by their key whatever order the aligner wrote them in
+    """
+    sam_record = SamRecord(sam_line + "MD:Z:36T36\tXS:i:0\n")
+    assert sam_record.md == "36T36"
+    assert sam_record.get_tag("NM") is None
+    assert variant_calling_for_one_sam_record(sam_record) == {
+        Variant(chrom="chr15", pos=102500914, ref="T", alt="G")
+    }
+    assert SamRecord(sam_line.rstrip("\t")).md == ""
+
+
+def test_sam_bytes_record_matches_sam_record():
+    tags = "NM:i:1\tMD:Z:36T36\tAS:i:71"
+    sam_record = SamRecord(sam_line + tags)
+    sam_bytes_record = SamBytesRecord((sam_line + tags).encode())
+    for field in ["read_name", "chrom", "pos", "flag", "mapq", "cigar_ops", "seq"]:
+        assert getattr(sam_bytes_record, field) == getattr(sam_record, field)
+    assert sam_bytes_record.qual == sam_record.qual
+    assert sam_bytes_record.md == "36T36"
+    assert sam_bytes_record.get_tag("AS") == 71
+    assert sam_bytes_record.get_tag("XS") is None
+    assert sam_bytes_record["MD"] == "MD:Z:36T36"
+    assert sam_bytes_record["RNAME"] == "chr15"
+    assert variant_calling_for_one_sam_record(
+        sam_bytes_record
+    ) == variant_calling_for_one_sam_record(sam_record)
+
+
+def test_iter_sam_line_bytes_shards(tmp_path, monkeypatch):
+    """
+    The lines of every shard together are the lines of the file, whatever the block size
+    """
+    monkeypatch.setattr("src.variant_calling.sam_reader.SAM_READ_BLOCK_SIZE", 7)
+    sam_file = tmp_path / "test.sam"
+    lines = [f"read{index}\t{'A' * (index % 5)}".encode() for index in range(40)]
+    sam_file.write_bytes(b"\n".join(lines) + b"\n")
+    for shard_count in [1, 3, 8]:
+        shard_lines = [
+            line
+            for start, stop in split_sam_file(str(sam_file), 0, shard_count)
+            for line in iter_sam_line_bytes(str(sam_file), start, stop)
+        ]
+        assert shard_lines == lines
+    empty_file = tmp_path / "empty.sam"
+    empty_file.write_bytes(b"")
+    assert list(iter_sam_line_bytes(str(empty_file), 0, 0)) == []
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from src.variant_calling.sam_reader import SamRecord
+from src.variant_calling.streaming import (
+    StreamingPileup,
+    evaluate_sam_file_streaming,
+    iter_position_result_batches,
+)
+from src.variant_calling.variant_calling import (
+    GenomicPosition,
+    call_variants_on_sam_file,
+    evaluate_sam_file,
+)
+
+from .test_bam import write_bam_file
+from .test_index import write_sorted_sam_file
+
+sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+
+
+def test_streaming_matches_batch(tmp_path):
+    """
+    Streaming a sorted sam or BAM file reports the same depths as the batch evaluation,
+    positions come out in order
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    bam_file = str(tmp_path / "sorted.bam")
+    write_sorted_sam_file(sorted_sam_file)
+    write_bam_file(bam_file, sorted_sam_file)
+    variant_to_read_depth, position_to_read_depth = evaluate_sam_file(sam_tsv_file)
+    for sorted_file in [sorted_sam_file, bam_file]:
+        position_results = list(evaluate_sam_file_streaming(sorted_file))
+        assert {
+            GenomicPosition(result.chrom, result.pos): result.read_depth
+            for result in position_results
+        } == position_to_read_depth
+        assert {
+            variant: variant_read_depth
+            for result in position_results
+            for variant, variant_read_depth in result.variant_read_depths
+        } == variant_to_read_depth
+        for result, next_result in zip(position_results, position_results[1:]):
+            if result.chrom == next_result.chrom:
+                assert result.pos < next_result.pos
+
+
+def test_position_result_batches(tmp_path):
+    """
+    Streams of sam or BAM data and iterables of records give the positions of a file
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    bam_file = str(tmp_path / "sorted.bam")
+    write_sorted_sam_file(sorted_sam_file)
+    write_bam_file(bam_file, sorted_sam_file)
+    position_results = list(evaluate_sam_file_streaming(sorted_sam_file))
+    with open(sorted_sam_file) as in_file:
+        sam_records = [
+            SamRecord(line) for line in in_file if not line.startswith(("@", "QNAME"))
+        ]
+    with open(sorted_sam_file, "rb") as sam_stream, open(bam_file, "rb") as bam_stream:
+        for alignments in [sam_stream, bam_stream, sam_records]:
+            batches = list(iter_position_result_batches(alignments))
+            assert all(batches)
+            assert [result for batch in batches for result in batch] == position_results
+
+
+def test_streaming_bedgraph_output(tmp_path):
+    """
+    Streaming and batch runs write the same bedGraph coverage
+    """
+    sorted_sam_file = str(tmp_path / "sorted.sam")
+    write_sorted_sam_file(sorted_sam_file)
+    for streaming in [False, True]:
+        call_variants_on_sam_file(
+            sorted_sam_file,
+            str(tmp_path / f"variants_{streaming}.tsv"),
+            str(tmp_path / f"coverage_{streaming}.bedgraph"),
+            streaming=streaming,
+            coverage_format="bedgraph",
+        )
+    with open(tmp_path / "coverage_False.bedgraph") as in_file:
+        bedgraph_lines = in_file.readlines()
+    with open(tmp_path / "coverage_True.bedgraph") as in_file:
+        assert in_file.readlines() == bedgraph_lines
+    assert bedgraph_lines[0] == "chr1\t30194\t30270\t1\n"
+
+
+def test_streaming_rejects_unsorted_input():
+    """
+    Unsorted input and alignments reaching back past the window are errors
+    """
+    with pytest.raises(ValueError, match="not sorted"):
+        list(evaluate_sam_file_streaming(sam_tsv_file))
+    streaming_pileup = StreamingPileup(lookbehind=0)
+    forward_record = {
+        "RNAME": "chr1",
+        "POS": "1000",
+        "FLAG": "0",
+        "CIGAR": "4M",
+        "SEQ": "ACGT",
+        "QUAL": "IIII",
+        "MD": "MD:Z:4",
+    }
+    list(streaming_pileup.add_records([forward_record]))
+    with pytest.raises(ValueError, match="increase the lookbehind"):
+        list(streaming_pileup.add_records([{**forward_record, "FLAG": "16"}]))
@@ -0,0 +1,27 @@
+from src.variant_calling.tokenizers import (
+    cached_tokenize_cigar,
+    clear_tokenizer_caches,
+    get_tokenizer_cache_info,
+    tokenize_cigar,
+    tokenize_md,
+)
+
+
+def test_tokenize_md():
+    """
+    Mismatches and deletions are tokens of their own, the trailing matches end as "N"
+    """
+    assert tokenize_md("MD:Z:67C8") == ((67, "C"), (8, "N"))
+    assert tokenize_md("MD:Z:10^AC0T5") == ((10, "^AC"), (0, "T"), (5, "N"))
+    assert tokenize_md("MD:Z:76") == ((76, "N"),)
+
+
+def test_cached_tokenize_cigar():
+    """
+    Repeated cigars are served from the cache
+    """
+    clear_tokenizer_caches()
+    assert tokenize_cigar("5S66M2I3M") == ((5, "S"), (66, "M"), (2, "I"), (3, "M"))
+    for _ in range(3):
+        assert cached_tokenize_cigar("76M") == ((76, "M"),)
+    assert get_tokenizer_cache_info()["cigar"] == (2, 1)
@@ -3,8 +3,11 @@ import os
 from src.variant_calling.variant_calling import (
     GenomicPosition,
     Variant,
+    evaluate_base_counts,
     evaluate_sam_file,
     get_coverage_data_for_one_sam_record,
+    get_coverage_intervals,
+    get_covered_variants,
     variant_calling_for_one_sam_record,
 )
 
@@ -278,6 +281,41 @@ def test_get_coverage_data_for_one_sam_record_complex_cigar():
     )
 
 
+def test_get_coverage_intervals_low_quality_run():
+    """
+    Low quality bases split a matched block into separate intervals, reverse complemented
+    alignments walk the reference backwards
+    """
+    qual_mask = bytes([1, 1, 0, 0, 1, 1, 1, 1])
+    assert get_coverage_intervals(100, False, [(8, "M")], qual_mask) == [
+        (100, 102),
+        (104, 108),
+    ]
+    assert get_coverage_intervals(100, True, [(8, "M")], qual_mask) == [
+        (99, 101),
+        (93, 97),
+    ]
+
+
+def test_get_covered_variants():
+    """
+    Variants on low quality bases are dropped and do not move the later positions,
+    variants outside the covered intervals are dropped
+    """
+    md_tokens = [(2, "A"), (3, "C"), (1, "G"), (4, "N")]
+    qual = b"III#IIIIII"
+    seq = "ACGTTGCAAC"
+    assert get_covered_variants(
+        "chr1", 100, False, md_tokens, seq, qual, [(100, 104), (105, 111)]
+    ) == [Variant("chr1", 102, "A", "G"), Variant("chr1", 103, "G", "C")]
+    assert get_covered_variants(
+        "chr1", 100, False, md_tokens, seq, qual, [(100, 103)]
+    ) == [Variant("chr1", 102, "A", "G")]
+    assert get_covered_variants(
+        "chr1", 100, True, md_tokens, seq, qual, [(97, 101)]
+    ) == [Variant("chr1", 98, "A", "C"), Variant("chr1", 97, "G", "G")]
+
+
 ############################## End-end tests ###################################
 # These tests are broader in scope than the strict unit tests above, they have
 # input files checked into the repository
@@ -811,3 +849,18 @@ def test_evaluate_evaluate_sam_file():
         GenomicPosition(chrom="chr15", pos=102500875): 1,
         GenomicPosition(chrom="chr15", pos=102500820): 1,
     }
+
+
+def test_evaluate_base_counts():
+    """
+    The base counts of every position add up to its read depth
+    """
+    sam_tsv_file = os.path.dirname(__file__) + "/test_sam_file.tsv"
+    _, position_to_read_depth = evaluate_sam_file(sam_tsv_file)
+    base_counts = evaluate_base_counts(sam_tsv_file)
+    assert {
+        GenomicPosition(chrom, pos): sum(counts)
+        for chrom, pos, counts in base_counts.iter_base_counts()
+    } == position_to_read_depth
+    # The reverse strand read at chr15:102500878 counts the complement of its bases
+    assert base_counts.base_counts("chr15", 102500878) == (1, 0, 0, 0, 0)
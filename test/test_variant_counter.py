@@ -0,0 +1,43 @@
+import pickle
+
+from src.variant_calling.models import Variant
+from src.variant_calling.variant_counter import VariantCounter
+
+
+def test_variant_counter_mapping():
+    variant_counter = VariantCounter()
+    variant_counter.add_alleles("chr2", [(100, "A", "G"), (-3, "^AC", "T")])
+    variant_counter.add_alleles("chr1", [(100, "A", "G")])
+    variant_counter.add_alleles("chr2", [(100, "A", "G")])
+    assert variant_counter == {
+        Variant("chr2", 100, "A", "G"): 2,
+        Variant("chr2", -3, "^AC", "T"): 1,
+        Variant("chr1", 100, "A", "G"): 1,
+    }
+    assert list(variant_counter.iter_counts())[1] == ("chr2", -3, "^AC", "T", 1)
+    assert Variant("chr3", 100, "A", "G") not in variant_counter
+    assert Variant("chr2", 100, "G", "A") not in variant_counter
+    assert variant_counter.subset(lambda chrom, pos: pos > 0) == {
+        Variant("chr2", 100, "A", "G"): 2,
+        Variant("chr1", 100, "A", "G"): 1,
+    }
+    assert variant_counter.pop_variants("chr2", 100) == [
+        (Variant("chr2", -3, "^AC", "T"), 1)
+    ]
+    assert len(variant_counter) == 2
+
+
+def test_variant_counter_merge():
+    """
+    Counters filled in other processes intern their chromosomes and alleles in their own
+    order, merging goes through the values rather than the ids
+    """
+    variant_counter = VariantCounter({Variant("chr1", 5, "C", "T"): 1})
+    other_variant_counter = VariantCounter()
+    other_variant_counter.add_alleles("chr9", [(7, "N", "A")])
+    other_variant_counter.add_alleles("chr1", [(5, "C", "T")])
+    variant_counter.merge(pickle.loads(pickle.dumps(other_variant_counter)))
+    assert dict(variant_counter.items()) == {
+        Variant("chr1", 5, "C", "T"): 2,
+        Variant("chr9", 7, "N", "A"): 1,
+    }